@@ -13,7 +13,11 @@ class WishlistAdmin(ImportExportModelAdmin):
 class NotificationAdmin(ImportExportModelAdmin):
     list_display = ['user', 'type', 'seen', 'date']
 
+class CustomerSummaryAdmin(admin.ModelAdmin):
+    list_display = ['user', 'orders_count', 'total_spent', 'unseen_notifications']
+    search_fields = ['user__username', 'user__email']
+
 admin.site.register(customer_models.Address, AddressAdmin)
 admin.site.register(customer_models.Wishlist, WishlistAdmin)
 admin.site.register(customer_models.Notifications, NotificationAdmin)
-
+admin.site.register(customer_models.CustomerSummary, CustomerSummaryAdmin)
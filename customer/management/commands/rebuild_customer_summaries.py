@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from customer import summary
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики кабинета покупателей (заказы, потрачено, непрочитанные уведомления)"
+
+    def handle(self, *args, **options):
+        rows = summary.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f"Счётчики пересчитаны для {rows} покупателей"))
@@ -0,0 +1,52 @@
+# Generated manually
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+import django.db.models.deletion
+
+
+def fill_summaries(apps, schema_editor):
+    """Начальные значения счётчиков по существующим заказам и уведомлениям"""
+    CustomerSummary = apps.get_model('customer', 'CustomerSummary')
+    Notifications = apps.get_model('customer', 'Notifications')
+    Order = apps.get_model('store', 'Order')
+
+    rows = {}
+    for user_id, orders_count, total_spent in (
+        Order.objects.filter(customer__isnull=False).values('customer_id').annotate(
+            n=Count('id'), spent=Sum('total', filter=Q(payment_status="Paid")),
+        ).order_by().values_list('customer_id', 'n', 'spent')
+    ):
+        rows[user_id] = CustomerSummary(user_id=user_id, orders_count=orders_count, total_spent=total_spent or 0)
+    for user_id, unseen in (
+        Notifications.objects.filter(user__isnull=False, seen=False).values('user_id').annotate(
+            n=Count('id'),
+        ).order_by().values_list('user_id', 'n')
+    ):
+        rows.setdefault(user_id, CustomerSummary(user_id=user_id)).unseen_notifications = unseen
+    CustomerSummary.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('customer', '0005_alter_address_options_alter_notifications_options_and_more'),
+        ('store', '0030_order_customer_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='customer_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Заказы')),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0.0, help_text='Сумма оплаченных заказов', max_digits=14, verbose_name='Потрачено')),
+                ('unseen_notifications', models.PositiveIntegerField(default=0, verbose_name='Непрочитанные уведомления')),
+            ],
+            options={
+                'verbose_name_plural': 'Сводки покупателей',
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+# Generated manually
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0006_customersummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notifications',
+            index=models.Index(fields=['user', 'seen'], name='customer_no_user_id_49549f_idx'),
+        ),
+    ]
@@ -50,6 +50,30 @@ class Notifications(models.Model):
     
     class Meta:
         verbose_name_plural = "Уведомления"
+        indexes = [
+            # Непрочитанные уведомления пользователя
+            models.Index(fields=['user', 'seen']),
+        ]
     
     def __str__(self):
         return self.type
+
+
+class CustomerSummary(models.Model):
+    """
+    Счётчики покупателя для личного кабинета (customer.summary)
+
+    Обновляются при записи: создании и удалении заказа, оплате, создании и
+    прочтении уведомлений. Полный пересчёт - команда rebuild_customer_summaries.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="customer_summary")
+    orders_count = models.PositiveIntegerField(default=0, verbose_name="Заказы")
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0.00, verbose_name="Потрачено",
+                                      help_text="Сумма оплаченных заказов")
+    unseen_notifications = models.PositiveIntegerField(default=0, verbose_name="Непрочитанные уведомления")
+
+    class Meta:
+        verbose_name_plural = "Сводки покупателей"
+
+    def __str__(self):
+        return str(self.user)
@@ -0,0 +1,73 @@
+"""
+Сигналы покупателя: приращения счётчиков кабинета (customer.summary)
+
+Оплата через store.payments делается UPDATE без сигналов и учитывается там же;
+здесь - создание, удаление и изменения через save().
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from customer import models as customer_models
+from customer import summary
+from store import models as store_models
+from store import notifications
+
+
+def _paid_total(payment_status, total):
+    return total if payment_status == "Paid" else 0
+
+
+@receiver(pre_save, sender=store_models.Order)
+def order_remember_payment(sender, instance, **kwargs):
+    instance._previous_payment = None
+    if instance.pk:
+        instance._previous_payment = sender.objects.filter(pk=instance.pk).values_list(
+            'customer_id', 'payment_status', 'total'
+        ).first()
+
+
+@receiver(post_save, sender=store_models.Order)
+def order_saved(sender, instance, created=False, **kwargs):
+    spent = _paid_total(instance.payment_status, instance.total)
+    previous = getattr(instance, '_previous_payment', None)
+    if created or previous is None:
+        summary.add(instance.customer_id, orders_count=1, total_spent=spent)
+        return
+    previous_customer, previous_status, previous_total = previous
+    if previous_customer != instance.customer_id:
+        summary.add(previous_customer, orders_count=-1, total_spent=-_paid_total(previous_status, previous_total))
+        summary.add(instance.customer_id, orders_count=1, total_spent=spent)
+    else:
+        summary.add(instance.customer_id, total_spent=spent - _paid_total(previous_status, previous_total))
+
+
+@receiver(post_delete, sender=store_models.Order)
+def order_deleted(sender, instance, **kwargs):
+    summary.add(instance.customer_id, orders_count=-1, total_spent=-_paid_total(instance.payment_status, instance.total))
+
+
+@receiver(pre_save, sender=customer_models.Notifications)
+def notification_remember_seen(sender, instance, **kwargs):
+    instance._previous_unseen = None
+    if instance.pk:
+        instance._previous_unseen = sender.objects.filter(pk=instance.pk).values_list('user_id', 'seen').first()
+
+
+@receiver(post_save, sender=customer_models.Notifications)
+def notification_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_unseen', None)
+    deltas = {}
+    if previous and not previous[1]:
+        deltas[previous[0]] = deltas.get(previous[0], 0) - 1
+    if not instance.seen:
+        deltas[instance.user_id] = deltas.get(instance.user_id, 0) + 1
+    for user_id, delta in deltas.items():
+        summary.add(user_id, unseen_notifications=delta)
+    notifications.invalidate(notifications.KIND_CUSTOMER, instance.user_id, previous[0] if previous else None)
+
+
+@receiver(post_delete, sender=customer_models.Notifications)
+def notification_deleted(sender, instance, **kwargs):
+    if not instance.seen:
+        summary.add(instance.user_id, unseen_notifications=-1)
+        notifications.invalidate(notifications.KIND_CUSTOMER, instance.user_id)
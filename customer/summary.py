@@ -0,0 +1,66 @@
+"""
+Счётчики покупателя (CustomerSummary) для личного кабинета
+
+Кабинет читает одну строку вместо Sum/Count по всем заказам и уведомлениям.
+Счётчики меняются приращениями при записи:
+- заказ создан / удалён (сигналы Order): orders_count
+- заказ оплачен (store.payments.finalize_payment или save() в админке): total_spent
+- уведомление создано, прочитано, удалено (сигналы Notifications): unseen_notifications
+
+rebuild_all (команда rebuild_customer_summaries) пересчитывает всё по таблицам.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+FIELDS = ('orders_count', 'total_spent', 'unseen_notifications')
+
+
+def add(user_id, **deltas):
+    """Прибавляет приращения к счётчикам покупателя (строка создаётся при необходимости)"""
+    from customer.models import CustomerSummary
+
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not user_id or not deltas:
+        return
+    with transaction.atomic():
+        CustomerSummary.objects.bulk_create([CustomerSummary(user_id=user_id)], ignore_conflicts=True)
+        CustomerSummary.objects.filter(user_id=user_id).update(
+            **{field: F(field) + value for field, value in deltas.items()}
+        )
+
+
+def get_summary(user):
+    """Счётчики покупателя; без строки - нули (у покупателя ещё ничего нет)"""
+    from customer.models import CustomerSummary
+
+    return CustomerSummary.objects.filter(user=user).first() or CustomerSummary(user=user)
+
+
+def rebuild_all():
+    """Пересчитывает счётчики всех покупателей; возвращает число строк"""
+    from customer.models import CustomerSummary, Notifications
+    from store import models as store_models
+
+    rows = {}
+    for user_id, orders_count, total_spent in (
+        store_models.Order.objects.filter(customer__isnull=False).values('customer_id').annotate(
+            n=Count('id'), spent=Sum('total', filter=Q(payment_status="Paid")),
+        ).order_by().values_list('customer_id', 'n', 'spent')
+    ):
+        row = rows.setdefault(user_id, dict.fromkeys(FIELDS, 0))
+        row['orders_count'] = orders_count
+        row['total_spent'] = total_spent or 0
+    for user_id, unseen in (
+        Notifications.objects.filter(user__isnull=False, seen=False).values('user_id').annotate(
+            n=Count('id'),
+        ).order_by().values_list('user_id', 'n')
+    ):
+        rows.setdefault(user_id, dict.fromkeys(FIELDS, 0))['unseen_notifications'] = unseen
+
+    with transaction.atomic():
+        CustomerSummary.objects.all().delete()
+        CustomerSummary.objects.bulk_create(
+            [CustomerSummary(user_id=user_id, **values) for user_id, values in rows.items()],
+            batch_size=1000,
+        )
+    return len(rows)
@@ -1,3 +1,31 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from store import models as store_models
+from userauths.models import User
+
+
+class OrdersViewTests(TestCase):
+    """История заказов: keyset-пагинация по дате, новые сначала"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create(email='customer@example.com', username='customer')
+        other = User.objects.create(email='other@example.com', username='other')
+        cls.orders = [store_models.Order.objects.create(customer=cls.customer) for _ in range(12)]
+        store_models.Order.objects.create(customer=other)
+
+    def test_lists_orders_page_by_page(self):
+        self.client.force_login(self.customer)
+        url = reverse('customer:orders')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        first = response.context['orders']
+        self.assertIsNotNone(first)
+        self.assertEqual(list(first), self.orders[::-1][:10])
+        self.assertTrue(first.has_next())
+
+        second = self.client.get(url, {'cursor': first.next_cursor}).context['orders']
+        self.assertEqual(list(second), self.orders[::-1][10:])
+        self.assertFalse(second.has_next())
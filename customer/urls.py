@@ -14,6 +14,8 @@ urlpatterns = [
     path("addresses/", views.addresses, name="addresses"),
     path("notis/", views.notis, name="notis"),
     path("mark_noti_seen/<id>/", views.mark_noti_seen, name="mark_noti_seen"),
+    path("mark_all_notis_seen/", views.mark_all_notis_seen, name="mark_all_notis_seen"),
+    path("notis/poll/", views.poll_notis, name="poll_notis"),
     path("address_detail/<id>/", views.address_detail, name="address_detail"),
     path("address_create/", views.address_create, name="address_create"),
     path("delete_address/<id>/", views.delete_address, name="delete_address"),
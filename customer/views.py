@@ -1,32 +1,41 @@
 from django.http import JsonResponse
 from django.shortcuts import redirect, render
 from django.contrib import messages
-from django.db import models
+from django.db.models import Prefetch
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.hashers import check_password
 
-from plugin.paginate_queryset import paginate_queryset
+from plugin.paginate_queryset import paginate_queryset, cursor_paginate
 from store import models as store_models
+from store.context import set_wishlist_count
 from customer import models as customer_models
+from store import notifications
+from customer.summary import get_summary
 from userauths.models import Profile
 
+def customer_orders(user):
+    # Позиции, товары и продавцы всех заказов страницы - фиксированное число запросов
+    items = store_models.OrderItem.objects.select_related('product', 'product__vendor', 'product__vendor__profile')
+    return store_models.Order.objects.filter(customer=user).prefetch_related(
+        Prefetch('orderitem_set', queryset=items)
+    ).order_by('-date', '-id')
+
 @login_required
 def dashboard(request):
-    orders = store_models.Order.objects.filter(customer=request.user)
-    total_spent = store_models.Order.objects.filter(customer=request.user).aggregate(total = models.Sum("total"))['total']
-    notis = customer_models.Notifications.objects.filter(user=request.user, seen=False)
+    orders = customer_orders(request.user)[:5]
+    summary = get_summary(request.user)
 
     context = {
         "orders": orders,
-        "total_spent": total_spent,
-        "notis": notis,
+        "summary": summary,
     }
 
     return render(request, "customer/dashboard.html", context)
 
 @login_required
 def orders(request):
-    orders = store_models.Order.objects.filter(customer=request.user)
+    # Keyset-пагинация: страница не зависит от числа заказов покупателя
+    orders = cursor_paginate(customer_orders(request.user), request.GET.get("cursor"), 10)
 
     context = {
         "orders": orders,
@@ -36,7 +45,7 @@ def orders(request):
 
 @login_required
 def order_detail(request, order_id):
-    order = store_models.Order.objects.get(customer=request.user, order_id=order_id)
+    order = customer_orders(request.user).get(order_id=order_id)
 
     context = {
         "order": order,
@@ -47,7 +56,7 @@ def order_detail(request, order_id):
 @login_required
 def order_item_detail(request, order_id, item_id):
     order = store_models.Order.objects.get(customer=request.user, order_id=order_id)
-    item = store_models.OrderItem.objects.get(order=order, item_id=item_id)
+    item = store_models.OrderItem.objects.select_related('product', 'product__vendor').get(order=order, item_id=item_id)
     
     context = {
         "order": order,
@@ -75,6 +84,7 @@ def wishlist(request):
 def remove_from_wishlist(request, id):
     wishlist = customer_models.Wishlist.objects.get(user=request.user, id=id)
     wishlist.delete()
+    set_wishlist_count(request, customer_models.Wishlist.objects.filter(user=request.user).count())
     
     messages.success(request, "Товар удалён из избранного")
     return redirect("customer:wishlist")
@@ -84,8 +94,10 @@ def add_to_wishlist(request, id):
     if request.user.is_authenticated:
         product = store_models.Product.objects.get(id=id)
         customer_models.Wishlist.objects.create(product=product, user=request.user)
-        wishlist = customer_models.Wishlist.objects.filter(user=request.user)
-        return JsonResponse({"message": "Товар добавлен в избранное", "wishlist_count": wishlist.count()})
+        wishlist_count = customer_models.Wishlist.objects.filter(user=request.user).count()
+        # Keep the header counter in the session (read by the context processor)
+        set_wishlist_count(request, wishlist_count)
+        return JsonResponse({"message": "Товар добавлен в избранное", "wishlist_count": wishlist_count})
     else:
         return JsonResponse({"message": "Пользователь не авторизован", "wishlist_count": "0"})
 
@@ -100,18 +112,36 @@ def notis(request):
     context = {
         "notis": notis,
         "notis_list": notis_list,
+        "unread": notifications.unread_count(notifications.KIND_CUSTOMER, request.user.pk),
     }
     return render(request, "customer/notis.html", context)
 
 @login_required
 def mark_noti_seen(request, id):
-    noti = customer_models.Notifications.objects.get(user=request.user, id=id)
-    noti.seen = True
-    noti.save()
+    if not notifications.mark_seen(notifications.KIND_CUSTOMER, request.user, id):
+        messages.error(request, "Уведомление не найдено")
+        return redirect("customer:notis")
 
     messages.success(request, "Уведомление отмечено как прочитанное")
     return redirect("customer:notis")
 
+@login_required
+def mark_all_notis_seen(request):
+    if request.method == "POST":
+        updated = notifications.mark_all_seen(notifications.KIND_CUSTOMER, request.user)
+        messages.success(request, f"Отмечено как прочитанные: {updated}")
+    return redirect("customer:notis")
+
+@login_required
+def poll_notis(request):
+    # Лёгкий опрос: пока новых уведомлений нет, ответ строится из кэша без запросов к БД
+    try:
+        after = int(request.GET.get("after", 0))
+        wait = int(request.GET.get("wait", 0))
+    except ValueError:
+        after, wait = 0, 0
+    return JsonResponse(notifications.poll(notifications.KIND_CUSTOMER, request.user.pk, after=after, wait=wait))
+
 
 @login_required
 def addresses(request):
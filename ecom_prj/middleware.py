@@ -3,7 +3,6 @@ Middleware for currency localization based on IP
 """
 import logging
 from plugin.currency import get_country_from_ip, get_currency_for_country
-from django.core.cache import cache
 
 logger = logging.getLogger(__name__)
 
@@ -36,16 +35,8 @@ class CurrencyMiddleware:
             else:
                 # Only make API call if not in session
                 try:
-                    # Check cache first
-                    cache_key = f'ip_country_{ip}'
-                    country_code = cache.get(cache_key)
-                    
-                    if not country_code:
-                        # Get country from IP (with timeout and caching)
-                        country_code = get_country_from_ip(ip)
-                        # Cache for 24 hours
-                        if country_code:
-                            cache.set(cache_key, country_code, 86400)
+                    # Get country from IP (cached in the shared cache by get_country_from_ip)
+                    country_code = get_country_from_ip(ip)
                     
                     # Get currency for country
                     currency = get_currency_for_country(country_code)
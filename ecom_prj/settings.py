@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+import sys
 from django.contrib import messages
 
 # Опциональный импорт environs для миграций
@@ -186,15 +187,68 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
-# Cache configuration for currency and IP geolocation
-CACHES = {
-    'default': {
+# Абсолютные ссылки в фидах товаров: схема и домен сайта без "/" в конце
+SITE_URL = env.str('SITE_URL', default='http://127.0.0.1:8000')
+SITE_NAME = env.str('SITE_NAME', default='NEO Store')
+# Фиды для маркетплейсов (`manage.py export_feeds`) пишутся gzip-файлами в MEDIA_ROOT/feeds
+# и отдаются nginx как статика: /media/feeds/google.xml.gz
+FEEDS_DIR = env.str('FEEDS_DIR', default=str(MEDIA_ROOT / 'feeds'))
+# Живой фид /feeds/<name>/ (views.product_feed): персоналу или по этому токену; пусто - только персоналу
+FEEDS_TOKEN = env.str('FEEDS_TOKEN', default='')
+# Sitemap и robots.txt (`manage.py build_sitemaps`, store.sitemaps) - готовые файлы для nginx;
+# отдаются из корня сайта: location ~ ^/(sitemap[\w-]*\.xml(\.gz)?|robots\.txt)$ { root SITEMAPS_DIR; }
+SITEMAPS_DIR = env.str('SITEMAPS_DIR', default=str(BASE_DIR / 'sitemaps'))
+
+# Offline GeoIP: range file built by `manage.py import_geoip`
+GEOIP_DB_PATH = env.str('GEOIP_DB_PATH', default=str(BASE_DIR / 'geoip' / 'country.bin'))
+# Optionally ask ip-api.com for IPs missing from the local database (blocking, up to 500ms).
+# Off by default: without the range file visitors get the default currency, not a network wait
+GEOIP_HTTP_FALLBACK = env.bool('GEOIP_HTTP_FALLBACK', default=False)
+
+# Exchange rates are refreshed by `manage.py refresh_exchange_rates`; if they get older
+# than 6 hours a worker refreshes them in a background thread (never on the request path)
+EXCHANGE_RATES_AUTO_REFRESH = env.bool('EXCHANGE_RATES_AUTO_REFRESH', default=True)
+
+# Cache configuration for currency, IP geolocation and catalog data
+# Двухуровневый кэш (plugin.cache.TieredCache): маленький LRU в процессе перед общим кэшем,
+# чтобы все gunicorn воркеры видели одни и те же курсы, гео-данные и инвалидации.
+# Общий кэш - Redis (REDIS_URL), без него - файловый кэш как локальная замена.
+# Тесты (manage.py test) - кэш в памяти процесса: счётчики, версии и блокировки
+# не переходят между запусками и не смешиваются с dev-сервером
+REDIS_URL = env.str('REDIS_URL', default='')
+TESTING = sys.argv[1:2] == ['test']
+
+if TESTING:
+    SHARED_CACHE = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'LOCATION': 'neostore-tests',
+    }
+elif REDIS_URL:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'neostore',
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env.str('CACHE_DIR', default=str(BASE_DIR / '.cache')),
         'OPTIONS': {
             'MAX_ENTRIES': 10000
         }
     }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'plugin.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED_ALIAS': 'shared',
+            'LOCAL_MAX_ENTRIES': 2000,
+            'LOCAL_TIMEOUT': 10,
+            'LOCAL_NAMESPACES': ['catalog', 'currency', 'geo'],
+        }
+    },
+    'shared': SHARED_CACHE,
 }
 
 AUTH_USER_MODEL = 'userauths.User'
@@ -242,6 +296,7 @@ LOGGING = {
 # Stripe API Keys 
 # STRIPE_PUBLIC_KEY = env("STRIPE_PUBLIC_KEY")
 # STRIPE_SECRET_KEY = env("STRIPE_SECRET_KEY")
+# STRIPE_WEBHOOK_SECRET = env("STRIPE_WEBHOOK_SECRET")
 
 # Paypal API Keys 
 # PAYPAL_CLIENT_ID = env('PAYPAL_CLIENT_ID')
@@ -250,6 +305,7 @@ LOGGING = {
 # Flutterwave Keys
 # FLUTTERWAVE_PUBLIC_KEY=env("FLUTTERWAVE_PUBLIC_KEY")
 # FLUTTERWAVE_PRIVATE_KEY=env("FLUTTERWAVE_PRIVATE_KEY")
+# FLUTTERWAVE_WEBHOOK_HASH=env("FLUTTERWAVE_WEBHOOK_HASH")
 
 # Paystack Keys
 # PAYSTACK_PUBLIC_KEY=env("PAYSTACK_PUBLIC_KEY")
@@ -258,6 +314,14 @@ LOGGING = {
 # Razorpay keys
 # RAZORPAY_KEY_ID=env("RAZORPAY_KEY_ID")
 # RAZORPAY_KEY_SECRET=env("RAZORPAY_KEY_SECRET")
+# RAZORPAY_WEBHOOK_SECRET=env("RAZORPAY_WEBHOOK_SECRET")
+
+# Вебхуки шлюзов: /webhooks/payments/<stripe|paystack|flutterwave|razorpay>/ (подпись Paystack -
+# его секретный ключ). События применяет `manage.py process_payment_events --interval 5`
+
+# Заглушка платёжных шлюзов (store.payments.verify_fake): оплата подтверждается без сети.
+# Только для локальной разработки и нагрузочных проверок, никогда в продакшене
+PAYMENT_FAKE_GATEWAY = env.bool('PAYMENT_FAKE_GATEWAY', default=False)
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -0,0 +1,243 @@
+"""
+Two-tier cache: small per-process LRU (L1) in front of a shared backend (L2)
+
+L2 is any configured Django cache alias (Redis in production, file-based
+cache as a local stand-in), so every gunicorn worker sees the same
+exchange rates, geo lookups and catalog caches and invalidation crosses
+processes. L1 only keeps keys from LOCAL_NAMESPACES for a few seconds to
+skip the network round-trip on hot keys.
+
+Keys are namespaced: use make_key(CATALOG, ...), make_key(CURRENCY, ...) etc.
+Keys in the SYNC namespace (versions, counters, locks) always go to L2.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches, cache as default_cache
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+# Key namespaces
+CATALOG = 'catalog'
+CURRENCY = 'currency'
+GEO = 'geo'
+SESSION = 'session'
+PAYMENTS = 'payments'
+SYNC = 'sync'
+
+_MISSING = object()
+
+
+def make_key(namespace, *parts):
+    """Build a namespaced key, e.g. make_key(GEO, 'ip_country', ip) -> 'geo:ip_country:1.2.3.4'"""
+    return ':'.join([namespace] + [str(part) for part in parts])
+
+
+class LocalLRU:
+    """Thread-safe bounded LRU with per-entry expiry; values are pickled like LocMemCache"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, payload = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+        return pickle.loads(payload)
+
+    def set(self, key, value, ttl):
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TieredCache(BaseCache):
+    """
+    Django cache backend combining a per-process LRU with a shared cache alias
+
+    OPTIONS:
+        SHARED_ALIAS: alias of the shared cache in settings.CACHES (default 'shared')
+        LOCAL_MAX_ENTRIES: L1 size (default 1000)
+        LOCAL_TIMEOUT: max seconds a key lives in L1 (default 10)
+        LOCAL_NAMESPACES: namespaces eligible for L1 (default catalog, currency, geo)
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED_ALIAS', location or 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 10)
+        self.local_namespaces = tuple(options.get('LOCAL_NAMESPACES', (CATALOG, CURRENCY, GEO)))
+        self.local = LocalLRU(options.get('LOCAL_MAX_ENTRIES', 1000))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _local_key(self, key, version):
+        return self.make_and_validate_key(key, version=version)
+
+    def _is_local(self, key):
+        return key.split(':', 1)[0] in self.local_namespaces
+
+    def _local_ttl(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.local_timeout
+        return max(0, min(self.local_timeout, timeout - time.time()))
+
+    def _remember(self, key, value, version, timeout=DEFAULT_TIMEOUT):
+        if self._is_local(key):
+            self.local.set(self._local_key(key, version), value, self._local_ttl(timeout))
+
+    def _forget(self, key, version):
+        self.local.delete(self._local_key(key, version))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._remember(key, value, version, timeout)
+        return added
+
+    def get(self, key, default=None, version=None):
+        if self._is_local(key):
+            value = self.local.get(self._local_key(key, version))
+            if value is not _MISSING:
+                return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            return default
+        self._remember(key, value, version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self._remember(key, value, version, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._forget(key, version)
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        if self._is_local(key) and self.local.get(self._local_key(key, version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._forget(key, version)
+        return self.shared.incr(key, delta=delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._forget(key, version)
+        return self.shared.decr(key, delta=delta, version=version)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        for key in keys:
+            value = self.local.get(self._local_key(key, version)) if self._is_local(key) else _MISSING
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        if remote:
+            fetched = self.shared.get_many(remote, version=version)
+            for key, value in fetched.items():
+                self._remember(key, value, version)
+            found.update(fetched)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout=timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(key, value, version, timeout)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._forget(key, version)
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+
+# ========== STAMPEDE PROTECTION ==========
+
+def get_or_refresh(key, producer, timeout, stale_timeout=None, lock_timeout=30, wait=2.0, cache=None):
+    """
+    Return a cached value, recomputing it with single-flight and stale-while-revalidate
+
+    - fresh value: returned as is
+    - stale value (older than timeout, younger than timeout + stale_timeout):
+      one caller across all processes recomputes it, the others keep serving the stale copy
+    - missing value: one caller computes it, the others wait up to `wait` seconds for it
+
+    The value is stored in an envelope with its soft expiry, so None is a valid value.
+    """
+    cache = cache or default_cache
+    stale_timeout = timeout if stale_timeout is None else stale_timeout
+
+    envelope = cache.get(key)
+    if envelope is not None and envelope['expires'] > time.time():
+        return envelope['value']
+
+    lock_key = make_key(SYNC, 'lock', key)
+    # The shared add() lease is the only lock: no thread blocks while another runs the producer
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            value = producer()
+        except Exception:
+            if envelope is not None:
+                return envelope['value']
+            raise
+        finally:
+            cache.delete(lock_key)
+        cache.set(key, {'value': value, 'expires': time.time() + timeout}, timeout + stale_timeout)
+        return value
+
+    if envelope is not None:
+        # Another thread or worker is revalidating - serve stale
+        return envelope['value']
+
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        time.sleep(0.05)
+        envelope = cache.get(key)
+        if envelope is not None:
+            return envelope['value']
+
+    return producer()
+
+
+def invalidate(key, cache=None):
+    (cache or default_cache).delete(key)
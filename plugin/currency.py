@@ -1,10 +1,27 @@
 """
 Currency localization and conversion based on IP geolocation
 """
+import logging
+import threading
+import time
 from decimal import Decimal, ROUND_DOWN
 import requests
+from django.conf import settings
 from django.core.cache import cache
 
+from plugin.cache import make_key, CURRENCY, GEO, SYNC
+from plugin.geoip import lookup_country
+
+logger = logging.getLogger(__name__)
+
+GEO_CACHE_TIMEOUT = 86400  # 24 hours
+GEO_FAILURE_TIMEOUT = 3600  # 1 hour
+RATES_KEY = make_key(CURRENCY, 'rates')
+RATES_LOCK_KEY = make_key(SYNC, 'lock', 'exchange_rates')
+RATES_MAX_AGE = 21600  # 6 hours, rates don't change that often
+RATES_CHECK_INTERVAL = 60  # how often workers pick up rates refreshed elsewhere
+RATES_LOCK_TIMEOUT = 300  # at most one background refresh attempt per 5 minutes
+
 # Exchange rates (will be updated from API)
 EXCHANGE_RATES = {
     'KGS': Decimal('89.50'),  # 1 USD = 89.50 KGS (сом)
@@ -12,6 +29,10 @@ EXCHANGE_RATES = {
     'USD': Decimal('1.00'),
 }
 
+# Payment gateway currencies (Razorpay, Paystack/Flutterwave): no built-in
+# defaults, amounts are only ever charged at a downloaded rate
+PAYMENT_CURRENCIES = ('INR', 'NGN')
+
 # Currency symbols
 CURRENCY_SYMBOLS = {
     'KGS': 'сом',
@@ -30,8 +51,9 @@ COUNTRY_CURRENCY = {
 
 def get_country_from_ip(ip_address):
     """
-    Get country code from IP address using free API
-    Optimized with caching and fast fallback for local IPs
+    Get country code from IP address
+    Looked up in the local GeoIP range file (plugin.geoip); the HTTP API is
+    only used as an optional fallback (GEOIP_HTTP_FALLBACK) for unknown IPs
     """
     if not ip_address:
         return 'US'
@@ -45,9 +67,21 @@ def get_country_from_ip(ip_address):
         # Local IP, default to Kyrgyzstan for testing
         return 'KG'
     
+    # Local database - microseconds, no network
+    try:
+        country_code = lookup_country(ip_address)
+    except Exception as e:
+        logger.warning(f"GeoIP lookup failed for {ip_address}: {e}")
+        country_code = None
+    if country_code:
+        return country_code
+
+    if not getattr(settings, 'GEOIP_HTTP_FALLBACK', False):
+        return 'US'
+
     # Check cache first
+    cache_key = make_key(GEO, 'ip_country', ip_address)
     try:
-        cache_key = f'ip_country_{ip_address}'
         cached_country = cache.get(cache_key)
         if cached_country:
             return cached_country
@@ -69,14 +103,14 @@ def get_country_from_ip(ip_address):
             country_code = data.get('countryCode', 'US')
             # Cache for 24 hours
             try:
-                cache.set(cache_key, country_code, 86400)
+                cache.set(cache_key, country_code, GEO_CACHE_TIMEOUT)
             except Exception:
                 pass  # If cache fails, continue without caching
             return country_code
     except (requests.RequestException, ValueError, KeyError, Exception):
         # If API fails, cache a default value for 1 hour to avoid repeated failures
         try:
-            cache.set(cache_key, 'US', 3600)
+            cache.set(cache_key, 'US', GEO_FAILURE_TIMEOUT)
         except Exception:
             pass
         pass
@@ -90,42 +124,119 @@ def get_currency_for_country(country_code):
     """
     return COUNTRY_CURRENCY.get(country_code.upper(), 'USD')
 
+def _download_exchange_rates():
+    """
+    Download current exchange rates from API (raises on failure)
+    """
+    # Using exchangerate-api.com (free tier); runs out of band, never on the request path
+    response = requests.get('https://api.exchangerate-api.com/v4/latest/USD', timeout=10)
+    response.raise_for_status()
+    rates = response.json().get('rates', {})
+
+    updated_rates = EXCHANGE_RATES.copy()
+    for currency_code in (*EXCHANGE_RATES, *PAYMENT_CURRENCIES):
+        if currency_code in rates:
+            updated_rates[currency_code] = Decimal(str(rates[currency_code]))
+    return updated_rates
+
+class ExchangeRateUnavailable(Exception):
+    """No fresh downloaded rate to charge a payment with"""
+
+
+class ExchangeRateService:
+    """
+    In-memory exchange rates, refreshed out of band
+
+    Rates are downloaded by `manage.py refresh_exchange_rates` (cron/scheduler)
+    and published to the shared cache. Each worker keeps an immutable snapshot
+    and re-reads the shared cache at most every RATES_CHECK_INTERVAL seconds;
+    the snapshot is swapped atomically, so readers never block on the network.
+    Nothing is loaded at import time. If rates get older than RATES_MAX_AGE,
+    one worker refreshes them in a background thread.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def rates(self):
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - self._checked_at >= RATES_CHECK_INTERVAL:
+            snapshot = self._reload()
+        return snapshot['rates']
+
+    def _reload(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is not None and now - self._checked_at < RATES_CHECK_INTERVAL:
+                return self._snapshot
+            self._checked_at = now
+            try:
+                stored = cache.get(RATES_KEY)
+            except Exception:
+                stored = None
+            if stored:
+                self._snapshot = stored
+            elif self._snapshot is None:
+                self._snapshot = {'rates': EXCHANGE_RATES, 'fetched_at': None}
+            snapshot = self._snapshot
+
+        if snapshot['fetched_at'] is None or time.time() - snapshot['fetched_at'] > RATES_MAX_AGE:
+            self.refresh_in_background()
+        return snapshot
+
+    def fresh_rates(self):
+        """
+        Rates no older than RATES_MAX_AGE, for amounts charged through a gateway
+        A stale or default snapshot is refreshed synchronously once;
+        raises ExchangeRateUnavailable if that fails
+        """
+        self.rates()
+        snapshot = self._snapshot
+        if snapshot['fetched_at'] is None or time.time() - snapshot['fetched_at'] > RATES_MAX_AGE:
+            try:
+                snapshot = self.refresh()
+            except Exception as e:
+                raise ExchangeRateUnavailable(f"Failed to refresh exchange rates: {e}") from e
+        return snapshot['rates']
+
+    def refresh(self):
+        """
+        Download rates, publish them to the shared cache and swap the local snapshot
+        Raises on network errors
+        """
+        snapshot = {'rates': _download_exchange_rates(), 'fetched_at': time.time()}
+        cache.set(RATES_KEY, snapshot, None)
+        self._snapshot = snapshot
+        self._checked_at = time.monotonic()
+        return snapshot
+
+    def refresh_in_background(self):
+        """Start a refresh thread unless another worker is already refreshing"""
+        if not getattr(settings, 'EXCHANGE_RATES_AUTO_REFRESH', True):
+            return
+        try:
+            # The lock is not released: it also throttles retries while the API is down
+            if not cache.add(RATES_LOCK_KEY, 1, RATES_LOCK_TIMEOUT):
+                return
+        except Exception:
+            return
+        threading.Thread(target=self._refresh_quietly, name='exchange-rates-refresh', daemon=True).start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning(f"Failed to refresh exchange rates: {e}")
+
+rate_service = ExchangeRateService()
+
 def fetch_exchange_rates():
     """
-    Fetch current exchange rates from API
-    Optimized to use cache and avoid blocking
+    Get current exchange rates (in-memory snapshot, no network call)
     """
-    # Check cache first - this is fast
-    cached_rates = cache.get('exchange_rates')
-    if cached_rates:
-        return cached_rates
-    
-    # If not in cache, try to fetch (but don't block if it fails)
-    try:
-        # Using exchangerate-api.com (free tier) with short timeout
-        response = requests.get('https://api.exchangerate-api.com/v4/latest/USD', timeout=1)
-        if response.status_code == 200:
-            data = response.json()
-            rates = data.get('rates', {})
-            
-            # Update rates
-            updated_rates = EXCHANGE_RATES.copy()
-            if 'KGS' in rates:
-                updated_rates['KGS'] = Decimal(str(rates['KGS']))
-            if 'KZT' in rates:
-                updated_rates['KZT'] = Decimal(str(rates['KZT']))
-            
-            # Cache for 6 hours (rates don't change that often)
-            cache.set('exchange_rates', updated_rates, 21600)
-            return updated_rates
-    except Exception:
-        # If API fails, use default rates and cache them for 1 hour
-        # This prevents repeated failed requests
-        cache.set('exchange_rates', EXCHANGE_RATES, 3600)
-        pass
-    
-    # Return default rates if all else fails
-    return EXCHANGE_RATES
+    return rate_service.rates()
 
 def get_exchange_rate(currency_code):
     """
@@ -134,6 +245,20 @@ def get_exchange_rate(currency_code):
     rates = fetch_exchange_rates()
     return rates.get(currency_code.upper(), Decimal('1.00'))
 
+def get_payment_rate(currency_code):
+    """
+    Exchange rate for a payment gateway amount (never a hardcoded default)
+    Raises ExchangeRateUnavailable if no fresh rate can be obtained
+    """
+    rates = rate_service.fresh_rates()
+    try:
+        return rates[currency_code.upper()]
+    except KeyError:
+        raise ExchangeRateUnavailable(f"No exchange rate for {currency_code}")
+
+def _quantize(amount):
+    return amount.quantize(Decimal('0.01'), rounding=ROUND_DOWN)
+
 def convert_price(usd_amount, target_currency='USD'):
     """
     Convert USD price to target currency
@@ -142,15 +267,18 @@ def convert_price(usd_amount, target_currency='USD'):
         return usd_amount
     
     rate = get_exchange_rate(target_currency)
-    converted = Decimal(str(usd_amount)) * rate
-    
-    # Round to 2 decimal places for KGS and KZT
-    if target_currency in ['KGS', 'KZT']:
-        converted = converted.quantize(Decimal('0.01'), rounding=ROUND_DOWN)
-    else:
-        converted = converted.quantize(Decimal('0.01'), rounding=ROUND_DOWN)
-    
-    return converted
+    return _quantize(Decimal(str(usd_amount)) * rate)
+
+def convert_prices(usd_amounts, target_currency='USD'):
+    """
+    Convert a list of USD prices to target currency in one pass
+    The rate is looked up once for the whole list (listing pages)
+    """
+    if target_currency == 'USD':
+        return list(usd_amounts)
+
+    rate = get_exchange_rate(target_currency)
+    return [_quantize(Decimal(str(amount or 0)) * rate) for amount in usd_amounts]
 
 def format_price(price, currency_code='USD'):
     """
@@ -186,3 +314,65 @@ def get_user_currency(request):
     # Default to USD
     return 'USD'
 
+# Precompiled number formats: (format spec, separators translation, template)
+PRICE_FORMATS = {
+    'KGS': (',.2f', str.maketrans({',': ' ', '.': ','}), '{amount} ' + CURRENCY_SYMBOLS['KGS']),  # "XXX сом"
+    'KZT': (',.0f', str.maketrans({',': ' '}), '{amount} ' + CURRENCY_SYMBOLS['KZT']),  # "XXX ₸"
+    'USD': (',.2f', None, CURRENCY_SYMBOLS['USD'] + '{amount}'),  # "$XXX.XX"
+}
+
+class PriceFormatter:
+    """
+    Request-scoped price converter/formatter
+    Resolves the currency, rate and format once per request instead of once per price
+    """
+
+    def __init__(self, currency_code='USD', rate=None):
+        self.currency_code = currency_code
+        self.rate = rate if rate is not None else (
+            Decimal('1.00') if currency_code == 'USD' else get_exchange_rate(currency_code)
+        )
+        self.spec, self.translation, self.template = PRICE_FORMATS.get(
+            currency_code, (',.2f', None, CURRENCY_SYMBOLS.get(currency_code, '$') + '{amount}')
+        )
+
+    def convert(self, usd_amount):
+        if not usd_amount:
+            return Decimal('0.00')
+        if not isinstance(usd_amount, Decimal):
+            usd_amount = Decimal(str(usd_amount))
+        if self.currency_code == 'USD':
+            return usd_amount
+        return _quantize(usd_amount * self.rate)
+
+    def format(self, usd_amount):
+        amount = format(self.convert(usd_amount), self.spec)
+        if self.translation:
+            amount = amount.translate(self.translation)
+        return self.template.format(amount=amount)
+
+    def format_many(self, usd_amounts):
+        return [self.format(amount) for amount in usd_amounts]
+
+USD_FORMATTER = PriceFormatter('USD')
+
+def get_price_formatter(request):
+    """
+    Price formatter for the request, created once and stored on the request
+    (recreated if the currency changes during the request, e.g. currency switch)
+    """
+    if not request:
+        return USD_FORMATTER
+    try:
+        currency_code = get_user_currency(request)
+    except Exception:
+        return USD_FORMATTER
+
+    formatter = getattr(request, '_price_formatter', None)
+    if formatter is None or formatter.currency_code != currency_code:
+        try:
+            formatter = PriceFormatter(currency_code)
+        except Exception:
+            formatter = USD_FORMATTER
+        request._price_formatter = formatter
+    return formatter
@@ -1,21 +1,16 @@
-from decimal import Decimal
-import requests
-
-def fetch_exchange_rates():
-    response = requests.get('https://api.exchangerate-api.com/v4/latest/USD')
-    data = response.json()
-    return {
-        'INR': Decimal(data['rates']['INR']),
-        'NGN': Decimal(data['rates']['NGN'])
-    }
-
-exchange_rates = fetch_exchange_rates()
+"""
+USD conversions for payment gateways (Razorpay - INR, Paystack/Flutterwave - NGN)
+Rates come from the rate service in plugin.currency and must be fresh: a stale
+snapshot is refreshed synchronously, and ExchangeRateUnavailable is raised
+instead of charging at a made-up rate
+"""
+from plugin.currency import ExchangeRateUnavailable, get_payment_rate
 
 def get_usd_to_inr_rate():
-    return exchange_rates['INR']
+    return get_payment_rate('INR')
 
 def get_usd_to_ngn_rate():
-    return exchange_rates['NGN']
+    return get_payment_rate('NGN')
 
 def convert_usd_to_inr(usd_amount):
     inr_rate = get_usd_to_inr_rate()
@@ -29,4 +24,3 @@ def convert_usd_to_kobo(usd_amount):
 def convert_usd_to_ngn(usd_amount):
     ngn_rate = get_usd_to_ngn_rate()
     return usd_amount * ngn_rate
-
@@ -0,0 +1,165 @@
+"""
+Offline IP -> country lookup over a compact sorted-range file
+
+File layout (big-endian):
+    header:  MAGIC (8 bytes) + record count (uint32)
+    records: start (16 bytes) + end (16 bytes) + country code (2 ASCII bytes)
+
+IPv4 addresses are stored as IPv4-mapped IPv6 (::ffff:a.b.c.d), so a single
+table covers both families. Records are sorted by start and don't overlap.
+The file is mmap'ed and searched with bisection: a lookup is a handful of
+16-byte comparisons, no network and no per-IP cache entries.
+
+The file is built by `manage.py import_geoip` from a DB-IP / IP2Location
+style CSV and replaced atomically; running workers pick up the new file
+on their next mtime check.
+"""
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'NGEOIP1\x00'
+HEADER = struct.Struct('>8sI')
+RECORD_SIZE = 34
+ADDRESS_SIZE = 16
+# How often workers check whether the file was replaced
+RELOAD_CHECK_INTERVAL = 60
+
+
+def address_key(ip):
+    """16-byte sortable key for an IPv4/IPv6 address (string or int for IPv4)"""
+    if isinstance(ip, int):
+        ip = ipaddress.IPv4Address(ip)
+    elif not isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        ip = ipaddress.ip_address(str(ip).strip())
+    if ip.version == 4:
+        ip = ipaddress.IPv6Address(b'\x00' * 10 + b'\xff\xff' + ip.packed)
+    return ip.packed
+
+
+class GeoIPDatabase:
+    """Read-only view of a range file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or len(self._map) != HEADER.size + self.count * RECORD_SIZE:
+            self._map.close()
+            raise ValueError(f"{path} is not a valid GeoIP range file")
+
+    def _start(self, index):
+        offset = HEADER.size + index * RECORD_SIZE
+        return self._map[offset:offset + ADDRESS_SIZE]
+
+    def lookup(self, ip):
+        """Country code for the address, or None if it isn't covered"""
+        try:
+            key = address_key(ip)
+        except ValueError:
+            return None
+
+        # Last record with start <= key
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._start(middle) <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+
+        offset = HEADER.size + (low - 1) * RECORD_SIZE
+        end = self._map[offset + ADDRESS_SIZE:offset + 2 * ADDRESS_SIZE]
+        if key > end:
+            return None
+        return self._map[offset + 2 * ADDRESS_SIZE:offset + RECORD_SIZE].decode('ascii')
+
+    def close(self):
+        self._map.close()
+
+
+def write_database(path, ranges):
+    """
+    Write a range file atomically
+
+    Args:
+        ranges: iterable of (start_key, end_key, country_code) with 16-byte keys
+
+    Returns:
+        int: number of records written
+    """
+    records = sorted(ranges)
+    merged = []
+    for start, end, country in records:
+        if merged and start <= merged[-1][1]:
+            # Overlapping range - the earlier one wins
+            continue
+        if merged and merged[-1][2] == country and int.from_bytes(merged[-1][1], 'big') + 1 == int.from_bytes(start, 'big'):
+            # Adjacent ranges of the same country are merged to keep the file small
+            merged[-1] = (merged[-1][0], end, country)
+            continue
+        merged.append((start, end, country))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(merged)))
+        for start, end, country in merged:
+            f.write(start + end + country.encode('ascii'))
+    os.replace(tmp_path, path)
+    return len(merged)
+
+
+_database = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_database():
+    """Process-wide database, reopened when the file is replaced; None if it's missing"""
+    global _database, _checked_at
+    path = getattr(settings, 'GEOIP_DB_PATH', None)
+    if not path:
+        return None
+
+    now = time.monotonic()
+    if _database is not None and now - _checked_at < RELOAD_CHECK_INTERVAL:
+        return _database
+
+    with _lock:
+        if _database is not None and now - _checked_at < RELOAD_CHECK_INTERVAL:
+            return _database
+        _checked_at = now
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            _database = None
+            return None
+        if _database is None or _database.mtime != mtime or _database.path != path:
+            try:
+                _database = GeoIPDatabase(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to open GeoIP database {path}: {e}")
+                _database = None
+    return _database
+
+
+def lookup_country(ip_address):
+    """Country code from the local database, or None if unknown / no database"""
+    database = get_database()
+    if database is None:
+        return None
+    return database.lookup(ip_address)
@@ -1,6 +1,226 @@
+"""
+Pagination helpers
+
+- paginate_queryset: page-number pagination; for catalog listings the total
+  count can be cached for a short time, so paging doesn't rerun COUNT(*) per page
+- cursor_paginate: opt-in keyset pagination for infinite scroll. Instead of
+  OFFSET it filters on the last row of the previous page ("after this
+  (date, id)"), so deep pages cost the same as the first one. Cursors are
+  opaque signed tokens bound to the ordering they were issued for.
+"""
+import hashlib
+import math
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
 from django.core.paginator import Paginator
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+from plugin.cache import make_key, CATALOG
+
+COUNT_TIMEOUT = 120  # counts are approximate on purpose
+CURSOR_SALT = 'plugin.paginate_queryset.cursor'
+
+
+def cached_count(queryset, timeout=COUNT_TIMEOUT):
+    """COUNT(*) of a queryset, cached by its SQL for `timeout` seconds"""
+    if not hasattr(queryset, 'query'):
+        return len(queryset)
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    digest = hashlib.md5(f'{sql}|{params!r}'.encode('utf-8')).hexdigest()
+    key = make_key(CATALOG, 'count', digest)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator that takes the total count from cached_count()"""
+
+    def __init__(self, *args, count_timeout=COUNT_TIMEOUT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_timeout = count_timeout
+
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list, self.count_timeout)
+
 
-def paginate_queryset(request, queryset, per_page):
-    paginator = Paginator(queryset, per_page)
+def paginate_queryset(request, queryset, per_page, cache_count=False):
+    """
+    cache_count=True - use the cached (approximate) total count; meant for
+    catalog listings, not for dashboards where the owner expects exact numbers
+    """
+    if cache_count:
+        paginator = CachedCountPaginator(queryset, per_page)
+    else:
+        paginator = Paginator(queryset, per_page)
     page_number = request.GET.get('page')
     return paginator.get_page(page_number)
+
+
+# ========== KEYSET PAGINATION ==========
+
+class CursorPage:
+    """One page of keyset pagination (iterable like a Paginator page)"""
+
+    def __init__(self, object_list, next_cursor, per_page, count_queryset):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+        self._count_queryset = count_queryset
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @cached_property
+    def count(self):
+        """Approximate (cached) total count of the whole listing"""
+        return cached_count(self._count_queryset)
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+
+def keyset_ordering(queryset, ordering=None):
+    """
+    Ordering usable for keyset pagination: plain field names with a unique
+    `id` tie-breaker appended. Without an explicit order_by() the model's
+    Meta.ordering is used, as in the SQL Django would run. None if the queryset
+    is ordered by expressions (e.g. search relevance) - such listings stay on
+    page-number pagination.
+    """
+    if ordering is None:
+        query = queryset.query
+        ordering = query.order_by or (queryset.model._meta.ordering if query.default_ordering else ())
+    fields = list(ordering)
+    if not fields or not all(isinstance(field, str) for field in fields):
+        return None
+    fields = ['-id' if field == '-pk' else 'id' if field == 'pk' else field for field in fields]
+    opts = queryset.model._meta
+    for field in fields:
+        name = field.lstrip('-')
+        if '__' in name or name == '?':
+            return None
+        try:
+            opts.get_field(name)
+        except Exception:
+            return None
+    if not any(field.lstrip('-') == 'id' for field in fields):
+        fields.append('-id' if fields[-1].startswith('-') else 'id')
+    return fields
+
+
+def _model_field(model, name):
+    return model._meta.get_field(name)
+
+
+def _order_expressions(model, fields):
+    expressions = []
+    for field in fields:
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        if _model_field(model, name).null:
+            # NULLs always last, so the keyset condition below stays valid on every DB
+            expression = F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_last=True)
+        else:
+            expression = F(name).desc() if descending else F(name).asc()
+        expressions.append(expression)
+    return expressions
+
+
+def _after(model, fields, values):
+    """Q for rows strictly after `values` in the given ordering"""
+    condition = Q()
+    equal = Q()
+    for field, value in zip(fields, values):
+        name = field.lstrip('-')
+        nullable = _model_field(model, name).null
+        if value is None:
+            # NULLs are last: only further NULLs can follow
+            strict = None
+            same = Q(**{f'{name}__isnull': True})
+        else:
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            strict = Q(**{f'{name}__{lookup}': value})
+            if nullable:
+                strict |= Q(**{f'{name}__isnull': True})
+            same = Q(**{name: value})
+        if strict is not None:
+            condition |= equal & strict
+        equal &= same
+    return condition
+
+
+def _encode_value(value):
+    if value is None or isinstance(value, (int, float, bool, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(fields, obj):
+    values = [_encode_value(getattr(obj, field.lstrip('-'))) for field in fields]
+    return signing.dumps({'o': fields, 'v': values}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(model, fields, cursor):
+    """Cursor values converted back to Python, or None for an invalid/foreign cursor"""
+    if not cursor:
+        return None
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    if data.get('o') != fields or len(data.get('v', [])) != len(fields):
+        return None
+    try:
+        return [
+            None if value is None else _model_field(model, field.lstrip('-')).to_python(value)
+            for field, value in zip(fields, data['v'])
+        ]
+    except Exception:
+        return None
+
+
+def cursor_paginate(queryset, cursor, per_page, ordering=None):
+    """
+    Keyset pagination
+
+    Args:
+        queryset: filtered queryset; its order_by() is used unless ordering is given
+        cursor: next_cursor of the previous page ('' / None for the first page)
+
+    Returns:
+        CursorPage, or None if the ordering can't be paginated by keys
+    """
+    fields = keyset_ordering(queryset, ordering)
+    if fields is None:
+        return None
+
+    model = queryset.model
+    ordered = queryset.order_by(*_order_expressions(model, fields))
+    values = decode_cursor(model, fields, cursor)
+    page_queryset = ordered.filter(_after(model, fields, values)) if values else ordered
+
+    rows = list(page_queryset[:per_page + 1])
+    next_cursor = encode_cursor(fields, rows[per_page - 1]) if len(rows) > per_page else None
+    return CursorPage(rows[:per_page], next_cursor, per_page, queryset.order_by())
@@ -1,12 +1,10 @@
-
 from plugin.countries import countries
 
-def tax_calculation(country, order_total):
-    tax_rate = 0
-    
-    for c in countries():
-        if country == c['country']:
-            tax_rate += int(float(c['tax_rate'])) / 100 * float(order_total)
+# country -> tax rate (%), built once instead of scanning countries() per call
+TAX_RATES = {c['country']: int(float(c['tax_rate'])) for c in countries()}
 
-    return tax_rate
-    
\ No newline at end of file
+def tax_calculation(country, order_total):
+    rate = TAX_RATES.get(country)
+    if not rate:
+        return 0
+    return rate / 100 * float(order_total)
@@ -12,6 +12,7 @@
     let currentPage = 1;
     let isLoading = false;
     let hasMorePages = true;
+    let nextCursor = null; // Курсор следующей страницы (keyset пагинация для infinite scroll)
     let currentFilters = {
         categories: [],
         rating: [],
@@ -120,7 +121,7 @@
     }
 
     // ========== ПРИМЕНЕНИЕ ФИЛЬТРОВ (AJAX) ==========
-    function applyFilters(page = 1) {
+    function applyFilters(page = 1, cursor = null) {
         if (isLoading) return;
 
         isLoading = true;
@@ -161,6 +162,13 @@
         
         ajaxData['page'] = page;
         ajaxData['per_page'] = 20;
+        // Первая страница и infinite scroll - курсорный режим (без OFFSET и COUNT на каждой странице),
+        // переход на конкретный номер страницы - обычная пагинация
+        if (page === 1) {
+            ajaxData['cursor'] = '';
+        } else if (cursor) {
+            ajaxData['cursor'] = cursor;
+        }
 
         // Отправляем AJAX запрос
         console.log("Sending AJAX request with filters:", ajaxData);
@@ -226,6 +234,7 @@
                 // Обновляем информацию о пагинации
                 hasMorePages = response.has_next;
                 currentPage = response.page;
+                nextCursor = response.next_cursor || null;
 
                 // Обновляем чипсы фильтров
                 updateFilterChips();
@@ -258,7 +267,7 @@
                 if ($(window).scrollTop() + $(window).height() >= $(document).height() - 300) {
                     // Загружаем следующую страницу, если есть
                     if (hasMorePages && !isLoading) {
-                        applyFilters(currentPage + 1);
+                        applyFilters(currentPage + 1, nextCursor);
                     }
                 }
             }, 100);
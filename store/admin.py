@@ -14,6 +14,8 @@ class ProductVariantInline(admin.TabularInline):
     model = store_models.ProductVariant
     extra = 1
     fields = ['size', 'color', 'color_code', 'stock', 'is_available', 'price_modifier']
+    # Следует за остатком (store.inventory.refresh_flags)
+    readonly_fields = ['is_available']
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['title', 'image']
@@ -26,6 +28,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ['status', 'featured', 'category', 'is_new', 'in_stock', 'brand']
     inlines = [GalleryInline, VariantInline, ProductVariantInline]
     prepopulated_fields = {'slug': ('name',)}
+    readonly_fields = ['in_stock']
     fieldsets = (
         ('Основная информация', {
             'fields': ('name', 'slug', 'description', 'category', 'brand', 'image', 'status', 'featured', 'is_new', 'in_stock')
@@ -51,7 +54,7 @@ class ProductVariantAdmin(admin.ModelAdmin):
     list_display = ['product', 'size', 'color', 'stock', 'is_available', 'get_final_price']
     list_filter = ['is_available', 'size', 'color']
     search_fields = ['product__name', 'size', 'color']
-    list_editable = ['is_available', 'stock']
+    list_editable = ['stock']
     
     def get_final_price(self, obj):
         return obj.get_final_price()
@@ -103,6 +106,25 @@ class BannerAdmin(admin.ModelAdmin):
         }),
     )
 
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    search_fields = ['to', 'subject']
+    list_filter = ['status']
+
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ['gateway', 'event_type', 'event_id', 'status', 'attempts', 'received_at', 'processed_at']
+    search_fields = ['event_id']
+    list_filter = ['gateway', 'status']
+
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['cart_id', 'product', 'variant', 'qty', 'order', 'expires_at']
+    search_fields = ['cart_id']
+    raw_id_fields = ['product', 'variant', 'order']
+
+class ProductRecommendationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'rank', 'recommended', 'score']
+    raw_id_fields = ['product', 'recommended']
+
 admin.site.register(store_models.Category, CategoryAdmin)
 admin.site.register(store_models.Product, ProductAdmin)
 admin.site.register(store_models.Variant, VariantAdmin)
@@ -115,3 +137,7 @@ admin.site.register(store_models.Order, OrderAdmin)
 admin.site.register(store_models.OrderItem, OrderItemAdmin)
 admin.site.register(store_models.Review, ReviewAdmin)
 admin.site.register(store_models.Banner, BannerAdmin)
+admin.site.register(store_models.OutgoingEmail, OutgoingEmailAdmin)
+admin.site.register(store_models.PaymentEvent, PaymentEventAdmin)
+admin.site.register(store_models.ProductRecommendation, ProductRecommendationAdmin)
+admin.site.register(store_models.StockReservation, StockReservationAdmin)
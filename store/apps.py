@@ -15,6 +15,9 @@ class StoreConfig(AppConfig):
     name = 'store'
     
     def ready(self):
+        # Подключаем сигналы поддержки производных данных каталога
+        from store import signals  # noqa: F401
+
         # Register length_is filter for Django 6.0 compatibility
         # This filter was removed in Django 6.0 but is still used by Jazzmin
         try:
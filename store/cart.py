@@ -0,0 +1,117 @@
+"""
+Сервис корзины
+
+- позиция корзины уникальна по (cart_id, товар, размер, цвет) - это
+  гарантирует ограничение store_cart_unique_item, поэтому добавление
+  выполняется одним INSERT ... ON CONFLICT DO UPDATE без гонок между
+  параллельными кликами "В корзину"
+- количество позиций, подытог, доставка и итог считаются одним агрегатом
+- при оформлении заказа строки корзины блокируются (select_for_update)
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Sum
+
+from store import models as store_models
+
+UPSERT_FIELDS = ['qty', 'price', 'sub_total', 'shipping', 'total', 'user']
+ZERO = Decimal('0.00')
+
+
+def normalize_option(value):
+    """Размер/цвет без значения хранятся как '' (NULL не участвует в уникальности)"""
+    return (value or '').strip()
+
+
+def parse_qty(value):
+    """Количество позиции: целое не меньше 1, иначе ValueError"""
+    qty = int(value)
+    if qty < 1:
+        raise ValueError(f"Количество должно быть положительным: {value}")
+    return qty
+
+
+def add_item(cart_id, product, qty, size=None, color=None, user=None):
+    """
+    Добавляет товар в корзину или обновляет существующую позицию (одним запросом)
+
+    Returns:
+        Cart: позиция с посчитанными суммами (pk может быть не заполнен)
+
+    Raises:
+        ValueError: qty - не целое положительное число
+    """
+    qty = parse_qty(qty)
+    price = Decimal(product.price or 0)
+    sub_total = price * qty
+    shipping = Decimal(product.shipping or 0) * qty
+    item = store_models.Cart(
+        cart_id=cart_id,
+        product=product,
+        size=normalize_option(size),
+        color=normalize_option(color),
+        qty=qty,
+        price=price,
+        sub_total=sub_total,
+        shipping=shipping,
+        total=sub_total + shipping,
+        user=user if user is not None and user.is_authenticated else None,
+    )
+    store_models.Cart.objects.bulk_create(
+        [item],
+        update_conflicts=True,
+        unique_fields=['cart_id', 'product', 'size', 'color'],
+        update_fields=UPSERT_FIELDS,
+    )
+    return item
+
+
+def remove_item(cart_id, item_id, product_id=None):
+    """Удаляет позицию корзины одним DELETE; возвращает количество удалённых строк"""
+    items = store_models.Cart.objects.filter(id=item_id)
+    if cart_id:
+        items = items.filter(cart_id=cart_id)
+    if product_id:
+        items = items.filter(product_id=product_id)
+    deleted, _ = items.delete()
+    return deleted
+
+
+def totals(cart_id):
+    """
+    Количество позиций и суммы корзины одним запросом
+
+    Returns:
+        dict: count, sub_total, shipping, total
+    """
+    values = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(
+        count=Count('id'),
+        sub_total=Sum('sub_total'),
+        shipping=Sum('shipping'),
+        total=Sum('total'),
+    )
+    for field in ('sub_total', 'shipping', 'total'):
+        values[field] = values[field] or ZERO
+    return values
+
+
+def totals_of(items):
+    """Те же суммы по уже загруженным позициям (без запроса)"""
+    return {
+        'count': len(items),
+        'sub_total': sum((item.sub_total or ZERO for item in items), ZERO),
+        'shipping': sum((item.shipping or ZERO for item in items), ZERO),
+        'total': sum((item.total or ZERO for item in items), ZERO),
+    }
+
+
+def items(cart_id):
+    return store_models.Cart.objects.filter(cart_id=cart_id).select_related('product', 'product__vendor')
+
+
+def lock_items(cart_id):
+    """
+    Позиции корзины с блокировкой строк до конца транзакции (для оформления заказа)
+    Вызывать внутри transaction.atomic()
+    """
+    return list(items(cart_id).select_for_update(of=('self',)).order_by('id'))
@@ -1,33 +1,82 @@
+"""
+Контекст-процессор магазина
+
+В установившемся режиме не делает запросов к БД:
+- дерево категорий берётся из кэша (сбрасывается сигналом при изменении Category)
+- счётчики корзины и избранного хранятся в сессии; их обновляют add_to_cart,
+  delete_cart_item, add_to_wishlist, remove_from_wishlist, clear_cart_items.
+  Счётчик привязан к cart_id / пользователю - чужое значение пересчитывается.
+"""
+from django.core.cache import cache
+
 from store import models as store_models
 from customer import models as customer_models
-from plugin.currency import get_user_currency
+from plugin.cache import make_key, CATALOG
+from plugin.currency import get_price_formatter
+
+CATEGORIES_KEY = make_key(CATALOG, 'categories')
+CATEGORIES_TIMEOUT = 3600
+CART_COUNT_SESSION_KEY = 'cart_count'
+WISHLIST_COUNT_SESSION_KEY = 'wishlist_count'
+
+
+def get_categories():
+    """Все категории (список, одинаковый для всех страниц)"""
+    categories = cache.get(CATEGORIES_KEY)
+    if categories is None:
+        categories = list(store_models.Category.objects.all())
+        cache.set(CATEGORIES_KEY, categories, CATEGORIES_TIMEOUT)
+    return categories
+
+
+def invalidate_categories():
+    cache.delete(CATEGORIES_KEY)
+
+
+def set_cart_count(request, cart_id, count):
+    request.session[CART_COUNT_SESSION_KEY] = [cart_id, count]
+
+
+def set_wishlist_count(request, count):
+    request.session[WISHLIST_COUNT_SESSION_KEY] = [request.user.pk, count]
+
+
+def get_cart_count(request):
+    cart_id = request.session.get('cart_id')
+    if not cart_id:
+        return 0
+    stored = request.session.get(CART_COUNT_SESSION_KEY)
+    if stored and stored[0] == cart_id:
+        return stored[1]
+    count = store_models.Cart.objects.filter(cart_id=cart_id).count()
+    set_cart_count(request, cart_id, count)
+    return count
+
+
+def get_wishlist_count(request):
+    if not request.user.is_authenticated:
+        return 0
+    stored = request.session.get(WISHLIST_COUNT_SESSION_KEY)
+    if stored and stored[0] == request.user.pk:
+        return stored[1]
+    count = customer_models.Wishlist.objects.filter(user=request.user).count()
+    set_wishlist_count(request, count)
+    return count
+
 
 def default(request):
-    category_ = store_models.Category.objects.all()
-    try:
-        cart_id = request.session['cart_id']
-        total_cart_items = store_models.Cart.objects.filter(cart_id=cart_id).count()
-    except:
-        total_cart_items = 0
-
-    try:
-        if request.user.is_authenticated:
-            wishlist_count = customer_models.Wishlist.objects.filter(user=request.user).count()
-        else:
-            wishlist_count = 0
-    except:
-        wishlist_count = 0
-
-    # Get user currency with error handling
-    try:
-        user_currency = get_user_currency(request)
-    except Exception:
-        # Fallback to USD if currency detection fails
-        user_currency = 'USD'
+    # Без сессии/пользователя (например, render вне middleware) счётчики нулевые
+    has_session = hasattr(request, 'session')
+    total_cart_items = get_cart_count(request) if has_session else 0
+    wishlist_count = get_wishlist_count(request) if has_session and hasattr(request, 'user') else 0
+
+    # Request-scoped price formatter (currency, rate and format resolved once)
+    price_formatter = get_price_formatter(request)
 
     return {
         "total_cart_items": total_cart_items,
-        "category_": category_,
+        "category_": get_categories(),
         "wishlist_count": wishlist_count,
-        "user_currency": user_currency,
-    }
\ No newline at end of file
+        "user_currency": price_formatter.currency_code,
+        "price_formatter": price_formatter,
+    }
@@ -0,0 +1,446 @@
+"""
+Фасетный индекс каталога для фильтров в стиле Wildberries
+
+Держит в памяти процесса posting-листы (множества id товаров) для каждого
+значения фасета опубликованных товаров и отвечает на вопрос
+"сколько товаров даст каждое значение фильтра при текущем выборе"
+одним проходом пересечений множеств вместо десятков COUNT запросов.
+
+Индекс обновляется инкрементально: сигналы Product/ProductVariant/VariantItem/Review
+помечают товар как изменённый (mark_dirty), а get_index() перед ответом
+досчитывает только изменённые товары. Версия изменений хранится в кэше,
+поэтому при общем кэше остальные процессы тоже подтягивают изменения.
+"""
+import logging
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+
+from plugin.cache import make_key, SYNC
+
+logger = logging.getLogger(__name__)
+
+# Фасеты, по которым строятся posting-листы
+FACETS = ('category', 'brand', 'season', 'material', 'size', 'color', 'rating', 'in_stock', 'is_new', 'sale')
+
+# Ключи кэша для межпроцессной синхронизации (пространство SYNC не кэшируется в L1)
+VERSION_KEY = make_key(SYNC, 'facets', 'version')
+DIRTY_KEY = make_key(SYNC, 'facets', 'dirty', '%s')
+DIRTY_TIMEOUT = 86400
+
+# Полная перестройка индекса не реже, чем раз в час (страховка от потерянных событий)
+INDEX_TTL = 3600
+# Если изменений накопилось больше - дешевле перестроить индекс целиком
+MAX_INCREMENTAL = 500
+# Значение в журнале изменений, требующее полной перестройки
+FULL_REBUILD = '*'
+
+TRUE_VALUES = ('true', '1', 'True', 'TRUE')
+
+
+class FacetIndex:
+    """
+    Posting-листы фасетов для опубликованных товаров
+
+    postings[facet][value] - множество id товаров, подходящих под фильтр facet=value.
+    option_postings используется только для списка опций фильтра: размеры и цвета
+    из VariantItem показываются в фильтре, но сам фильтр работает по ProductVariant.
+    """
+
+    def __init__(self):
+        self.all_ids = set()
+        self.prices = {}
+        self.postings = {facet: {} for facet in FACETS}
+        self.option_postings = {'size': {}, 'color': {}}
+        self.labels = {'category': {}, 'size': {}, 'color': {}}
+        self.color_codes = {}
+        self.version = 0
+        self.built_at = 0.0
+
+    # ========== ПОСТРОЕНИЕ ==========
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        index._load()
+        index.built_at = time.monotonic()
+        return index
+
+    def clone(self):
+        """Копия индекса: читающие потоки продолжают работать со старой версией"""
+        index = FacetIndex()
+        index.all_ids = set(self.all_ids)
+        index.prices = dict(self.prices)
+        index.postings = {
+            facet: {value: set(ids) for value, ids in postings.items()}
+            for facet, postings in self.postings.items()
+        }
+        index.option_postings = {
+            facet: {value: set(ids) for value, ids in postings.items()}
+            for facet, postings in self.option_postings.items()
+        }
+        index.labels = {facet: dict(labels) for facet, labels in self.labels.items()}
+        index.color_codes = dict(self.color_codes)
+        index.version = self.version
+        index.built_at = self.built_at
+        return index
+
+    def refresh_products(self, product_ids):
+        """Пересчитывает posting-листы только для указанных товаров"""
+        product_ids = set(product_ids)
+        self._discard(product_ids)
+        self._load(product_ids)
+
+    def _discard(self, product_ids):
+        self.all_ids -= product_ids
+        for product_id in product_ids:
+            self.prices.pop(product_id, None)
+        for facet_postings in list(self.postings.values()) + list(self.option_postings.values()):
+            for value in list(facet_postings):
+                facet_postings[value] -= product_ids
+                if not facet_postings[value]:
+                    del facet_postings[value]
+
+    def _load(self, product_ids=None):
+        from store import models as store_models
+
+        products = store_models.Product.objects.filter(status="Published")
+        variants = store_models.ProductVariant.objects.filter(product__status="Published", is_available=True)
+        variant_items = store_models.VariantItem.objects.filter(
+            variant__product__status="Published", variant__name__in=['Size', 'Color']
+        )
+
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+            variants = variants.filter(product_id__in=product_ids)
+            variant_items = variant_items.filter(variant__product_id__in=product_ids)
+
+        self.labels['category'] = dict(store_models.Category.objects.values_list('id', 'title'))
+
+        for (product_id, category_id, brand, season, material, price, regular_price,
+             in_stock, is_new, rating_avg) in products.values_list(
+                'id', 'category_id', 'brand', 'season', 'material', 'price', 'regular_price',
+                'in_stock', 'is_new', 'rating_avg'):
+            self.all_ids.add(product_id)
+            self.prices[product_id] = price
+            if category_id:
+                self._add('category', category_id, product_id)
+            for facet, value in (('brand', brand), ('season', season), ('material', material)):
+                if value:
+                    self._add(facet, value, product_id)
+            self._add('in_stock', bool(in_stock), product_id)
+            self._add('is_new', bool(is_new), product_id)
+            if regular_price is not None and price is not None and regular_price > price:
+                self._add('sale', True, product_id)
+            # Фильтр "от N звёзд" - по денормализованному среднему рейтингу (store.ratings)
+            for stars in range(1, 6):
+                if rating_avg and rating_avg >= stars:
+                    self._add('rating', stars, product_id)
+
+        for product_id, size, color, color_code in variants.values_list('product_id', 'size', 'color', 'color_code'):
+            if product_id not in self.all_ids:
+                continue
+            if size:
+                self._add('size', size, product_id)
+                self._add_option('size', size, product_id)
+            if color:
+                self._add('color', color, product_id)
+                self._add_option('color', color, product_id)
+                if color_code and color not in self.color_codes:
+                    self.color_codes[color] = color_code
+
+        for product_id, name, title, content in variant_items.values_list(
+                'variant__product_id', 'variant__name', 'title', 'content'):
+            value = content or title
+            if not value or product_id not in self.all_ids:
+                continue
+            facet = 'size' if name == 'Size' else 'color'
+            self._add_option(facet, value, product_id)
+            self.labels[facet].setdefault(value, title or value)
+
+    def _add(self, facet, value, product_id):
+        self.postings[facet].setdefault(value, set()).add(product_id)
+
+    def _add_option(self, facet, value, product_id):
+        self.option_postings[facet].setdefault(value, set()).add(product_id)
+
+    # ========== ЗАПРОСЫ ==========
+
+    def ids_for(self, facet, values):
+        """Объединение posting-листов выбранных значений фасета (OR внутри фасета)"""
+        postings = self.postings[facet]
+        result = set()
+        for value in values:
+            result |= postings.get(value, set())
+        return result
+
+    def _scope(self, restrict=None, price_min=None, price_max=None):
+        scope = set(self.all_ids) if restrict is None else self.all_ids & set(restrict)
+        if price_min is not None or price_max is not None:
+            scope = {
+                product_id for product_id in scope
+                if self.prices.get(product_id) is not None
+                and (price_min is None or self.prices[product_id] >= price_min)
+                and (price_max is None or self.prices[product_id] <= price_max)
+            }
+        return scope
+
+    def match(self, selection, restrict=None, price_min=None, price_max=None):
+        """
+        Возвращает множество id товаров, подходящих под выбор
+
+        selection: {facet: [values]} - OR внутри фасета, AND между фасетами
+        restrict: необязательное множество id (например, результат поиска)
+        """
+        result = self._scope(restrict, price_min, price_max)
+        for selected in sorted(
+                (self.ids_for(facet, values) for facet, values in selection.items() if values),
+                key=len):
+            result &= selected
+            if not result:
+                break
+        return result
+
+    def counts(self, selection, facets=FACETS, restrict=None, price_min=None, price_max=None):
+        """
+        Количество товаров для каждого значения каждого фасета при текущем выборе
+
+        Для фасета учитываются все выбранные фильтры, кроме его собственного,
+        чтобы выбор одного бренда не обнулял счётчики остальных брендов.
+        """
+        scope = self._scope(restrict, price_min, price_max)
+        selected_sets = {
+            facet: self.ids_for(facet, values)
+            for facet, values in selection.items() if values
+        }
+
+        result = {}
+        for facet in facets:
+            facet_scope = scope
+            for other, selected in selected_sets.items():
+                if other != facet:
+                    facet_scope = facet_scope & selected
+            result[facet] = {
+                value: len(product_ids & facet_scope)
+                for value, product_ids in self.postings[facet].items()
+            }
+        return result
+
+    def price_range(self, product_ids=None):
+        prices = [
+            price for product_id, price in self.prices.items()
+            if price is not None and (product_ids is None or product_id in product_ids)
+        ]
+        return {
+            'min_price': min(prices) if prices else None,
+            'max_price': max(prices) if prices else None,
+        }
+
+    def options(self, category_id=None):
+        """
+        Опции фильтров (в формате store.utils.get_filter_options) для всего
+        каталога или одной категории
+        """
+        scope = self.all_ids
+        if category_id is not None:
+            scope = self.postings['category'].get(category_id, set())
+
+        def counted(facet, key):
+            return [
+                {key: value, 'count': len(product_ids & scope)}
+                for value, product_ids in sorted(self.postings[facet].items())
+                if product_ids & scope
+            ]
+
+        categories = sorted(
+            (
+                {
+                    'id': category_pk,
+                    'title': title,
+                    'product_count': len(self.postings['category'].get(category_pk, ())),
+                }
+                for category_pk, title in self.labels['category'].items()
+            ),
+            key=lambda c: c['title'],
+        )
+
+        sizes = [
+            {'title': self.labels['size'].get(value, value), 'content': value}
+            for value, product_ids in sorted(self.option_postings['size'].items())
+            if product_ids & scope
+        ]
+        colors = [
+            {
+                'title': self.labels['color'].get(value, value),
+                'content': value,
+                'code': None if value in self.labels['color'] else self.color_codes.get(value),
+            }
+            for value, product_ids in sorted(self.option_postings['color'].items())
+            if product_ids & scope
+        ]
+
+        return {
+            # Диапазон цен - в пределах категории, как и остальные опции
+            'price_range': self.price_range(scope if category_id is not None else None),
+            'categories': categories,
+            'sizes': sizes,
+            'colors': colors,
+            'brands': counted('brand', 'brand'),
+            'seasons': counted('season', 'season'),
+            'materials': counted('material', 'material'),
+        }
+
+
+# ========== ФИЛЬТРЫ В SQL ==========
+
+def filter_queryset(queryset, facet, values):
+    """
+    Фильтр по рейтингу, размеру или цвету условием в SQL - те же правила, что у
+    posting-листов (рейтинг по Product.rating_avg, размер и цвет по доступным
+    ProductVariant), но без списка id в запросе: на большом каталоге IN (...)
+    упирается в лимит переменных SQLite и замедляет PostgreSQL
+    """
+    from store import models as store_models
+
+    values = [value for value in values if value not in (None, '')]
+    if not values:
+        return queryset
+    if facet == 'rating':
+        return queryset.filter(rating_avg__gte=min(values))
+    if facet in ('size', 'color'):
+        variants = store_models.ProductVariant.objects.filter(
+            product_id=OuterRef('pk'), is_available=True, **{f'{facet}__in': values}
+        )
+        return queryset.filter(Exists(variants))
+    raise ValueError(f"Unsupported facet: {facet}")
+
+
+def _parse_decimal(value):
+    if not value:
+        return None
+    try:
+        return Decimal(str(value).strip())
+    except (ValueError, TypeError, InvalidOperation):
+        return None
+
+
+def selection_from_request(params):
+    """
+    Разбирает GET параметры магазина (shop, filter_products, filter_metadata)
+
+    Returns:
+        tuple: (selection, price_min, price_max)
+    """
+    categories = params.getlist('categories[]') or params.getlist('categories')
+    ratings = params.getlist('rating[]') or params.getlist('rating')
+
+    selection = {
+        'category': [int(c) for c in categories if c and str(c).isdigit()],
+        'brand': [b for b in (params.getlist('brands[]') or params.getlist('brands')) if b],
+        'size': [s for s in (params.getlist('sizes[]') or params.getlist('sizes')) if s],
+        'color': [c for c in (params.getlist('colors[]') or params.getlist('colors')) if c],
+        # "от N звёзд" при нескольких выбранных значениях эквивалентно минимальному из них
+        'rating': [min(int(r) for r in ratings if r.isdigit())] if any(r.isdigit() for r in ratings) else [],
+    }
+
+    in_stock = params.get('in_stock')
+    if in_stock == 'true':
+        selection['in_stock'] = [True]
+    elif in_stock == 'false':
+        selection['in_stock'] = [False]
+    if params.get('is_new') == 'true':
+        selection['is_new'] = [True]
+    if params.get('has_discount') in TRUE_VALUES or params.get('sale') in TRUE_VALUES:
+        selection['sale'] = [True]
+
+    return selection, _parse_decimal(params.get('min_price')), _parse_decimal(params.get('max_price'))
+
+
+# ========== ИНДЕКС ПРОЦЕССА ==========
+
+_index = None
+_lock = threading.Lock()
+
+
+def _shared_version():
+    try:
+        return cache.get(VERSION_KEY) or 0
+    except Exception:
+        return 0
+
+
+def get_index():
+    """
+    Возвращает актуальный индекс процесса, досчитывая изменения из кэша
+    """
+    global _index
+
+    shared_version = _shared_version()
+    index = _index
+    if index is not None and index.version == shared_version and \
+            time.monotonic() - index.built_at < INDEX_TTL:
+        return index
+
+    with _lock:
+        index = _index
+        if index is None or shared_version < index.version or \
+                shared_version - index.version > MAX_INCREMENTAL or \
+                time.monotonic() - index.built_at >= INDEX_TTL:
+            index = FacetIndex.build()
+            index.version = shared_version
+            _index = index
+            return index
+
+        if shared_version > index.version:
+            keys = [DIRTY_KEY % v for v in range(index.version + 1, shared_version + 1)]
+            try:
+                dirty = cache.get_many(keys)
+            except Exception:
+                dirty = {}
+            if len(dirty) < len(keys) or FULL_REBUILD in dirty.values():
+                # Часть событий вытеснена из кэша или запрошена полная перестройка
+                index = FacetIndex.build()
+            else:
+                product_ids = set()
+                for ids in dirty.values():
+                    product_ids.update(ids)
+                index = index.clone()
+                index.refresh_products(product_ids)
+            index.version = shared_version
+            _index = index
+        return index
+
+
+def _publish(payload):
+    try:
+        cache.add(VERSION_KEY, 0, None)
+        version = cache.incr(VERSION_KEY)
+        cache.set(DIRTY_KEY % version, payload, DIRTY_TIMEOUT)
+    except Exception as e:
+        # Без кэша индекс обновится по INDEX_TTL
+        logger.warning(f"Failed to mark facet index dirty: {e}")
+
+
+def mark_dirty(*product_ids):
+    """
+    Помечает товары как изменённые для всех процессов
+
+    Вызывается из сигналов после коммита транзакции. Без аргументов
+    только обновляет справочник категорий.
+    """
+    _publish([product_id for product_id in product_ids if product_id])
+
+
+def invalidate_all():
+    """Запрашивает полную перестройку индекса во всех процессах (после массовых изменений)"""
+    _publish(FULL_REBUILD)
+
+
+def reset_index():
+    """Сбрасывает индекс процесса (следующий get_index() перестроит его)"""
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,383 @@
+"""
+Фиды товаров для маркетплейсов и рекламных сетей
+
+- google: Google Merchant Center (RSS 2.0, пространство имён g:)
+- yml: Яндекс Маркет (YML)
+- csv: таблица с теми же полями
+
+Строка фида - ProductVariant товара (группа - сам товар) или товар, если
+вариантов нет. Товары читаются .iterator(chunk_size=CHUNK_SIZE) с категорией,
+вариантами и галереей (prefetch выполняется на каждую пачку): память не
+зависит от размера каталога. Генераторы отдают текст кусками около
+BUFFER_SIZE - их можно вернуть в StreamingHttpResponse (views.product_feed)
+или записать в файл (write_feed).
+
+Инкрементальный фид (since) - товары, у которых Product.updated позже since,
+включая снятые с публикации: они выгружаются как отсутствующие, чтобы
+площадка убрала их из продажи, - только ID строк и доступность, без
+названий, описаний, цен и ссылок.
+
+write_feed пишет gzip во временный файл рядом с целевым и переименовывает
+его (os.replace): nginx не отдаёт недописанный файл. Время начала полной
+выгрузки сохраняется в state.json - от него считается выгрузка изменений
+(export_feeds --changed).
+"""
+import csv
+import gzip
+import html
+import json
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.html import strip_tags
+
+from store import models as store_models
+
+CHUNK_SIZE = 500
+BUFFER_SIZE = 64 * 1024
+CURRENCY = 'USD'  # цены каталога хранятся в долларах (plugin.currency)
+MAX_IMAGES = 10
+MAX_DESCRIPTION = 5000
+STATE_FILE = 'state.json'
+
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_SPACES = re.compile(r'\s+')
+
+
+# ========== ТОВАРЫ ==========
+
+def products(since=None):
+    """Опубликованные товары (или все изменённые после since) по одной пачке за раз"""
+    queryset = store_models.Product.objects.exclude(slug__isnull=True).exclude(slug='')
+    if since is None:
+        queryset = queryset.filter(status="Published")
+    else:
+        queryset = queryset.filter(updated__gt=since)
+    return queryset.select_related('category').prefetch_related(
+        Prefetch('product_variants', queryset=store_models.ProductVariant.objects.order_by('id')),
+        Prefetch('gallery_set', queryset=store_models.Gallery.objects.order_by('id')),
+    ).defer('search_document', 'search_vector').order_by('id').iterator(chunk_size=CHUNK_SIZE)
+
+
+def _absolute(url):
+    if url.startswith(('http://', 'https://')):
+        return url
+    return settings.SITE_URL.rstrip('/') + '/' + url.lstrip('/')
+
+
+def _plain(value):
+    return _SPACES.sub(' ', html.unescape(strip_tags(value or ''))).strip()[:MAX_DESCRIPTION]
+
+
+def offers(product):
+    """Строки фида товара: по одной на ProductVariant или одна на товар"""
+    variants = product.product_variants.all()
+    if product.status != "Published":
+        # Черновик или отключённый товар: площадке нужны только ID строк, чтобы снять их с продажи
+        group_id = product.sku if variants else ''
+        for row in list(variants) or [product]:
+            yield {'id': row.sku, 'group_id': group_id, 'product_id': product.pk, 'published': False, 'available': False}
+        return
+
+    price = product.price or 0
+    regular = product.regular_price or 0
+    images = [product.image] if product.image else []
+    images += [image.image for image in product.gallery_set.all() if image.image]
+
+    common = {
+        'group_id': product.sku if variants else '',
+        'product_id': product.pk,
+        'title': product.name,
+        'description': _plain(product.description),
+        'link': _absolute(reverse('store:product_detail', args=[product.slug])),
+        'images': [_absolute(image.url) for image in images[:MAX_IMAGES]],
+        'brand': product.brand or '',
+        'category': product.category,
+        'shipping': product.shipping or 0,
+        'updated': product.updated,
+        'published': True,
+    }
+    if not variants:
+        yield dict(
+            common, id=product.sku, size='', color='', stock=product.stock or 0,
+            price=price, old_price=regular if regular > price else None,
+            available=product.in_stock,
+        )
+        return
+    for variant in variants:
+        modifier = variant.price_modifier or 0
+        yield dict(
+            common, id=variant.sku, size=variant.size or '', color=variant.color or '', stock=variant.stock or 0,
+            price=price + modifier, old_price=regular + modifier if regular > price else None,
+            available=variant.is_available,
+        )
+
+
+def _buffered(pieces):
+    # Куски около BUFFER_SIZE: меньше мелких записей в ответ и в gzip
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+# ========== XML ==========
+
+def _text(value):
+    return html.escape(_INVALID_XML.sub('', str(value)), quote=False)
+
+
+def _attr(value):
+    return html.escape(_INVALID_XML.sub('', str(value)), quote=True)
+
+
+def _tag(name, value, attrs=''):
+    return f'<{name}{attrs}>{_text(value)}</{name}>'
+
+
+def _money(value):
+    return f'{value:.2f}'
+
+
+def _google_item(offer):
+    if not offer['published']:
+        return f"<item>{_tag('g:id', offer['id'])}{_tag('g:availability', 'out_of_stock')}</item>\n"
+    parts = ['<item>', _tag('g:id', offer['id'])]
+    if offer['group_id']:
+        parts.append(_tag('g:item_group_id', offer['group_id']))
+    parts += [
+        _tag('g:title', offer['title']),
+        _tag('g:description', offer['description']),
+        _tag('g:link', offer['link']),
+    ]
+    if offer['images']:
+        parts.append(_tag('g:image_link', offer['images'][0]))
+        parts += [_tag('g:additional_image_link', image) for image in offer['images'][1:]]
+    parts.append(_tag('g:availability', 'in_stock' if offer['available'] else 'out_of_stock'))
+    if offer['old_price'] is not None:
+        parts.append(_tag('g:price', f"{_money(offer['old_price'])} {CURRENCY}"))
+        parts.append(_tag('g:sale_price', f"{_money(offer['price'])} {CURRENCY}"))
+    else:
+        parts.append(_tag('g:price', f"{_money(offer['price'])} {CURRENCY}"))
+    if offer['brand']:
+        parts.append(_tag('g:brand', offer['brand']))
+    parts.append('<g:identifier_exists>no</g:identifier_exists><g:condition>new</g:condition>')
+    if offer['category']:
+        parts.append(_tag('g:product_type', offer['category'].title))
+    if offer['size']:
+        parts.append(_tag('g:size', offer['size']))
+    if offer['color']:
+        parts.append(_tag('g:color', offer['color']))
+    shipping = _tag('g:price', f"{_money(offer['shipping'])} {CURRENCY}")
+    parts.append(f'<g:shipping>{shipping}</g:shipping>')
+    parts.append('</item>\n')
+    return ''.join(parts)
+
+
+def google_feed(since=None):
+    """Google Merchant Center: RSS 2.0"""
+    def pieces():
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n<channel>\n'
+        yield _tag('title', settings.SITE_NAME) + _tag('link', settings.SITE_URL) + _tag('description', settings.SITE_NAME) + '\n'
+        for product in products(since):
+            for offer in offers(product):
+                yield _google_item(offer)
+        yield '</channel>\n</rss>\n'
+    return _buffered(pieces())
+
+
+def _yml_offer(offer):
+    if not offer['published']:
+        return f'<offer id="{_attr(offer["id"])}" available="false"/>\n'
+    available = 'true' if offer['available'] else 'false'
+    attrs = f' id="{_attr(offer["id"])}" available="{available}"'
+    if offer['group_id']:
+        # group_id в YML - число
+        attrs += f' group_id="{offer["product_id"]}"'
+    parts = [
+        f'<offer{attrs}>',
+        _tag('url', offer['link']),
+        _tag('price', _money(offer['price'])),
+    ]
+    if offer['old_price'] is not None:
+        parts.append(_tag('oldprice', _money(offer['old_price'])))
+    parts.append(_tag('currencyId', CURRENCY))
+    if offer['category']:
+        parts.append(_tag('categoryId', offer['category'].pk))
+    parts += [_tag('picture', image) for image in offer['images']]
+    parts.append(_tag('name', offer['title']))
+    if offer['brand']:
+        parts.append(_tag('vendor', offer['brand']))
+    parts.append(_tag('description', offer['description']))
+    if offer['size']:
+        parts.append(_tag('param', offer['size'], ' name="Размер"'))
+    if offer['color']:
+        parts.append(_tag('param', offer['color'], ' name="Цвет"'))
+    parts.append(_tag('count', offer['stock']))
+    parts.append('</offer>\n')
+    return ''.join(parts)
+
+
+def yml_feed(since=None):
+    """Яндекс Маркет: YML"""
+    def pieces():
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield f'<yml_catalog date="{timezone.localtime().isoformat(timespec="minutes")}">\n<shop>\n'
+        yield _tag('name', settings.SITE_NAME) + _tag('company', settings.SITE_NAME) + _tag('url', settings.SITE_URL) + '\n'
+        yield f'<currencies><currency id="{CURRENCY}" rate="1"/></currencies>\n<categories>\n'
+        for category_id, title in store_models.Category.objects.order_by('id').values_list('id', 'title').iterator(CHUNK_SIZE):
+            yield _tag('category', title, f' id="{category_id}"') + '\n'
+        yield '</categories>\n<offers>\n'
+        for product in products(since):
+            for offer in offers(product):
+                yield _yml_offer(offer)
+        yield '</offers>\n</shop>\n</yml_catalog>\n'
+    return _buffered(pieces())
+
+
+# ========== CSV ==========
+
+CSV_COLUMNS = [
+    'id', 'item_group_id', 'title', 'description', 'link', 'image_link', 'additional_image_links',
+    'availability', 'price', 'sale_price', 'currency', 'brand', 'category', 'size', 'color', 'stock',
+    'shipping', 'updated',
+]
+
+
+class _Line:
+    # csv.writer пишет строку в "файл" и возвращает то, что вернул write
+    def write(self, value):
+        return value
+
+
+def _csv_row(offer):
+    if not offer['published']:
+        row = [''] * len(CSV_COLUMNS)
+        row[CSV_COLUMNS.index('id')] = offer['id']
+        row[CSV_COLUMNS.index('item_group_id')] = offer['group_id']
+        row[CSV_COLUMNS.index('availability')] = 'out_of_stock'
+        return row
+    on_sale = offer['old_price'] is not None
+    return [
+        offer['id'], offer['group_id'], offer['title'], offer['description'], offer['link'],
+        offer['images'][0] if offer['images'] else '', ' '.join(offer['images'][1:]),
+        'in_stock' if offer['available'] else 'out_of_stock',
+        _money(offer['old_price'] if on_sale else offer['price']), _money(offer['price']) if on_sale else '',
+        CURRENCY, offer['brand'], offer['category'].title if offer['category'] else '',
+        offer['size'], offer['color'], offer['stock'], _money(offer['shipping']),
+        offer['updated'].isoformat() if offer['updated'] else '',
+    ]
+
+
+def csv_feed(since=None):
+    """Таблица CSV (UTF-8, заголовок в первой строке)"""
+    writer = csv.writer(_Line())
+
+    def pieces():
+        yield writer.writerow(CSV_COLUMNS)
+        for product in products(since):
+            for offer in offers(product):
+                yield writer.writerow(_csv_row(offer))
+    return _buffered(pieces())
+
+
+# ========== ФАЙЛЫ ==========
+
+class Feed:
+    __slots__ = ('filename', 'content_type', 'generate')
+
+    def __init__(self, filename, content_type, generate):
+        self.filename = filename
+        self.content_type = content_type
+        self.generate = generate
+
+
+FEEDS = {
+    'google': Feed('google.xml', 'application/xml; charset=utf-8', google_feed),
+    'yml': Feed('yandex.xml', 'application/xml; charset=utf-8', yml_feed),
+    'csv': Feed('products.csv', 'text/csv; charset=utf-8', csv_feed),
+}
+
+
+def parse_since(value):
+    """Дата-время ISO 8601 (без часового пояса - в TIME_ZONE); ValueError, если не разобрать"""
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError(f"Неверная дата: {value}")
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def feed_filename(name, changes=False):
+    base, ext = os.path.splitext(FEEDS[name].filename)
+    return f"{base}-changes{ext}.gz" if changes else f"{base}{ext}.gz"
+
+
+def write_atomic(path, write):
+    """
+    Атомарная замена файла: write(raw) пишет во временный файл, который
+    переименовывается в path (в том же каталоге - os.replace атомарен только
+    в пределах одной ФС). Используется и для sitemap (store.sitemaps)
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, tmp = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as raw:
+            write(raw)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.chmod(tmp, 0o644)  # mkstemp создаёт 0600 - nginx не смог бы прочитать
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def write_feed(name, since=None, directory=None):
+    """
+    Записывает фид gzip-файлом в FEEDS_DIR (полный или изменения после since)
+
+    Returns:
+        str: путь к файлу
+    """
+    feed = FEEDS[name]
+    path = os.path.join(directory or settings.FEEDS_DIR, feed_filename(name, changes=since is not None))
+
+    def write(raw):
+        with gzip.GzipFile(filename=feed.filename, mode='wb', fileobj=raw) as archive:
+            for chunk in feed.generate(since):
+                archive.write(chunk.encode('utf-8'))
+
+    write_atomic(path, write)
+    return path
+
+
+def load_state(directory=None):
+    """Формат фида -> время начала последней полной выгрузки"""
+    path = os.path.join(directory or settings.FEEDS_DIR, STATE_FILE)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return {name: parse_since(value) for name, value in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state, directory=None):
+    path = os.path.join(directory or settings.FEEDS_DIR, STATE_FILE)
+    payload = json.dumps({name: value.isoformat() for name, value in state.items()}, indent=2).encode('utf-8')
+    write_atomic(path, lambda raw: raw.write(payload))
@@ -0,0 +1,131 @@
+"""
+Кэш HTML фрагментов карточек товаров
+
+Карточка товара в списке меняется редко, поэтому AJAX фильтрация собирает
+список из готовых фрагментов. Ключ фрагмента: шаблон, id товара, валюта, курс
+валюты, язык - после обновления курсов карточки с пересчитанными ценами
+отрисовываются заново.
+Вместе с HTML хранится версия товара и общее поколение карточек - фрагмент
+действителен, только если обе совпадают с текущими.
+
+Версии и фрагменты читаются одним get_many на весь список; отрисовываются
+только промахи. Версия товара меняется сигналами (store.signals) при
+сохранении Product, Gallery, ProductVariant, Review; поколение - при изменении
+категорий и массовых пересчётах (invalidate_all).
+
+Версия - уникальный токен, а не счётчик: если ключ версии вытеснен из кэша,
+новая версия не совпадёт ни с одним старым фрагментом.
+"""
+import logging
+import uuid
+
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils import translation
+from django.utils.safestring import mark_safe
+
+from plugin.cache import make_key, CATALOG, SYNC
+
+logger = logging.getLogger(__name__)
+
+FRAGMENT_TIMEOUT = 86400
+GENERATION_KEY = make_key(SYNC, 'cards', 'generation')
+
+
+def _version_key(product_id):
+    return make_key(SYNC, 'cards', 'version', product_id)
+
+
+def _fragment_key(template_name, product_id, currency_code, rate, language):
+    return make_key(CATALOG, 'card', template_name, product_id, currency_code, rate, language)
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def bump(*product_ids):
+    """Инвалидирует карточки указанных товаров"""
+    product_ids = [product_id for product_id in product_ids if product_id]
+    if not product_ids:
+        return
+    try:
+        cache.set_many({_version_key(product_id): _new_token() for product_id in product_ids}, None)
+    except Exception as e:
+        logger.warning(f"Failed to invalidate product cards {product_ids}: {e}")
+
+
+def invalidate_all():
+    """Инвалидирует все карточки (категории, массовые пересчёты)"""
+    try:
+        cache.set(GENERATION_KEY, _new_token(), None)
+    except Exception as e:
+        logger.warning(f"Failed to invalidate product cards: {e}")
+
+
+def render_cards(products, template_name, formatter):
+    """
+    HTML карточек товаров в порядке списка
+
+    Args:
+        products: товары (уже загруженные, с select_related category)
+        template_name: шаблон одной карточки, товар передаётся как `p`
+        formatter: PriceFormatter запроса (валюта и курс входят в ключ)
+    """
+    products = list(products)
+    if not products:
+        return []
+
+    language = translation.get_language() or ''
+    currency_code = formatter.currency_code
+    # Курс из снимка, которым форматируются цены этого запроса
+    rate = formatter.rate.normalize()
+    version_keys = {product.pk: _version_key(product.pk) for product in products}
+    fragment_keys = {
+        product.pk: _fragment_key(template_name, product.pk, currency_code, rate, language) for product in products
+    }
+
+    try:
+        cached = cache.get_many([GENERATION_KEY, *version_keys.values(), *fragment_keys.values()])
+    except Exception as e:
+        logger.warning(f"Product card cache is unavailable: {e}")
+        cached = {}
+
+    # Отсутствующие версии создаются заново (add - чтобы не затереть параллельный bump)
+    missing_versions = {}
+    generation = cached.get(GENERATION_KEY)
+    if generation is None:
+        generation = missing_versions[GENERATION_KEY] = _new_token()
+    versions = {}
+    for product_id, key in version_keys.items():
+        version = cached.get(key)
+        if version is None:
+            version = missing_versions[key] = _new_token()
+        versions[product_id] = version
+    for key, value in missing_versions.items():
+        try:
+            cache.add(key, value, None)
+        except Exception:
+            pass
+
+    template = None
+    rendered = {}
+    cards = []
+    for product in products:
+        fragment = cached.get(fragment_keys[product.pk])
+        if fragment and fragment[0] == generation and fragment[1] == versions[product.pk]:
+            cards.append(fragment[2])
+            continue
+        if template is None:
+            template = get_template(template_name)
+        html = template.render({'p': product, 'price_formatter': formatter})
+        rendered[fragment_keys[product.pk]] = (generation, versions[product.pk], html)
+        cards.append(html)
+
+    if rendered:
+        try:
+            cache.set_many(rendered, FRAGMENT_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Failed to cache product cards: {e}")
+
+    return [mark_safe(html) for html in cards]
@@ -0,0 +1,279 @@
+"""
+Остатки товаров: временные резервы корзин и списание при оплате
+
+- SKU - строка ProductVariant, если размер и цвет позиции совпадают с одной
+  из них, иначе сам товар (Product.stock)
+- reserve: строка SKU блокируется (select_for_update), резервы одного SKU
+  выдаются по очереди; доступно = остаток - активные резервы других позиций.
+  Резерв позиции - один upsert по (cart_id, товар, размер, цвет), как в корзине
+- оформление заказа заново резервирует все позиции корзины под блокировкой
+  SKU (reserve_order) и отказывает, если остатка уже не хватает; резервы
+  привязываются к заказу на CHECKOUT_TIMEOUT
+- оплата (store.payments.finalize_payment) списывает остаток условным
+  UPDATE ... SET stock = stock - qty WHERE stock >= qty: параллельные
+  покупатели последних единиц не уводят остаток в минус
+- флаги ProductVariant.is_available и Product.in_stock пересчитываются при
+  изменении остатка (списание, сохранение товара или варианта), а не при
+  каждом запросе
+- истёкшие резервы удаляет команда sweep_stock_reservations; резервы ещё не
+  оплаченного заказа она не трогает ORDER_HOLD_RETENTION после истечения
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Sum, Value, When
+from django.utils import timezone
+
+from store import facets
+from store import fragments
+from store import models as store_models
+from store.cart import normalize_option, parse_qty
+
+logger = logging.getLogger(__name__)
+
+HOLD_TIMEOUT = timedelta(minutes=15)  # резерв позиции корзины
+CHECKOUT_TIMEOUT = timedelta(minutes=30)  # резерв оформленного, но не оплаченного заказа
+ORDER_HOLD_RETENTION = timedelta(days=1)  # сколько хранятся истёкшие резервы неоплаченного заказа
+SWEEP_BATCH_SIZE = 1000
+
+
+class OutOfStock(Exception):
+    def __init__(self, available, product=None):
+        super().__init__(f"Доступно: {available}")
+        self.available = available
+        self.product = product
+
+
+# ========== SKU ==========
+
+def _variant_index(product_ids):
+    """(товар, размер, цвет) -> ID ProductVariant для товаров; один запрос"""
+    index = {}
+    for variant_id, product_id, size, color in store_models.ProductVariant.objects.filter(
+        product_id__in=product_ids,
+    ).values_list('id', 'product_id', 'size', 'color'):
+        index.setdefault((product_id, normalize_option(size), normalize_option(color)), variant_id)
+    return index
+
+
+def resolve_variant_id(product_id, size=None, color=None):
+    """ProductVariant позиции или None - тогда остаток ведётся на товаре"""
+    index = _variant_index([product_id])
+    return index.get((product_id, normalize_option(size), normalize_option(color)))
+
+
+# ========== РЕЗЕРВЫ ==========
+
+def reserve(cart_id, product, qty, size=None, color=None):
+    """
+    Резервирует qty единиц для позиции корзины (заменяет прежний резерв позиции)
+
+    Raises:
+        ValueError: qty - не целое положительное число
+        OutOfStock: доступно меньше qty (available - сколько можно взять)
+    """
+    qty = parse_qty(qty)
+    size, color = normalize_option(size), normalize_option(color)
+    now = timezone.now()
+    with transaction.atomic():
+        variant_id = resolve_variant_id(product.pk, size, color)
+        if variant_id:
+            sku = store_models.ProductVariant.objects.filter(pk=variant_id)
+            holds = store_models.StockReservation.objects.filter(variant_id=variant_id)
+        else:
+            sku = store_models.Product.objects.filter(pk=product.pk)
+            holds = store_models.StockReservation.objects.filter(product_id=product.pk, variant__isnull=True)
+        stock = sku.select_for_update().values_list('stock', flat=True).first() or 0
+        held = holds.filter(expires_at__gt=now).exclude(
+            cart_id=cart_id, product_id=product.pk, size=size, color=color,
+        ).aggregate(qty=Sum('qty'))['qty'] or 0
+        if qty > stock - held:
+            raise OutOfStock(max(stock - held, 0))
+
+        reservation = store_models.StockReservation(
+            cart_id=cart_id, product=product, variant_id=variant_id, size=size, color=color,
+            qty=qty, expires_at=now + HOLD_TIMEOUT,
+        )
+        store_models.StockReservation.objects.bulk_create(
+            [reservation],
+            update_conflicts=True,
+            unique_fields=['cart_id', 'product', 'size', 'color'],
+            update_fields=['variant', 'qty', 'expires_at'],
+        )
+    return reservation
+
+
+def release_removed(cart_id):
+    """Снимает резервы позиций, которых больше нет в корзине (одним DELETE)"""
+    lines = store_models.Cart.objects.filter(
+        cart_id=OuterRef('cart_id'), product_id=OuterRef('product_id'),
+        size=OuterRef('size'), color=OuterRef('color'),
+    )
+    deleted, _ = store_models.StockReservation.objects.filter(
+        cart_id=cart_id, order__isnull=True,
+    ).exclude(Exists(lines)).delete()
+    return deleted
+
+
+def release_cart(cart_id):
+    """Снимает резервы корзины, не привязанные к заказу"""
+    deleted, _ = store_models.StockReservation.objects.filter(cart_id=cart_id, order__isnull=True).delete()
+    return deleted
+
+
+def _sku(product_id, variant_id):
+    return ('variant', variant_id) if variant_id else ('product', product_id)
+
+
+def reserve_order(cart_id, order, items):
+    """
+    Заново резервирует все позиции корзины под оформляемый заказ
+    Вызывать внутри transaction.atomic() (store.orders.create_order_from_cart)
+
+    Строки SKU блокируются (select_for_update, по возрастанию ID), остаток
+    проверяется для каждой позиции: истёкший или удалённый сборщиком резерв
+    корзины не продлевается вслепую. Число запросов не зависит от числа позиций.
+
+    Raises:
+        OutOfStock: остатка не хватает хотя бы на одну позицию (product - её товар)
+    """
+    now = timezone.now()
+    index = _variant_index({item.product_id for item in items})
+    lines = []
+    for item in items:
+        size, color = normalize_option(item.size), normalize_option(item.color)
+        lines.append((item, size, color, index.get((item.product_id, size, color))))
+
+    variant_ids = sorted({variant_id for _, _, _, variant_id in lines if variant_id})
+    product_ids = sorted({item.product_id for item, _, _, variant_id in lines if not variant_id})
+    stock = {}
+    if variant_ids:
+        for variant_id, qty in store_models.ProductVariant.objects.filter(pk__in=variant_ids).select_for_update() \
+                .order_by('pk').values_list('id', 'stock'):
+            stock[_sku(None, variant_id)] = qty or 0
+    if product_ids:
+        for product_id, qty in store_models.Product.objects.filter(pk__in=product_ids).select_for_update() \
+                .order_by('pk').values_list('id', 'stock'):
+            stock[_sku(product_id, None)] = qty or 0
+
+    # Активные резервы других корзин на те же SKU
+    held = {}
+    others = store_models.StockReservation.objects.filter(expires_at__gt=now).exclude(cart_id=cart_id).filter(
+        Q(variant_id__in=variant_ids) | Q(product_id__in=product_ids, variant__isnull=True)
+    )
+    for product_id, variant_id, qty in others.values('product_id', 'variant_id').annotate(
+        total=Sum('qty'),
+    ).order_by().values_list('product_id', 'variant_id', 'total'):
+        sku = _sku(product_id, variant_id)
+        held[sku] = held.get(sku, 0) + qty
+
+    needed = {}
+    for item, size, color, variant_id in lines:
+        sku = _sku(item.product_id, variant_id)
+        available = stock.get(sku, 0) - held.get(sku, 0) - needed.get(sku, 0)
+        if item.qty > available:
+            raise OutOfStock(max(available, 0), product=item.product)
+        needed[sku] = needed.get(sku, 0) + item.qty
+
+    store_models.StockReservation.objects.bulk_create(
+        [
+            store_models.StockReservation(
+                cart_id=cart_id, product_id=item.product_id, variant_id=variant_id, size=size, color=color,
+                qty=item.qty, order=order, expires_at=now + CHECKOUT_TIMEOUT,
+            )
+            for item, size, color, variant_id in lines
+        ],
+        update_conflicts=True,
+        unique_fields=['cart_id', 'product', 'size', 'color'],
+        update_fields=['variant', 'qty', 'order', 'expires_at'],
+    )
+    # Резервы позиций, которых в корзине уже нет
+    store_models.StockReservation.objects.filter(cart_id=cart_id, order__isnull=True).delete()
+
+
+def sweep_expired(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Удаляет пачку истёкших резервов; возвращает количество удалённых
+
+    Резервы заказа, который ещё ждёт оплаты, остаются ORDER_HOLD_RETENTION после
+    истечения: их снимает оплата (commit_order), в том числе запоздавший вебхук;
+    брошенные заказы вычищаются после этого срока.
+    """
+    now = timezone.now()
+    expired = store_models.StockReservation.objects.filter(expires_at__lte=now).exclude(
+        order__payment_status="Processing", expires_at__gt=now - ORDER_HOLD_RETENTION,
+    )
+    ids = list(expired.order_by('expires_at').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    deleted, _ = expired.filter(id__in=ids).delete()
+    return deleted
+
+
+# ========== СПИСАНИЕ ==========
+
+def decrement(product_id, variant_id, qty):
+    """Условное списание остатка SKU; False, если остатка не хватает"""
+    if variant_id:
+        sku = store_models.ProductVariant.objects.filter(pk=variant_id)
+    else:
+        sku = store_models.Product.objects.filter(pk=product_id)
+    return bool(sku.filter(stock__gte=qty).update(stock=F('stock') - qty))
+
+
+def commit_order(order):
+    """
+    Списывает остатки по позициям оплаченного заказа и снимает его резервы
+    Вызывать внутри transaction.atomic()
+
+    Returns:
+        list: ID позиций, на которые остатка не хватило
+    """
+    items = list(order.order_items().values_list('id', 'product_id', 'size', 'color', 'qty'))
+    product_ids = {product_id for _, product_id, _, _, _ in items}
+    index = _variant_index(product_ids)
+
+    shortages = []
+    for item_id, product_id, size, color, qty in items:
+        variant_id = index.get((product_id, normalize_option(size), normalize_option(color)))
+        if qty > 0 and not decrement(product_id, variant_id, qty):
+            shortages.append(item_id)
+    store_models.StockReservation.objects.filter(order=order).delete()
+    refresh_flags(*product_ids)
+
+    if shortages:
+        logger.error(f"Order {order.pk} paid without stock for items {shortages}")
+    return shortages
+
+
+# ========== ФЛАГИ НАЛИЧИЯ ==========
+
+def refresh_flags(*product_ids):
+    """
+    Приводит is_available вариантов и in_stock товаров в соответствие остаткам
+
+    Два UPDATE (варианты с уже верным флагом не трогаются); товарам заодно
+    ставится Product.updated - остатки меняются и мимо save(). Фасетный индекс
+    и карточки товаров обновляются после коммита.
+    """
+    product_ids = [product_id for product_id in product_ids if product_id]
+    if not product_ids:
+        return
+
+    store_models.ProductVariant.objects.filter(product_id__in=product_ids).filter(
+        Q(stock__gt=0, is_available=False) | ~Q(stock__gt=0) & Q(is_available=True)
+    ).update(is_available=Case(When(stock__gt=0, then=Value(True)), default=Value(False)))
+
+    # Товар с вариантами в наличии, если доступен хотя бы один вариант
+    variants = store_models.ProductVariant.objects.filter(product_id=OuterRef('pk'))
+    store_models.Product.objects.filter(pk__in=product_ids).update(
+        in_stock=Case(
+            When(Exists(variants.filter(is_available=True)), then=Value(True)),
+            When(Exists(variants), then=Value(False)),
+            When(stock__gt=0, then=Value(True)),
+            default=Value(False),
+        ),
+        updated=timezone.now(),
+    )
+    transaction.on_commit(lambda: (facets.mark_dirty(*product_ids), fragments.bump(*product_ids)))
@@ -0,0 +1,88 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from store import cart as cart_service
+from store import models as store_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочная проверка сервиса корзины: параллельные добавления/удаления в одну корзину. "
+        "Проверяет, что позиции не дублируются и итоги сходятся"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--products', type=int, default=3)
+
+    def handle(self, *args, **options):
+        products = list(store_models.Product.objects.filter(status="Published").order_by('id')[:options['products']])
+        if not products:
+            raise CommandError("Нет опубликованных товаров для проверки")
+
+        cart_id = f'benchmark-{uuid.uuid4().hex}'
+        errors = []
+        timings = []
+        lock = threading.Lock()
+
+        def worker(number):
+            local_timings = []
+            try:
+                for i in range(options['iterations']):
+                    product = products[(number + i) % len(products)]
+                    started = time.perf_counter()
+                    cart_service.add_item(cart_id, product, qty=1 + i % 3, size='M', color='')
+                    cart_service.totals(cart_id)
+                    if i % 5 == 4:
+                        item_id = store_models.Cart.objects.filter(
+                            cart_id=cart_id, product=product).values_list('id', flat=True).first()
+                        if item_id:
+                            cart_service.remove_item(cart_id, item_id)
+                    local_timings.append(time.perf_counter() - started)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            finally:
+                with lock:
+                    timings.extend(local_timings)
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            lines = list(store_models.Cart.objects.filter(cart_id=cart_id).values_list('product_id', 'size', 'color'))
+            totals = cart_service.totals(cart_id)
+            duplicates = len(lines) - len(set(lines))
+            expected_sub_total = sum(
+                (item.sub_total for item in store_models.Cart.objects.filter(cart_id=cart_id)),
+                cart_service.ZERO,
+            )
+        finally:
+            store_models.Cart.objects.filter(cart_id=cart_id).delete()
+
+        operations = len(timings)
+        self.stdout.write(f"БД: {connection.vendor}, потоков: {options['threads']}, операций: {operations}")
+        if operations:
+            timings.sort()
+            self.stdout.write(
+                f"  {operations / elapsed:.0f} оп/с, медиана {timings[operations // 2] * 1000:.2f} мс, "
+                f"p95 {timings[int(operations * 0.95)] * 1000:.2f} мс"
+            )
+        self.stdout.write(f"  позиций: {totals['count']}, дублей: {duplicates}, ошибок: {len(errors)}")
+        for error in errors[:5]:
+            self.stderr.write(f"  {error}")
+
+        if duplicates or totals['sub_total'] != expected_sub_total:
+            raise CommandError("Итоги корзины не сходятся")
+        self.stdout.write(self.style.SUCCESS("Готово"))
@@ -0,0 +1,72 @@
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+from django.test import RequestFactory
+
+from plugin.currency import get_price_formatter
+
+
+class Command(BaseCommand):
+    help = "Замеряет стоимость тегов форматирования цен на сетке товаров (format_currency против prices_for)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=48)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--currency', default='KGS')
+
+    def _render_time(self, template, context_factory, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            template.render(context_factory())
+        return time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        count, repeat = options['products'], options['repeat']
+        products = [
+            SimpleNamespace(price=Decimal('19.99') + i, regular_price=Decimal('24.99') + i, shipping=Decimal('3.50'))
+            for i in range(count)
+        ]
+
+        def context():
+            request = RequestFactory().get('/')
+            request.user_currency = options['currency']
+            return Context({'request': request, 'products': products})
+
+        per_tag = Template(
+            "{% load currency_tags %}{% for p in products %}"
+            "{% format_currency p.price %}{% format_currency p.regular_price %}{% format_currency p.shipping %}"
+            "{% endfor %}"
+        )
+        bulk = Template(
+            "{% load currency_tags %}{% prices_for products 'price' 'regular_price' 'shipping' %}"
+            "{% for p in products %}{{ p.display_price }}{{ p.display_regular_price }}{{ p.display_shipping }}"
+            "{% endfor %}"
+        )
+        empty = Template("{% for p in products %}{{ p.price }}{{ p.regular_price }}{{ p.shipping }}{% endfor %}")
+
+        prices = count * 3 * repeat
+        baseline = self._render_time(empty, context, repeat)
+        results = [
+            ("format_currency", self._render_time(per_tag, context, repeat)),
+            ("prices_for", self._render_time(bulk, context, repeat)),
+        ]
+
+        request = RequestFactory().get('/')
+        request.user_currency = options['currency']
+        formatter = get_price_formatter(request)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for product in products:
+                formatter.format(product.price)
+                formatter.format(product.regular_price)
+                formatter.format(product.shipping)
+        results.append(("PriceFormatter.format", time.perf_counter() - started))
+
+        self.stdout.write(f"{count} товаров x 3 цены, {repeat} рендеров, валюта {options['currency']}")
+        self.stdout.write(f"  шаблон без тегов: {baseline * 1e6 / prices:.2f} мкс на цену")
+        for name, elapsed in results:
+            self.stdout.write(f"  {name}: {elapsed * 1e6 / prices:.2f} мкс на цену")
+        self.stdout.write(self.style.SUCCESS("Готово"))
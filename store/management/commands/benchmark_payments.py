@@ -0,0 +1,148 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from customer import models as customer_models
+from store import cart as cart_service
+from store import inventory
+from store import models as store_models
+from store import payments
+from store.orders import create_order_from_cart
+from userauths.models import User
+from vendor import models as vendor_models
+from vendor import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочная проверка подтверждения оплаты на заглушке шлюза (без сети): "
+        "на каждый заказ параллельно приходят несколько callback. Проверяет, что заказ "
+        "оплачивается один раз и уведомления/письма не дублируются. Созданные данные удаляются"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=20)
+        parser.add_argument('--callbacks', type=int, default=4, help="Параллельных callback на заказ")
+        parser.add_argument('--items', type=int, default=3)
+        parser.add_argument('--latency', type=float, default=0.05, help="Задержка заглушки шлюза, секунд")
+        parser.add_argument('--method', default="Stripe", choices=sorted(payments.GATEWAYS))
+
+    def handle(self, *args, **options):
+        products = list(store_models.Product.objects.order_by('id')[:options['items']])
+        customer = User.objects.order_by('id').first()
+        if not products or customer is None:
+            raise CommandError("Нужны товары и хотя бы один пользователь")
+
+        first_notification = customer_models.Notifications.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        first_email = store_models.OutgoingEmail.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        address = customer_models.Address.objects.filter(user=customer).first()
+        # Оплата списывает остатки - после проверки они восстанавливаются
+        product_ids = [product.pk for product in products]
+        stocks = dict(store_models.Product.objects.filter(pk__in=product_ids).values_list('id', 'stock'))
+        variant_stocks = dict(
+            store_models.ProductVariant.objects.filter(product_id__in=product_ids).values_list('id', 'stock')
+        )
+
+        orders = []
+        for _ in range(options['orders']):
+            cart_id = f'benchmark-{uuid.uuid4().hex}'
+            for product in products:
+                cart_service.add_item(cart_id, product, qty=1)
+            orders.append(create_order_from_cart(customer, address, cart_id))
+            store_models.Cart.objects.filter(cart_id=cart_id).delete()
+
+        results = []
+        timings = []
+        errors = []
+        lock = threading.Lock()
+
+        def callback(order_pk):
+            try:
+                order = store_models.Order.objects.get(pk=order_pk)
+                started = time.perf_counter()
+                result = payments.confirm_payment(order, options['method'], {})
+                elapsed = time.perf_counter() - started
+                with lock:
+                    results.append((order_pk, result))
+                    timings.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        previous_latency = payments.FAKE_LATENCY
+        payments.FAKE_LATENCY = options['latency']
+        started = time.perf_counter()
+        try:
+            with override_settings(PAYMENT_FAKE_GATEWAY=True):
+                threads = [
+                    threading.Thread(target=callback, args=(order.pk,))
+                    for order in orders
+                    for _ in range(options['callbacks'])
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            payments.FAKE_LATENCY = previous_latency
+        elapsed = time.perf_counter() - started
+
+        order_ids = [order.pk for order in orders]
+        item_ids = list(store_models.OrderItem.objects.filter(order_id__in=order_ids).values_list('id', flat=True))
+        vendor_ids = set(store_models.OrderItem.objects.filter(id__in=item_ids).values_list('vendor_id', flat=True)) - {None}
+        try:
+            paid_now = {}
+            for order_pk, result in results:
+                if result == payments.PAID:
+                    paid_now[order_pk] = paid_now.get(order_pk, 0) + 1
+            double_paid = sum(1 for count in paid_now.values() if count > 1)
+            unpaid = store_models.Order.objects.filter(pk__in=order_ids).exclude(payment_status="Paid").count()
+            customer_notifications = customer_models.Notifications.objects.filter(
+                user=customer, type="New Order", id__gt=first_notification).count()
+            vendor_notifications = vendor_models.Notifications.objects.filter(order_id__in=item_ids).count()
+            # Одно уведомление на продавца заказа, а не на позицию
+            expected_vendor_notifications = store_models.OrderItem.objects.filter(
+                id__in=item_ids, vendor__isnull=False).values('order_id', 'vendor_id').distinct().count()
+            emails = store_models.OutgoingEmail.objects.filter(id__gt=first_email).count()
+        finally:
+            store_models.OutgoingEmail.objects.filter(id__gt=first_email).delete()
+            customer_models.Notifications.objects.filter(
+                user=customer, type="New Order", id__gt=first_notification).delete()
+            store_models.Order.objects.filter(pk__in=order_ids).delete()
+            for product_id, stock in stocks.items():
+                store_models.Product.objects.filter(pk=product_id).update(stock=stock)
+            for variant_id, stock in variant_stocks.items():
+                store_models.ProductVariant.objects.filter(pk=variant_id).update(stock=stock)
+            inventory.refresh_flags(*product_ids)
+            # Сводка продавцов получила приращения от удалённых заказов
+            for vendor_id in vendor_ids:
+                rollups.rebuild_all(vendor_id=vendor_id)
+
+        calls = len(timings)
+        self.stdout.write(
+            f"БД: {connection.vendor}, заказов: {len(orders)}, callback: {calls}, задержка шлюза: {options['latency']} с"
+        )
+        if calls:
+            timings.sort()
+            self.stdout.write(
+                f"  {calls / elapsed:.0f} callback/с, медиана {timings[calls // 2] * 1000:.2f} мс, "
+                f"p95 {timings[int(calls * 0.95)] * 1000:.2f} мс"
+            )
+        self.stdout.write(
+            f"  оплачено: {len(paid_now)}, двойных оплат: {double_paid}, не оплачено: {unpaid}, "
+            f"уведомлений покупателю: {customer_notifications}, продавцам: {vendor_notifications}, "
+            f"писем: {emails}, ошибок: {len(errors)}"
+        )
+        for error in errors[:5]:
+            self.stderr.write(f"  {error}")
+
+        if double_paid or unpaid or customer_notifications != len(orders) \
+                or vendor_notifications != expected_vendor_notifications:
+            raise CommandError("Оплата подтверждена не ровно один раз")
+        self.stdout.write(self.style.SUCCESS("Готово"))
@@ -0,0 +1,100 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from store import inventory
+from store import models as store_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочная проверка остатков: много потоков одновременно резервируют, а затем покупают "
+        "последние единицы одного SKU (временный ProductVariant). Проверяет, что резервов и продаж "
+        "не больше остатка и остаток не уходит в минус. Созданные данные удаляются"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=50)
+        parser.add_argument('--units', type=int, default=5, help="Остаток SKU")
+
+    def run_threads(self, count, target):
+        results = []
+        timings = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker(n):
+            try:
+                started = time.perf_counter()
+                result = target(n)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    results.append(result)
+                    timings.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if timings:
+            timings.sort()
+            self.stdout.write(
+                f"  {len(timings) / elapsed:.0f} операций/с, медиана {timings[len(timings) // 2] * 1000:.2f} мс, "
+                f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} мс, ошибок: {len(errors)}"
+            )
+        for error in errors[:5]:
+            self.stderr.write(f"  {error}")
+        return results, errors
+
+    def handle(self, *args, **options):
+        product = store_models.Product.objects.filter(status="Published").order_by('id').first()
+        if product is None:
+            raise CommandError("Нужен хотя бы один опубликованный товар")
+
+        units = options['units']
+        expected = min(units, options['threads'])
+        size = f"benchmark-{uuid.uuid4().hex[:8]}"
+        variant = store_models.ProductVariant.objects.create(product=product, size=size, stock=units)
+        self.stdout.write(f"БД: {connection.vendor}, потоков: {options['threads']}, остаток: {units}")
+        try:
+            def reserve(n):
+                try:
+                    inventory.reserve(f"benchmark-{uuid.uuid4().hex}", product, 1, size=size)
+                    return True
+                except inventory.OutOfStock:
+                    return False
+
+            self.stdout.write("Резервирование:")
+            reserved, reserve_errors = self.run_threads(options['threads'], reserve)
+
+            self.stdout.write("Списание:")
+            sold, sell_errors = self.run_threads(
+                options['threads'], lambda n: inventory.decrement(product.pk, variant.pk, 1),
+            )
+            inventory.refresh_flags(product.pk)
+            variant.refresh_from_db()
+        finally:
+            store_models.StockReservation.objects.filter(variant_id=variant.pk).delete()
+            variant.delete()
+
+        reserved_count, sold_count = sum(reserved), sum(sold)
+        self.stdout.write(
+            f"  зарезервировано: {reserved_count}, продано: {sold_count}, остаток: {variant.stock}, "
+            f"доступен: {variant.is_available}"
+        )
+        if reserve_errors or sell_errors or reserved_count != expected or sold_count != expected \
+                or variant.stock != units - expected or variant.is_available != (variant.stock > 0):
+            raise CommandError("Остаток распределён неверно")
+        self.stdout.write(self.style.SUCCESS("Готово"))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает индекс рекомендаций \"с этим товаром покупают\" по оплаченным заказам "
+        "и избранному (запускать по расписанию, например раз в сутки)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K,
+                            help="Сколько рекомендаций хранить на товар")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        products, rows = recommendations.build_index(top_k=options['top_k'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Индекс рекомендаций построен: товаров {products}, строк {rows}, {elapsed:.1f} с"
+        ))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import sitemaps
+
+
+class Command(BaseCommand):
+    help = (
+        "Записывает sitemap (шарды по 50 000 URL и индекс) и robots.txt в SITEMAPS_DIR. "
+        "Переписываются только шарды, в которых изменились товары или статьи "
+        "(однократно или в цикле с --interval)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Переписать все файлы")
+        parser.add_argument('--dir', default=None, help="Каталог файлов; по умолчанию SITEMAPS_DIR")
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Проверять изменения каждые N секунд вместо однократного запуска")
+
+    def handle(self, *args, **options):
+        force = options['force']
+        while True:
+            started = time.perf_counter()
+            written, unchanged, removed = sitemaps.build(force=force, directory=options['dir'])
+            if written or removed or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Sitemap: записано шардов {written}, без изменений {unchanged}, удалено {removed}, "
+                    f"{time.perf_counter() - started:.1f} с"
+                ))
+            if not options['interval']:
+                break
+            force = False
+            time.sleep(options['interval'])
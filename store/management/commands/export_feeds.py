@@ -0,0 +1,54 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store import feeds
+
+
+class Command(BaseCommand):
+    help = (
+        "Выгружает фиды товаров (Google Merchant, YML, CSV) gzip-файлами в FEEDS_DIR для отдачи nginx. "
+        "Полная выгрузка по умолчанию; --changed - товары, изменённые после последней полной выгрузки, "
+        "--since - после указанной даты (файлы *-changes.*.gz)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', action='append', choices=sorted(feeds.FEEDS), dest='formats',
+                            help="Формат фида (можно несколько раз); по умолчанию все")
+        parser.add_argument('--changed', action='store_true',
+                            help="Только изменения с начала последней полной выгрузки формата")
+        parser.add_argument('--since', help="Только товары, изменённые после даты ISO 8601")
+        parser.add_argument('--dir', default=None, help="Каталог файлов; по умолчанию FEEDS_DIR")
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.FEEDS_DIR
+        names = options['formats'] or sorted(feeds.FEEDS)
+        since = None
+        if options['since']:
+            try:
+                since = feeds.parse_since(options['since'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        state = feeds.load_state(directory)
+        if options['changed'] and not since:
+            missing = [name for name in names if name not in state]
+            if missing:
+                raise CommandError(f"Нет полной выгрузки для: {', '.join(missing)} - запустите команду без --changed")
+
+        for name in names:
+            # Время начала, а не конца: изменения во время выгрузки попадут в следующую
+            started_at = timezone.now()
+            started = time.perf_counter()
+            feed_since = since or (state[name] if options['changed'] else None)
+            path = feeds.write_feed(name, since=feed_since, directory=directory)
+            if feed_since is None:
+                state[name] = started_at
+                feeds.save_state(state, directory)
+            self.stdout.write(
+                f"  {name}: {path}, {os.path.getsize(path) / 1024:.0f} КБ, {time.perf_counter() - started:.1f} с"
+            )
+        self.stdout.write(self.style.SUCCESS("Фиды выгружены"))
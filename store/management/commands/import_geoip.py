@@ -0,0 +1,75 @@
+import csv
+import gzip
+import io
+import ipaddress
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from plugin.geoip import address_key, write_database
+
+
+def _parse_address(value):
+    value = value.strip()
+    # IP2Location хранит IPv4 числами, DB-IP - строками
+    if value.isdigit():
+        number = int(value)
+        if number <= 0xFFFFFFFF:
+            return address_key(number)
+        return ipaddress.IPv6Address(number).packed
+    return address_key(value)
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует диапазоны IP -> страна из CSV (DB-IP country lite, IP2Location LITE DB1; "
+        "файл, .gz или URL) в бинарный файл для офлайн определения страны"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Путь или URL к CSV: start_ip,end_ip,country_code[,...]")
+        parser.add_argument('--output', default=None, help="По умолчанию settings.GEOIP_DB_PATH")
+
+    def _open(self, source):
+        if source.startswith(('http://', 'https://')):
+            response = requests.get(source, timeout=60)
+            response.raise_for_status()
+            data = response.content
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        if data[:2] == b'\x1f\x8b':
+            data = gzip.decompress(data)
+        return io.StringIO(data.decode('utf-8-sig'))
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.GEOIP_DB_PATH
+        try:
+            stream = self._open(options['source'])
+        except (OSError, requests.RequestException) as e:
+            raise CommandError(f"Не удалось прочитать {options['source']}: {e}")
+
+        ranges = []
+        skipped = 0
+        for row in csv.reader(stream):
+            if len(row) < 3:
+                skipped += 1
+                continue
+            country = row[2].strip().upper()
+            if len(country) != 2 or not country.isalpha():
+                # Заголовок или "-" для неизвестных диапазонов
+                skipped += 1
+                continue
+            try:
+                ranges.append((_parse_address(row[0]), _parse_address(row[1]), country))
+            except ValueError:
+                skipped += 1
+
+        if not ranges:
+            raise CommandError("В файле нет ни одного диапазона")
+
+        count = write_database(output, ranges)
+        self.stdout.write(self.style.SUCCESS(
+            f"GeoIP база записана в {output}: {count} диапазонов (пропущено строк: {skipped})"
+        ))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import webhooks
+
+
+class Command(BaseCommand):
+    help = "Применяет к заказам события платёжных шлюзов из PaymentEvent (однократно или в цикле с --interval)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=webhooks.BATCH_SIZE)
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Опрашивать очередь каждые N секунд вместо однократного запуска")
+
+    def handle(self, *args, **options):
+        while True:
+            total_processed = total_ignored = total_failed = 0
+            while True:
+                processed, ignored, failed = webhooks.process_batch(options['batch_size'])
+                total_processed += processed
+                total_ignored += ignored
+                total_failed += failed
+                if processed + ignored + failed < options['batch_size']:
+                    break
+            if total_processed or total_ignored or total_failed or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Обработано: {total_processed}, пропущено: {total_ignored}, ошибок: {total_failed}"
+                ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from store import facets
+from store import fragments
+from store import ratings
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает rating_avg, rating_count и гистограмму оценок у всех товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = ratings.rebuild_all(chunk_size=options['chunk_size'])
+        # Фильтр по рейтингу в фасетном индексе строится по rating_avg
+        facets.invalidate_all()
+        # Звёзды рейтинга есть в карточках товаров
+        fragments.invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f"Агрегаты отзывов пересчитаны для {updated} товаров"))
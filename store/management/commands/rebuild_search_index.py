@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from store import models as store_models
+from store import search
+
+
+class Command(BaseCommand):
+    help = "Пересобирает поисковые документы товаров (tsvector на PostgreSQL, FTS5 на SQLite)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        product_ids = list(store_models.Product.objects.order_by('id').values_list('id', flat=True))
+
+        for start in range(0, len(product_ids), chunk_size):
+            search.index_products(product_ids[start:start + chunk_size])
+            self.stdout.write(f"Проиндексировано {min(start + chunk_size, len(product_ids))}/{len(product_ids)}")
+
+        self.stdout.write(self.style.SUCCESS("Поисковый индекс пересобран"))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from plugin.currency import rate_service
+
+
+class Command(BaseCommand):
+    help = "Обновляет курсы валют в общем кэше (запускать по расписанию или с --interval)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Обновлять каждые N секунд вместо однократного запуска")
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            try:
+                snapshot = rate_service.refresh()
+            except Exception as e:
+                if not interval:
+                    raise CommandError(f"Не удалось обновить курсы: {e}")
+                self.stderr.write(f"Не удалось обновить курсы: {e}")
+            else:
+                rates = ', '.join(f"{code}={rate}" for code, rate in sorted(snapshot['rates'].items()))
+                self.stdout.write(self.style.SUCCESS(f"Курсы обновлены: {rates}"))
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import outbox
+
+
+class Command(BaseCommand):
+    help = "Отправляет письма из очереди OutgoingEmail (однократно или в цикле с --interval)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Опрашивать очередь каждые N секунд вместо однократного запуска")
+
+    def handle(self, *args, **options):
+        while True:
+            total_sent = total_failed = 0
+            while True:
+                sent, failed = outbox.send_batch(options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if sent + failed < options['batch_size']:
+                    break
+            if total_sent or total_failed or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(f"Отправлено: {total_sent}, ошибок: {total_failed}"))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import inventory
+
+
+class Command(BaseCommand):
+    help = "Удаляет истёкшие резервы остатков (однократно или в цикле с --interval)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=inventory.SWEEP_BATCH_SIZE)
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Проверять резервы каждые N секунд вместо однократного запуска")
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while True:
+                deleted = inventory.sweep_expired(options['batch_size'])
+                total += deleted
+                if deleted < options['batch_size']:
+                    break
+            if total or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(f"Удалено истёкших резервов: {total}"))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,84 @@
+# Generated manually
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+
+    histograms = {}
+    for product_id, rating, n in (
+        Review.objects.filter(active=True, product__isnull=False, rating__isnull=False)
+        .values('product_id', 'rating').annotate(n=models.Count('id')).values_list('product_id', 'rating', 'n')
+    ):
+        histograms.setdefault(product_id, {})[rating] = n
+
+    fields = ['rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5', 'rating_count', 'rating_avg']
+    batch = []
+    for product in Product.objects.filter(id__in=list(histograms)).only('id'):
+        histogram = histograms[product.id]
+        count = sum(histogram.values())
+        for stars in range(1, 6):
+            setattr(product, f'rating_{stars}', histogram.get(stars, 0))
+        product.rating_count = count
+        product.rating_avg = (
+            Decimal(sum(stars * n for stars, n in histogram.items())) / count
+        ).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        batch.append(product)
+    Product.objects.bulk_update(batch, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_product_search_document_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0.0, editable=False, max_digits=3, verbose_name='Средний рейтинг'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Количество отзывов'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'rating_avg'], name='store_produ_status_ec1ef2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'rating_count'], name='store_produ_status_1276c6_idx'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
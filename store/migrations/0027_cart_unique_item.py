@@ -0,0 +1,36 @@
+# Generated manually
+from django.db import migrations, models
+
+
+def dedupe_cart_items(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+
+    # NULL не участвует в уникальности - пустые размер/цвет храним как ''
+    Cart.objects.filter(size__isnull=True).update(size='')
+    Cart.objects.filter(color__isnull=True).update(color='')
+
+    # Из дублей оставляем самую свежую позицию
+    duplicates = (
+        Cart.objects.values('cart_id', 'product_id', 'size', 'color')
+        .annotate(n=models.Count('id'), keep_id=models.Max('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        Cart.objects.filter(
+            cart_id=row['cart_id'], product_id=row['product_id'], size=row['size'], color=row['color']
+        ).exclude(id=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('cart_id', 'product', 'size', 'color'), name='store_cart_unique_item'),
+        ),
+    ]
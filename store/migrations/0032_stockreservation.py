@@ -0,0 +1,37 @@
+# Generated manually
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0031_productrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_id', models.CharField(max_length=1000)),
+                ('size', models.CharField(blank=True, default='', max_length=100)),
+                ('color', models.CharField(blank=True, default='', max_length=100)),
+                ('qty', models.PositiveIntegerField(verbose_name='Количество')),
+                ('expires_at', models.DateTimeField(verbose_name='Действует до')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to='store.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.productvariant')),
+            ],
+            options={
+                'verbose_name_plural': 'Резервы остатков',
+                'ordering': ['-id'],
+                'indexes': [
+                    models.Index(fields=['product', 'expires_at'], name='store_stock_product_abaa07_idx'),
+                    models.Index(fields=['variant', 'expires_at'], name='store_stock_variant_73bbf2_idx'),
+                    models.Index(fields=['expires_at'], name='store_stock_expires_f1477d_idx'),
+                ],
+                'constraints': [models.UniqueConstraint(fields=('cart_id', 'product', 'size', 'color'), name='store_reservation_unique_line')],
+            },
+        ),
+    ]
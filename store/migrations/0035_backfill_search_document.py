@@ -0,0 +1,82 @@
+# Generated manually
+import re
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+# Копия логики store.search на момент миграции: её правки не должны менять эту миграцию
+FTS_TABLE = 'store_product_fts'
+SEARCH_CONFIG = 'russian'
+CHUNK_SIZE = 500
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+RU_ENDINGS = (
+    'иями', 'ями', 'ами', 'иях', 'ией', 'иям', 'ием', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ой', 'ей', 'ий', 'ый', 'ых', 'их',
+    'ов', 'ев', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ия', 'ию', 'ью',
+    'ы', 'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь', 'й',
+)
+EN_ENDINGS = ('ing', 'ies', 'es', 'ed', 'ly', 's')
+MIN_STEM = 3
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    endings = EN_ENDINGS if word.isascii() else RU_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            if ending == 'ies':
+                return word[:-3] + 'y'
+            return word[:-len(ending)]
+    return word
+
+
+def stemmed(text):
+    return ' '.join(stem(token.lower()) for token in WORD_RE.findall(text or ''))
+
+
+def build_document(product):
+    parts = [
+        product.name,
+        product.brand,
+        product.category.title if product.category_id and product.category else None,
+        product.season,
+        product.material,
+        strip_tags(product.description or ''),
+    ]
+    return ' '.join(part for part in parts if part)
+
+
+def backfill_search_document(apps, schema_editor):
+    """Заполняет поисковые документы товаров, созданных до появления индекса"""
+    Product = apps.get_model('store', 'Product')
+    connection = schema_editor.connection
+
+    products = Product.objects.select_related('category').only(
+        'id', 'name', 'brand', 'season', 'material', 'description', 'category__title',
+    ).order_by('id')
+    for product in products.iterator(CHUNK_SIZE):
+        document = build_document(product)
+        Product.objects.filter(pk=product.pk).update(search_document=document)
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s)',
+                    [product.pk, stemmed(document)]
+                )
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchVector
+        Product.objects.update(search_vector=SearchVector('search_document', config=SEARCH_CONFIG))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0034_product_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_document, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated manually
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0036_product_rating_drop_single_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='cart_id',
+            field=models.CharField(blank=True, editable=False, max_length=1000, null=True),
+        ),
+    ]
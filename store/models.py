@@ -3,6 +3,7 @@ from shortuuid.django_fields import ShortUUIDField
 from django.utils import timezone
 from django.utils.text import slugify
 from django_ckeditor_5.fields import CKEditor5Field
+from django.contrib.postgres.search import SearchVectorField
 
 from userauths import models as user_models
 from vendor import models as vendor_models
@@ -97,9 +98,35 @@ class Product(models.Model):
     vendor = models.ForeignKey(user_models.User, on_delete=models.SET_NULL, null=True, blank=True)
 
     sku = ShortUUIDField(unique=True, length=5, max_length=50, prefix="SKU", alphabet="1234567890")
+    # Артикул в системе продавца - ключ upsert массового импорта (vendor.importer)
+    external_id = models.CharField(max_length=100, null=True, blank=True, verbose_name="Артикул продавца")
     slug = models.SlugField(null=True, blank=True, db_index=True)
 
     date = models.DateTimeField(default=timezone.now, db_index=True)
+    # Последнее изменение товара, его остатков или галереи - инкрементальные фиды (store.feeds)
+    updated = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Изменён")
+
+    # Агрегаты одобренных отзывов, поддерживаются store.ratings при изменении Review
+    # Одиночные индексы не нужны - сортировки покрывают составные (status, rating_*)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0.00, editable=False,
+                                     verbose_name="Средний рейтинг")
+    rating_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Количество отзывов")
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    # Поисковый документ и tsvector поддерживаются store.search (GIN индекс создаётся миграцией только на PostgreSQL)
+    search_document = models.TextField(blank=True, default="", editable=False)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    # Колонки, которые пишут только store.ratings и store.search через update().
+    # Обычный save() их не трогает - иначе устаревший экземпляр затрёт свежие агрегаты
+    DERIVED_FIELDS = frozenset({
+        'rating_avg', 'rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+        'search_document', 'search_vector',
+    })
 
     class Meta:
         ordering = ['-id']
@@ -109,22 +136,38 @@ class Product(models.Model):
             models.Index(fields=['status', 'featured']),
             models.Index(fields=['status', 'is_new']),
             models.Index(fields=['status', 'in_stock']),
+            models.Index(fields=['status', 'rating_avg']),
+            models.Index(fields=['status', 'rating_count']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'external_id'], name='store_product_unique_external_id'),
         ]
 
     def __str__(self):
         return self.name
 
     def average_rating(self):
-        return Review.objects.filter(product=self).aggregate(avg_rating=models.Avg('rating'))['avg_rating']
+        # Денормализованное значение, без запроса к отзывам
+        return self.rating_avg if self.rating_count else None
+
+    def rating_histogram(self):
+        return {
+            5: self.rating_5,
+            4: self.rating_4,
+            3: self.rating_3,
+            2: self.rating_2,
+            1: self.rating_1,
+        }
 
     def reviews(self):
         return Review.objects.filter(product=self)
 
+    # Через менеджер связи: после prefetch_related (store.product_page) без запроса
     def gallery(self):
-        return Gallery.objects.filter(product=self)
+        return self.gallery_set.all()
 
     def variants(self):
-        return Variant.objects.filter(product=self)
+        return self.variant_set.all()
 
     def vendor_orders(self):
         return OrderItem.objects.filter(product=self, vendor=self.vendor)
@@ -133,6 +176,16 @@ class Product(models.Model):
         if not self.slug:
             self.slug = slugify(self.name) + "-" + str(shortuuid.uuid().lower()[:2])
 
+        # UPDATE существующей строки без производных колонок (INSERT пишет все поля)
+        if (not args and self.pk and not self._state.adding
+                and kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DERIVED_FIELDS
+                and field.attname not in deferred
+            ]
+
         super(Product, self).save(*args, **kwargs)
 
 
@@ -145,7 +198,7 @@ class Variant(models.Model):
         verbose_name_plural = "Варианты"
 
     def items(self):
-        return VariantItem.objects.filter(variant=self)
+        return self.variant_items.all()
 
     def __str__(self):
         return self.name
@@ -238,6 +291,10 @@ class Cart(models.Model):
     class Meta:
         ordering = ['-date']
         verbose_name_plural = "Корзина"
+        constraints = [
+            # Одна позиция на товар с размером и цветом - основа upsert в store.cart
+            models.UniqueConstraint(fields=['cart_id', 'product', 'size', 'color'], name='store_cart_unique_item'),
+        ]
 
     def __str__(self):
         return f'{self.cart_id} - {self.product.name}'
@@ -275,17 +332,24 @@ class Order(models.Model):
     coupons = models.ManyToManyField(Coupon, blank=True)
     order_id = ShortUUIDField(length=6, max_length=25, alphabet="1234567890")
     payment_id = models.CharField(null=True, blank=True, max_length=1000)
+    # Корзина, из которой оформлен заказ - очищается при оплате (store.payments)
+    cart_id = models.CharField(max_length=1000, null=True, blank=True, editable=False)
     date = models.DateTimeField(default=timezone.now)
 
     class Meta:
         verbose_name_plural = "Заказы"
         ordering = ['-date']
+        indexes = [
+            # История заказов покупателя (keyset-пагинация по -date, -id)
+            models.Index(fields=['customer', '-date']),
+        ]
 
     def __str__(self):
         return self.order_id
 
     def order_items(self):
-        return OrderItem.objects.filter(order=self)
+        # Через связь, а не отдельный запрос: использует prefetch_related('orderitem_set'), если он был
+        return self.orderitem_set.all()
 
 
 class OrderItem(models.Model):
@@ -372,3 +436,144 @@ class Banner(models.Model):
 
     def __str__(self):
         return self.title or f"Banner {self.pk or 'New'}"
+
+
+EMAIL_STATUS = (
+    ("Pending", "Pending"),
+    ("Sent", "Sent"),
+    ("Failed", "Failed"),
+)
+
+
+class OutgoingEmail(models.Model):
+    """
+    Очередь исходящих писем (outbox)
+
+    Представления только ставят письмо в очередь, отправляет его
+    команда send_outbox_emails (store.outbox) - с повторами и одним SMTP соединением.
+    """
+    to = models.CharField(max_length=254, verbose_name="Получатель")
+    subject = models.CharField(max_length=255, verbose_name="Тема")
+    template = models.CharField(max_length=255, verbose_name="Шаблон",
+                                help_text="Без расширения: .html и .txt")
+    context = models.JSONField(default=dict, blank=True, verbose_name="Контекст",
+                               help_text="Ссылки на объекты: {'order': id, 'vendor': id, 'items': [id, ...]}")
+    status = models.CharField(max_length=20, choices=EMAIL_STATUS, default="Pending", verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попытки")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, default="", verbose_name="Последняя ошибка")
+    date = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name_plural = "Исходящие письма"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.to} - {self.subject}'
+
+
+PAYMENT_EVENT_STATUS = (
+    ("Pending", "Pending"),
+    ("Processed", "Processed"),
+    ("Ignored", "Ignored"),
+    ("Failed", "Failed"),
+)
+
+
+class PaymentEvent(models.Model):
+    """
+    Событие платёжного шлюза, принятое вебхуком (журнал только на добавление)
+
+    Вебхук проверяет подпись и записывает событие одним INSERT; заказ по нему
+    обновляет команда process_payment_events (store.webhooks). Тело события
+    не изменяется, воркер отмечает только результат обработки.
+    """
+    gateway = models.CharField(max_length=100, choices=PAYMENT_METHOD, verbose_name="Шлюз")
+    event_id = models.CharField(max_length=255, verbose_name="ID события")
+    event_type = models.CharField(max_length=100, blank=True, default="", verbose_name="Тип события")
+    payload = models.JSONField(default=dict, verbose_name="Данные")
+    status = models.CharField(max_length=20, choices=PAYMENT_EVENT_STATUS, default="Pending", verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попытки")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, default="", verbose_name="Последняя ошибка")
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name_plural = "События платёжных шлюзов"
+        constraints = [
+            # Шлюзы повторяют доставку - одно событие записывается один раз
+            models.UniqueConstraint(fields=['gateway', 'event_id'], name='store_payment_event_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.gateway} - {self.event_type} ({self.event_id})'
+
+
+class ProductRecommendation(models.Model):
+    """
+    Строка офлайн индекса "с этим товаром покупают" (store.recommendations)
+
+    Индекс пересчитывается целиком командой build_recommendations: на товар
+    не больше TOP_K строк по возрастанию rank. Страница товара читает их
+    одним запросом по (product, rank).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField(verbose_name="Позиция")
+    score = models.FloatField(verbose_name="Сходство")
+
+    class Meta:
+        ordering = ['product', 'rank']
+        verbose_name_plural = "Рекомендации товаров"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='store_recommendation_unique_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.recommended_id} ({self.score:.3f})'
+
+
+class StockReservation(models.Model):
+    """
+    Временное удержание остатка позицией корзины (store.inventory)
+
+    Позиция определяется так же, как в корзине: (cart_id, товар, размер, цвет);
+    variant - строка ProductVariant, с остатка которой списывается товар
+    (пусто - остаток самого товара). После оформления заказа удержание
+    привязывается к нему и продлевается, при оплате - удаляется вместе со
+    списанием остатка. Истёкшие удержания удаляет sweep_stock_reservations.
+    """
+    cart_id = models.CharField(max_length=1000)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='reservations')
+    size = models.CharField(max_length=100, blank=True, default="")
+    color = models.CharField(max_length=100, blank=True, default="")
+    qty = models.PositiveIntegerField(verbose_name="Количество")
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations')
+    expires_at = models.DateTimeField(verbose_name="Действует до")
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name_plural = "Резервы остатков"
+        constraints = [
+            # Одно удержание на позицию корзины - основа upsert в store.inventory
+            models.UniqueConstraint(fields=['cart_id', 'product', 'size', 'color'], name='store_reservation_unique_line'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'expires_at']),
+            models.Index(fields=['variant', 'expires_at']),
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.cart_id} - {self.product_id} x {self.qty}'
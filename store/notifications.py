@@ -0,0 +1,162 @@
+"""
+Уведомления покупателей и продавцов
+
+- рассылка о новом заказе: уведомление покупателю и по одному на продавца
+  заказа (а не на каждую позицию) одним bulk_create; повторный вызов ничего
+  не дублирует - ограничение vendor_notification_unique_order на
+  (пользователь, тип, позиция) и ignore_conflicts
+- счётчик непрочитанных на пользователя в общем кэше вместе с ID последнего
+  непрочитанного уведомления: бейджи и опрос (poll) читают кэш, а не
+  filter(seen=False); запись уведомлений меняет поколение ключа после
+  коммита (save()/delete() - сигналами customer.signals и vendor.signals)
+- "прочитать все" - один UPDATE
+
+KIND_CUSTOMER / KIND_VENDOR выбирают модель: customer.Notifications или vendor.Notifications.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+
+from customer import models as customer_models
+from customer import summary as customer_summary
+from plugin.cache import make_key, SYNC
+from vendor import models as vendor_models
+
+KIND_CUSTOMER = 'customer'
+KIND_VENDOR = 'vendor'
+MODELS = {
+    KIND_CUSTOMER: customer_models.Notifications,
+    KIND_VENDOR: vendor_models.Notifications,
+}
+
+UNREAD_TIMEOUT = 3600
+POLL_MAX_WAIT = 20  # секунд; долгое ожидание держит воркер - только для ASGI/gevent
+POLL_INTERVAL = 1.0
+POLL_LIMIT = 20
+
+
+def generation_key(kind, user_id):
+    return make_key(SYNC, 'notis', 'generation', kind, user_id)
+
+
+def unread_key(kind, user_id, generation):
+    return make_key(SYNC, 'notis', kind, user_id, generation)
+
+
+def invalidate(kind, *user_ids):
+    """
+    Сбрасывает кэш счётчиков после коммита текущей транзакции: у пользователя
+    меняется поколение, и состояние, посчитанное до коммита, больше не читается
+    """
+    keys = [generation_key(kind, user_id) for user_id in set(user_ids) if user_id]
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex[:12] for key in keys}, None))
+
+
+def unread_state(kind, user_id):
+    """
+    Непрочитанные уведомления пользователя из кэша
+
+    Состояние хранится под ключом текущего поколения. Запрос, который
+    посчитал его до invalidate(), запишет результат под старое поколение -
+    свежие данные он не затрёт.
+
+    Returns:
+        dict: unread - количество, last_id - ID последнего непрочитанного (0, если нет)
+    """
+    gen_key = generation_key(kind, user_id)
+    generation = cache.get(gen_key)
+    if generation is None:
+        # Токен, а не счётчик: после вытеснения ключа старые состояния не совпадут с новым
+        cache.add(gen_key, uuid.uuid4().hex[:12], None)
+        generation = cache.get(gen_key)
+    key = unread_key(kind, user_id, generation)
+    state = cache.get(key)
+    if state is None:
+        values = MODELS[kind].objects.filter(user_id=user_id, seen=False).aggregate(
+            unread=Count('id'), last_id=Max('id'),
+        )
+        state = {'unread': values['unread'], 'last_id': values['last_id'] or 0}
+        cache.set(key, state, UNREAD_TIMEOUT)
+    return state
+
+
+def unread_count(kind, user_id):
+    return unread_state(kind, user_id)['unread']
+
+
+# ========== ЗАПИСЬ ==========
+
+def notify_new_order(order):
+    """Уведомления об оплаченном заказе: покупателю и каждому его продавцу один раз"""
+    if order.customer_id:
+        # create(): сигналы customer.signals обновляют счётчики (кабинет и кэш)
+        customer_models.Notifications.objects.create(type="New Order", user_id=order.customer_id)
+
+    # Первая позиция продавца в заказе представляет заказ в его уведомлении
+    first_items = {}
+    for item_id, vendor_id in order.order_items().order_by('id').values_list('id', 'vendor_id'):
+        if vendor_id:
+            first_items.setdefault(vendor_id, item_id)
+    vendor_models.Notifications.objects.bulk_create(
+        [
+            vendor_models.Notifications(type="New Order", user_id=vendor_id, order_id=item_id)
+            for vendor_id, item_id in first_items.items()
+        ],
+        ignore_conflicts=True,
+    )
+    invalidate(KIND_VENDOR, *first_items)
+
+
+def mark_seen(kind, user, noti_id):
+    """Отмечает одно уведомление прочитанным; возвращает False, если оно не найдено"""
+    noti = MODELS[kind].objects.filter(user=user, id=noti_id).first()
+    if noti is None:
+        return False
+    if not noti.seen:
+        noti.seen = True
+        noti.save()  # кэш счётчика сбрасывает сигнал post_save
+    return True
+
+
+def mark_all_seen(kind, user):
+    """Отмечает все уведомления пользователя прочитанными одним UPDATE; возвращает их количество"""
+    with transaction.atomic():
+        updated = MODELS[kind].objects.filter(user=user, seen=False).update(seen=True)
+        if updated and kind == KIND_CUSTOMER:
+            # update() не вызывает сигналы счётчика кабинета
+            customer_summary.add(user.pk, unseen_notifications=-updated)
+        invalidate(kind, user.pk)
+    return updated
+
+
+# ========== ОПРОС ==========
+
+def poll(kind, user_id, after=0, wait=0):
+    """
+    Новые непрочитанные уведомления с ID больше after
+
+    Пока новых нет, читается только кэш; при wait > 0 ожидание до wait секунд
+    (long-poll), с проверкой кэша раз в POLL_INTERVAL.
+
+    Returns:
+        dict: unread, last_id, items - [{id, type, date}], не больше POLL_LIMIT
+    """
+    deadline = time.monotonic() + min(max(wait, 0), POLL_MAX_WAIT)
+    state = unread_state(kind, user_id)
+    while state['last_id'] <= after and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        state = unread_state(kind, user_id)
+
+    items = []
+    if state['last_id'] > after:
+        items = [
+            {'id': noti_id, 'type': noti_type, 'date': date.isoformat()}
+            for noti_id, noti_type, date in MODELS[kind].objects.filter(
+                user_id=user_id, seen=False, id__gt=after,
+            ).order_by('-id').values_list('id', 'type', 'date')[:POLL_LIMIT]
+        ]
+    return {'unread': state['unread'], 'last_id': state['last_id'], 'items': items}
@@ -0,0 +1,83 @@
+"""
+Создание заказа из корзины
+
+Число запросов не зависит от количества позиций:
+- позиции корзины с товарами и продавцами - один запрос (store.cart.lock_items)
+- налог считается по словарю страна -> ставка (plugin.tax_calculation)
+- Order - один INSERT, OrderItem - один bulk_create,
+  продавцы заказа - одна пачечная вставка в M2M таблицу
+Всё выполняется в одной транзакции вместе с блокировкой строк корзины;
+позиции заново резервируются под заказ (store.inventory.reserve_order), и
+при нехватке остатка заказ не создаётся (OutOfStock).
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from plugin.service_fee import calculate_service_fee
+from plugin.tax_calculation import tax_calculation
+from store import cart as cart_service
+from store import inventory
+from store import models as store_models
+
+
+def build_order(customer, address, items, cart_id=None):
+    """
+    Создаёт заказ по загруженным позициям корзины (с select_related product__vendor)
+    Вызывать внутри transaction.atomic()
+    """
+    country = address.country if address else None
+    totals = cart_service.totals_of(items)
+
+    order = store_models.Order()
+    order.sub_total = totals['sub_total']
+    order.customer = customer
+    order.address = address
+    order.cart_id = cart_id
+    order.shipping = totals['shipping']
+    order.tax = tax_calculation(country, totals['sub_total'])
+    order.total = order.sub_total + order.shipping + Decimal(order.tax)
+    order.service_fee = calculate_service_fee(order.total)
+    order.total += order.service_fee
+    order.save()
+
+    store_models.OrderItem.objects.bulk_create([
+        store_models.OrderItem(
+            order=order,
+            product=item.product,
+            qty=item.qty,
+            color=item.color,
+            size=item.size,
+            price=item.price,
+            sub_total=item.sub_total,
+            shipping=item.shipping,
+            tax=tax_calculation(country, item.sub_total),
+            total=item.total,
+            initial_total=item.total,
+            vendor=item.product.vendor,
+        )
+        for item in items
+    ])
+
+    vendor_ids = {item.product.vendor_id for item in items if item.product.vendor_id}
+    if vendor_ids:
+        through = store_models.Order.vendors.through
+        through.objects.bulk_create(
+            [through(order_id=order.id, user_id=vendor_id) for vendor_id in vendor_ids],
+            ignore_conflicts=True,
+        )
+    return order
+
+
+def create_order_from_cart(customer, address, cart_id):
+    """
+    Блокирует позиции корзины и создаёт по ним заказ в одной транзакции
+
+    Raises:
+        inventory.OutOfStock: остатка на позицию уже не хватает - транзакция откатывается
+    """
+    with transaction.atomic():
+        items = cart_service.lock_items(cart_id)
+        order = build_order(customer, address, items, cart_id=cart_id)
+        inventory.reserve_order(cart_id, order, items)
+        return order
@@ -0,0 +1,175 @@
+"""
+Очередь исходящих писем (модель OutgoingEmail)
+
+Представления вызывают enqueue_* - это один INSERT, без SMTP в запросе.
+Команда send_outbox_emails забирает пачку готовых писем:
+- захват строк через select_for_update(skip_locked=True) с "арендой":
+  next_attempt_at сдвигается на LEASE вперёд, поэтому несколько воркеров
+  не берут одно письмо, а упавший воркер не теряет его
+- письма собираются по получателям и отправляются через одно SMTP
+  соединение (get_connection().send_messages)
+- ошибка отправки - повтор с экспоненциальной задержкой, после
+  MAX_ATTEMPTS письмо помечается Failed
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template import TemplateDoesNotExist
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from store import models as store_models
+from userauths.models import User
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 60  # секунд; задержки 1, 2, 4, 8... минут
+BACKOFF_MAX = 6 * 3600
+
+CUSTOMER_NEW_ORDER = "email/order/customer/customer_new_order"
+VENDOR_NEW_ORDER = "email/order/vendor/vendor_new_order"
+
+
+def enqueue_order_emails(order):
+    """Письма о новом заказе: покупателю и по одному каждому продавцу со списком его позиций"""
+    entries = []
+    if order.address and order.address.email:
+        entries.append(store_models.OutgoingEmail(
+            to=order.address.email, subject="New Order!",
+            template=CUSTOMER_NEW_ORDER, context={'order': order.pk},
+        ))
+    vendors = {}
+    for item_id, vendor_id, email in order.order_items().filter(vendor__isnull=False).order_by('id').values_list(
+        'id', 'vendor_id', 'vendor__email'
+    ):
+        if email:
+            vendors.setdefault(vendor_id, (email, []))[1].append(item_id)
+    for vendor_id, (email, item_ids) in vendors.items():
+        entries.append(store_models.OutgoingEmail(
+            to=email, subject="New Order!", template=VENDOR_NEW_ORDER,
+            context={'order': order.pk, 'vendor': vendor_id, 'items': item_ids},
+        ))
+    store_models.OutgoingEmail.objects.bulk_create(entries)
+    return len(entries)
+
+
+# ========== ОТПРАВКА ==========
+
+def _from_email():
+    return getattr(settings, 'FROM_EMAIL', None) or settings.DEFAULT_FROM_EMAIL
+
+
+def _resolve_context(context):
+    """Ссылки {'order': id, 'vendor': id, 'items': [id, ...]} -> объекты моделей"""
+    resolved = {}
+    if 'order' in context:
+        resolved['order'] = store_models.Order.objects.select_related('address').get(pk=context['order'])
+        resolved['order_items'] = resolved['order'].order_items().select_related('product')
+    if 'vendor' in context:
+        resolved['vendor'] = User.objects.select_related('profile').get(pk=context['vendor'])
+    if 'items' in context:
+        items = list(store_models.OrderItem.objects.filter(id__in=context['items']).select_related('product'))
+        resolved['items'] = items
+        resolved['sub_total'] = sum((item.sub_total for item in items), Decimal('0.00'))
+        resolved['shipping'] = sum((item.shipping for item in items), Decimal('0.00'))
+    return resolved
+
+
+def build_message(entry, connection=None):
+    context = _resolve_context(entry.context)
+    html_body = render_to_string(f"{entry.template}.html", context)
+    try:
+        text_body = render_to_string(f"{entry.template}.txt", context)
+    except TemplateDoesNotExist:
+        text_body = ''
+    if not text_body.strip():
+        text_body = strip_tags(html_body)
+
+    msg = EmailMultiAlternatives(
+        subject=entry.subject, from_email=_from_email(),
+        to=[entry.to], body=text_body, connection=connection,
+    )
+    msg.attach_alternative(html_body, "text/html")
+    return msg
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX))
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """Забирает готовые к отправке письма и продлевает их аренду"""
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            store_models.OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status="Pending", next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:limit]
+        )
+        if entries:
+            store_models.OutgoingEmail.objects.filter(id__in=[entry.id for entry in entries]).update(
+                next_attempt_at=now + LEASE
+            )
+    return entries
+
+
+def send_batch(limit=BATCH_SIZE):
+    """
+    Отправляет одну пачку писем
+
+    Returns:
+        tuple: (отправлено, ошибок)
+    """
+    entries = claim_batch(limit)
+    if not entries:
+        return 0, 0
+
+    sent, failed = [], []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # Почтовый сервер недоступен: попытка засчитывается всем письмам пачки,
+        # они повторяются с задержкой, а не ждут конца аренды
+        logger.warning(f"Failed to open email connection: {e}")
+        failed = [(entry, e) for entry in entries]
+    else:
+        try:
+            # Письма одному получателю (продавцу) уходят подряд по одному соединению
+            entries.sort(key=lambda entry: (entry.to, entry.id))
+            for recipient, group in groupby(entries, key=lambda entry: entry.to):
+                for entry in group:
+                    try:
+                        message = build_message(entry, connection=connection)
+                        connection.send_messages([message])
+                    except Exception as e:
+                        logger.warning(f"Failed to send email #{entry.id} to {recipient}: {e}")
+                        failed.append((entry, e))
+                    else:
+                        sent.append(entry)
+        finally:
+            connection.close()
+
+    now = timezone.now()
+    if sent:
+        store_models.OutgoingEmail.objects.filter(id__in=[entry.id for entry in sent]).update(
+            status="Sent", sent_at=now, last_error=""
+        )
+    for entry, error in failed:
+        attempts = entry.attempts + 1
+        store_models.OutgoingEmail.objects.filter(id=entry.id).update(
+            attempts=attempts,
+            status="Failed" if attempts >= MAX_ATTEMPTS else "Pending",
+            next_attempt_at=now + backoff(attempts),
+            last_error=str(error)[:2000],
+        )
+    return len(sent), len(failed)
@@ -0,0 +1,391 @@
+"""
+Подтверждение оплаты заказа - общий конвейер для всех платёжных шлюзов
+
+verify-представления только передают параметры шлюза в confirm_payment():
+- проверка у шлюза (Stripe, PayPal, RazorPay, Paystack, Flutterwave): платёж
+  именно этого заказа (order_id в метаданных шлюза) на его сумму и в его валюте
+- отметка "Paid" условным UPDATE ... WHERE payment_status = 'Processing':
+  повторный callback (обновление страницы, повтор от шлюза, двойной клик)
+  не создаёт второй комплект уведомлений и писем
+- ключ идемпотентности заказа в общем кэше: пока один callback проверяет
+  оплату, параллельные не обращаются к шлюзу, а ждут результат;
+  уже оплаченный заказ шлюз повторно не проверяет
+- остатки списываются условным UPDATE, резервы заказа снимаются
+  (store.inventory)
+- уведомления - store.notifications (по одному на продавца, bulk_create),
+  письма - в очередь (store.outbox), счётчики покупателя и сводка
+  продавцов - приращениями (customer.summary, vendor.rollups)
+
+HTTP к шлюзам идёт через requests.Session на шлюз (keep-alive, пул
+соединений), OAuth-токен PayPal кэшируется до истечения срока.
+PAYMENT_FAKE_GATEWAY = True подменяет шлюзы локальной заглушкой без сети
+(нагрузочная проверка: команда benchmark_payments).
+"""
+import logging
+import threading
+import time
+import uuid
+from decimal import Decimal, InvalidOperation
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from customer import summary as customer_summary
+from plugin.currency import PAYMENT_CURRENCIES, get_payment_rate
+from plugin.cache import make_key, PAYMENTS, SYNC
+from store import inventory
+from store import models as store_models
+from store import notifications
+from store.outbox import enqueue_order_emails
+from vendor import rollups
+
+logger = logging.getLogger(__name__)
+
+# Результат confirm_payment
+PAID = "paid"            # оплата подтверждена этим вызовом
+ALREADY_PAID = "already_paid"  # заказ уже был оплачен (повторный callback)
+FAILED = "failed"
+
+PAYPAL_API = 'https://api-m.sandbox.paypal.com'
+PAYSTACK_API = 'https://api.paystack.co'
+FLUTTERWAVE_API = 'https://api.flutterwave.com'
+
+HTTP_TIMEOUT = (3.05, 15)  # соединение, чтение
+POOL_SIZE = 20
+PAYPAL_TOKEN_KEY = make_key(PAYMENTS, 'paypal', 'token')
+TOKEN_EXPIRY_MARGIN = 120  # токен обновляется заранее, до истечения срока
+IN_FLIGHT_TIMEOUT = 60
+IN_FLIGHT_WAIT = 5.0
+
+# Допустимое отклонение суммы в INR/NGN: курс мог сдвинуться между страницей оплаты и платежом
+AMOUNT_TOLERANCE = Decimal('0.02')
+
+# Задержка заглушки шлюза (секунд), имитирует сетевой запрос
+FAKE_LATENCY = 0.0
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+# ========== HTTP ==========
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def gateway_session(name):
+    """requests.Session шлюза: одна на процесс, соединения переиспользуются"""
+    session = _sessions.get(name)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = requests.Session()
+                # Повторяются только безопасные GET при сетевых ошибках и 502/503/504
+                retry = Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                              allowed_methods=frozenset(['GET']))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[name] = session
+    return session
+
+
+def stripe_options():
+    """Ключ и HTTP-клиент Stripe на общей сессии (вызывать перед запросами к Stripe)"""
+    if not isinstance(stripe.default_http_client, stripe.http_client.RequestsClient):
+        stripe.default_http_client = stripe.http_client.RequestsClient(
+            timeout=HTTP_TIMEOUT[1], session=gateway_session('stripe'),
+        )
+    return {'api_key': settings.STRIPE_SECRET_KEY}
+
+
+_razorpay_client = None
+
+
+def razorpay_client():
+    global _razorpay_client
+    if _razorpay_client is None:
+        import razorpay
+        _razorpay_client = razorpay.Client(
+            session=gateway_session('razorpay'),
+            auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+        )
+    return _razorpay_client
+
+
+def paypal_access_token(force_refresh=False):
+    """OAuth-токен PayPal; кэшируется на срок expires_in (минус запас)"""
+    if not force_refresh:
+        token = cache.get(PAYPAL_TOKEN_KEY)
+        if token:
+            return token
+
+    response = gateway_session('paypal').post(
+        f'{PAYPAL_API}/v1/oauth2/token',
+        data={'grant_type': 'client_credentials'},
+        auth=(settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET_ID),
+        timeout=HTTP_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise PaymentGatewayError(f'Failed to get access token from PayPal. Status code: {response.status_code}')
+
+    data = response.json()
+    token = data['access_token']
+    timeout = int(data.get('expires_in', 0)) - TOKEN_EXPIRY_MARGIN
+    if timeout > 0:
+        cache.set(PAYPAL_TOKEN_KEY, token, timeout)
+    return token
+
+
+# ========== СУММА ПЛАТЕЖА ==========
+
+def amount_matches(order, currency, amount):
+    """
+    Платёж покрывает заказ: валюта шлюза и сумма в основных единицах (не в центах / кобо)
+
+    Суммы Paystack и Flutterwave задаёт JavaScript страницы оплаты, поэтому
+    заказ нельзя отмечать оплаченным по одной ссылке платежа на order_id.
+    USD сравнивается с order.total точно, INR/NGN - по текущему курсу с допуском
+    AMOUNT_TOLERANCE.
+
+    Raises:
+        ExchangeRateUnavailable: нет свежего курса (проверку можно повторить позже)
+    """
+    currency = str(currency or '').upper()
+    try:
+        amount = Decimal(str(amount))
+    except InvalidOperation:
+        return False
+    if currency == 'USD':
+        return amount >= order.total
+    if currency not in PAYMENT_CURRENCIES:
+        return False
+    return amount >= order.total * get_payment_rate(currency) * (1 - AMOUNT_TOLERANCE)
+
+
+# ========== ПРОВЕРКА У ШЛЮЗА ==========
+# Функции получают заказ и параметры callback (request.GET / request.POST) и
+# возвращают идентификатор платежа, если оплата этого заказа прошла на его
+# сумму, иначе None. Платёж другого заказа (order_id в метаданных шлюза) или
+# на меньшую сумму заказ не оплачивает
+
+def verify_stripe(order, params):
+    session_id = params.get('session_id')
+    if not session_id:
+        return None
+    session = stripe.checkout.Session.retrieve(session_id, **stripe_options())
+    if session.payment_status != "paid" or session.client_reference_id != order.order_id:
+        return None
+    if not amount_matches(order, session.currency, Decimal(session.amount_total or 0) / 100):
+        return None
+    return session.payment_intent or session_id
+
+
+def verify_paypal(order, params):
+    transaction_id = params.get('transaction_id')
+    if not transaction_id:
+        return None
+
+    url = f'{PAYPAL_API}/v2/checkout/orders/{transaction_id}'
+    response = None
+    for force_refresh in (False, True):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {paypal_access_token(force_refresh)}',
+        }
+        response = gateway_session('paypal').get(url, headers=headers, timeout=HTTP_TIMEOUT)
+        # 401 - токен отозван раньше срока: берём новый и повторяем один раз
+        if response.status_code != 401:
+            break
+
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    units = data.get('purchase_units') or [{}]
+    amount = units[0].get('amount') or {}
+    if data.get('status') != 'COMPLETED' or units[0].get('custom_id') != order.order_id:
+        return None
+    if not amount_matches(order, amount.get('currency_code'), amount.get('value')):
+        return None
+    return transaction_id
+
+
+def verify_razorpay(order, params):
+    signature = {
+        'razorpay_order_id': params.get('razorpay_order_id'),
+        'razorpay_payment_id': params.get('razorpay_payment_id'),
+        'razorpay_signature': params.get('razorpay_signature'),
+    }
+    if not all(signature.values()):
+        return None
+    # Проверка подписи локальная (HMAC), без запроса к RazorPay; при ошибке - исключение
+    client = razorpay_client()
+    client.utility.verify_payment_signature(signature)
+    # Подпись подтверждает платёж заказа RazorPay, но не то, что это заказ магазина
+    razorpay_order = client.order.fetch(signature['razorpay_order_id'])
+    if (razorpay_order.get('notes') or {}).get('order_id') != order.order_id:
+        return None
+    if not amount_matches(order, razorpay_order.get('currency'), Decimal(razorpay_order.get('amount_paid') or 0) / 100):
+        return None
+    return signature['razorpay_payment_id']
+
+
+def verify_paystack(order, params):
+    reference = params.get('reference', '')
+    if not reference:
+        return None
+    headers = {
+        "Authorization": f"Bearer {settings.PAYSTACK_PRIVATE_KEY}",
+        "Content-Type": "application/json",
+    }
+    response = gateway_session('paystack').get(
+        f'{PAYSTACK_API}/transaction/verify/{reference}', headers=headers, timeout=HTTP_TIMEOUT,
+    )
+    payload = response.json()
+    data = payload.get('data') or {}
+    if not payload.get('status') or data.get('status') != 'success' or data.get('reference') != reference:
+        return None
+    metadata = data.get('metadata') or {}
+    if not isinstance(metadata, dict) or str(metadata.get('order_id')) != order.order_id:
+        return None
+    # Сумма Paystack - в кобо
+    if not amount_matches(order, data.get('currency'), Decimal(data.get('amount') or 0) / 100):
+        return None
+    return reference
+
+
+def verify_flutterwave(order, params):
+    transaction_id = params.get('transaction_id')
+    if not transaction_id:
+        return None
+    headers = {'Authorization': f'Bearer {settings.FLUTTERWAVE_PRIVATE_KEY}'}
+    response = gateway_session('flutterwave').get(
+        f'{FLUTTERWAVE_API}/v3/transactions/{transaction_id}/verify', headers=headers, timeout=HTTP_TIMEOUT,
+    )
+    if response.status_code != 200:
+        return None
+    data = response.json().get('data') or {}
+    if data.get('status') != 'successful' or data.get('tx_ref') != order.order_id:
+        return None
+    if not amount_matches(order, data.get('currency'), Decimal(str(data.get('amount') or 0))):
+        return None
+    return str(data['id'])
+
+
+def verify_fake(order, params):
+    """Заглушка шлюза: оплата успешна, если не передан status=failed"""
+    if FAKE_LATENCY:
+        time.sleep(FAKE_LATENCY)
+    if params.get('status') == 'failed':
+        return None
+    return params.get('payment_id') or f'fake-{uuid.uuid4().hex}'
+
+
+GATEWAYS = {
+    "Stripe": verify_stripe,
+    "PayPal": verify_paypal,
+    "RazorPay": verify_razorpay,
+    "Paystack": verify_paystack,
+    "Flutterwave": verify_flutterwave,
+}
+
+
+def get_verifier(payment_method):
+    if getattr(settings, 'PAYMENT_FAKE_GATEWAY', False):
+        return verify_fake
+    return GATEWAYS[payment_method]
+
+
+# ========== ПОДТВЕРЖДЕНИЕ ЗАКАЗА ==========
+
+def _payment_status(order):
+    return store_models.Order.objects.filter(pk=order.pk).values_list('payment_status', flat=True).first()
+
+
+def _wait_for_result(order, idempotency_key):
+    """Ждёт, пока параллельный callback закончит проверку этого заказа"""
+    deadline = time.monotonic() + IN_FLIGHT_WAIT
+    while cache.get(idempotency_key) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return ALREADY_PAID if _payment_status(order) == "Paid" else FAILED
+
+
+def clear_order_cart(order):
+    """Удаляет позиции корзины оплаченного заказа и её оставшиеся резервы"""
+    if not order.cart_id:
+        return
+    store_models.Cart.objects.filter(cart_id=order.cart_id).delete()
+    inventory.release_cart(order.cart_id)
+
+
+def finalize_payment(order, payment_method, payment_id):
+    """
+    Отмечает заказ оплаченным, создаёт уведомления и ставит письма в очередь
+
+    Returns:
+        str: PAID, если заказ переведён в "Paid" этим вызовом, иначе ALREADY_PAID / FAILED
+    """
+    with transaction.atomic():
+        updated = store_models.Order.objects.filter(pk=order.pk, payment_status="Processing").update(
+            payment_status="Paid", payment_method=payment_method, payment_id=payment_id,
+        )
+        if not updated:
+            return ALREADY_PAID if _payment_status(order) == "Paid" else FAILED
+
+        order.payment_status = "Paid"
+        order.payment_method = payment_method
+        order.payment_id = payment_id
+
+        # Списание остатков: нехватка только пишется в лог - оплата уже получена
+        inventory.commit_order(order)
+        notifications.notify_new_order(order)
+        # Счётчики кабинета покупателя и дневная сводка продавцов
+        customer_summary.add(order.customer_id, total_spent=order.total)
+        rollups.record_paid_order(order)
+        # Письма отправляет воркер send_outbox_emails, не запрос
+        enqueue_order_emails(order)
+        # Корзина очищается здесь, а не в браузерном callback: заказ может
+        # завершить вебхук, и тогда браузер получит ALREADY_PAID
+        clear_order_cart(order)
+    return PAID
+
+
+def confirm_payment(order, payment_method, params):
+    """
+    Проверяет оплату у шлюза и завершает заказ (идемпотентно)
+
+    Args:
+        order: заказ
+        payment_method: шлюз из PAYMENT_METHOD ("Stripe", "PayPal", ...)
+        params: параметры callback шлюза (request.GET / request.POST)
+
+    Returns:
+        str: PAID, ALREADY_PAID или FAILED
+    """
+    if order.payment_status == "Paid":
+        return ALREADY_PAID
+    if order.payment_status != "Processing":
+        return FAILED
+
+    idempotency_key = make_key(SYNC, 'payment', order.pk)
+    if not cache.add(idempotency_key, 1, IN_FLIGHT_TIMEOUT):
+        return _wait_for_result(order, idempotency_key)
+
+    try:
+        try:
+            payment_id = get_verifier(payment_method)(order, params)
+        except Exception as e:
+            logger.warning(f"{payment_method} verification failed for order {order.order_id}: {e}")
+            payment_id = None
+        if payment_id is None:
+            return FAILED
+        return finalize_payment(order, payment_method, payment_id)
+    finally:
+        cache.delete(idempotency_key)
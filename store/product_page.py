@@ -0,0 +1,80 @@
+"""
+Загрузка страницы товара фиксированным числом запросов
+
+load_product(slug) - товар с категорией и продавцом, галерея, варианты с
+элементами, матрица ProductVariant и одобренные отзывы с авторами: число
+запросов не зависит от размера галереи и числа вариантов (шесть; пять, если
+вариантов нет - элементы тогда не запрашиваются). Шаблон читает
+предзагруженное: product.gallery, product.variants и variant.items
+возвращают кэш prefetch (в шаблоне без .all - он делает новый запрос).
+
+related_products(product) - не больше RELATED_LIMIT товаров: из офлайн
+индекса рекомендаций (store.recommendations) одним запросом. Товарам, которых
+ещё нет в индексе (добавлены после последнего build_recommendations), -
+товары той же категории: список ID считается заранее и хранится в кэше
+CATALOG (get_or_refresh), товары читаются одним запросом по id__in.
+"""
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+
+from plugin.cache import make_key, get_or_refresh, CATALOG
+from store import models as store_models
+from store import recommendations
+
+RELATED_LIMIT = 8
+RELATED_TIMEOUT = 3600
+
+
+def load_product(slug):
+    """Опубликованный товар со всем, что показывает страница; Http404, если его нет"""
+    queryset = store_models.Product.objects.filter(status="Published").select_related(
+        'category', 'vendor',
+    ).prefetch_related(
+        'gallery_set',
+        Prefetch('variant_set', queryset=store_models.Variant.objects.prefetch_related('variant_items')),
+        'product_variants',
+        Prefetch(
+            'reviews',
+            queryset=store_models.Review.objects.filter(active=True).select_related('user'),
+            to_attr='approved_reviews',
+        ),
+    )
+    return get_object_or_404(queryset, slug=slug)
+
+
+# ========== ПОХОЖИЕ ТОВАРЫ ==========
+
+def related_key(product_id, category_id):
+    # Категория в ключе: после смены категории список считается заново
+    return make_key(CATALOG, 'related', product_id, category_id)
+
+
+def compute_related_ids(product_id, category_id):
+    return list(
+        store_models.Product.objects.filter(status="Published", category_id=category_id)
+        .exclude(id=product_id)
+        .order_by('-rating_count', '-id')
+        .values_list('id', flat=True)[:RELATED_LIMIT]
+    )
+
+
+def related_products(product):
+    """Похожие товары в порядке заранее посчитанного списка"""
+    recommended = recommendations.recommended_products(product.pk, RELATED_LIMIT)
+    if recommended:
+        return recommended
+    if not product.category_id:
+        return []
+    ids = get_or_refresh(
+        related_key(product.pk, product.category_id),
+        lambda: compute_related_ids(product.pk, product.category_id),
+        RELATED_TIMEOUT,
+    )
+    if not ids:
+        return []
+    # Снятые с публикации за время жизни списка отсеиваются здесь
+    products = {
+        p.id: p
+        for p in store_models.Product.objects.filter(id__in=ids, status="Published").select_related('category')
+    }
+    return [products[product_id] for product_id in ids if product_id in products]
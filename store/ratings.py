@@ -0,0 +1,81 @@
+"""
+Денормализованные агрегаты отзывов товара
+
+Product.rating_avg, rating_count и гистограмма rating_1..rating_5 считаются
+по одобренным (active) отзывам и пересчитываются в той же транзакции, что и
+изменение отзыва, поэтому карточки и сортировки читают готовые колонки
+вместо Avg/Count по отзывам.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Count
+
+STARS = (1, 2, 3, 4, 5)
+
+
+def histogram_fields():
+    return [f'rating_{stars}' for stars in STARS]
+
+
+def aggregate_values(histogram):
+    """Значения полей Product по гистограмме {оценка: количество}"""
+    count = sum(histogram.get(stars, 0) for stars in STARS)
+    total = sum(stars * histogram.get(stars, 0) for stars in STARS)
+    values = {f'rating_{stars}': histogram.get(stars, 0) for stars in STARS}
+    values['rating_count'] = count
+    values['rating_avg'] = (
+        (Decimal(total) / count).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) if count else Decimal('0.00')
+    )
+    return values
+
+
+def recalculate_product_rating(product_id):
+    """
+    Пересчитывает агрегаты одного товара
+
+    Строка товара блокируется (select_for_update), чтобы параллельные
+    изменения отзывов одного товара не перетирали друг друга.
+    """
+    from store import models as store_models
+
+    if not product_id:
+        return
+    with transaction.atomic():
+        locked = store_models.Product.objects.select_for_update().filter(pk=product_id)
+        if not locked.exists():
+            return
+        histogram = dict(
+            store_models.Review.objects.filter(product_id=product_id, active=True, rating__isnull=False)
+            .values('rating').annotate(n=Count('id')).values_list('rating', 'n')
+        )
+        # update() не вызывает сигналы Product
+        locked.update(**aggregate_values(histogram))
+
+
+def rebuild_all(chunk_size=1000):
+    """Полный пересчёт агрегатов всех товаров (management-команда rebuild_product_ratings)"""
+    from store import models as store_models
+
+    histograms = {}
+    for product_id, rating, n in (
+        store_models.Review.objects.filter(active=True, product__isnull=False, rating__isnull=False)
+        .values('product_id', 'rating').annotate(n=Count('id')).values_list('product_id', 'rating', 'n')
+    ):
+        histograms.setdefault(product_id, {})[rating] = n
+
+    fields = histogram_fields() + ['rating_count', 'rating_avg']
+    updated = 0
+    batch = []
+    for product in store_models.Product.objects.only('id', *fields).iterator(chunk_size=chunk_size):
+        for field, value in aggregate_values(histograms.get(product.id, {})).items():
+            setattr(product, field, value)
+        batch.append(product)
+        if len(batch) >= chunk_size:
+            store_models.Product.objects.bulk_update(batch, fields)
+            updated += len(batch)
+            batch = []
+    if batch:
+        store_models.Product.objects.bulk_update(batch, fields)
+        updated += len(batch)
+    return updated
@@ -0,0 +1,126 @@
+"""
+Офлайн индекс рекомендаций "с этим товаром покупают"
+
+build_index (команда build_recommendations) строит разреженную матрицу
+совместной встречаемости товаров:
+- в одном оплаченном заказе (вес PURCHASE_WEIGHT)
+- в избранном одного пользователя (вес WISHLIST_WEIGHT)
+
+Сходство пары - косинус по встречаемости (co / sqrt(freq_a * freq_b)),
+плюс CATEGORY_BONUS для товаров одной категории. Товарам, у которых пар
+меньше top_k, недостающие места заполняются популярными товарами той же
+категории. На товар сохраняется не больше top_k строк ProductRecommendation.
+
+Корзины больше MAX_BASKET товаров обрезаются: пары считаются квадратично.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import combinations, groupby
+from operator import itemgetter
+
+from django.db import transaction
+
+from customer import models as customer_models
+from store import models as store_models
+
+TOP_K = 8
+PURCHASE_WEIGHT = 1.0
+WISHLIST_WEIGHT = 0.5
+CATEGORY_BONUS = 0.1
+MAX_BASKET = 50
+CHUNK_SIZE = 5000
+
+
+def _baskets(rows):
+    """Группирует упорядоченные пары (ключ, товар) в множества товаров"""
+    for _, group in groupby(rows, key=itemgetter(0)):
+        basket = {product_id for _, product_id in group}
+        if len(basket) > 1:
+            yield sorted(basket)[:MAX_BASKET]
+
+
+def _count(baskets, weight, products, freq, pairs):
+    for basket in baskets:
+        basket = [product_id for product_id in basket if product_id in products]
+        for product_id in basket:
+            freq[product_id] += weight
+        for a, b in combinations(basket, 2):
+            pairs[a][b] += weight
+            pairs[b][a] += weight
+
+
+def compute_index(top_k=TOP_K):
+    """
+    Считает рекомендации по заказам и избранному
+
+    Returns:
+        dict: product_id -> [(recommended_id, score)] по убыванию score
+    """
+    # Рекомендуются только опубликованные товары
+    products = dict(
+        store_models.Product.objects.filter(status="Published").values_list('id', 'category_id').iterator(CHUNK_SIZE)
+    )
+    freq = Counter()
+    pairs = defaultdict(Counter)
+
+    orders = store_models.OrderItem.objects.filter(order__payment_status="Paid").order_by('order_id').values_list(
+        'order_id', 'product_id'
+    )
+    _count(_baskets(orders.iterator(CHUNK_SIZE)), PURCHASE_WEIGHT, products, freq, pairs)
+
+    wishlists = customer_models.Wishlist.objects.filter(user__isnull=False).order_by('user_id').values_list(
+        'user_id', 'product_id'
+    )
+    _count(_baskets(wishlists.iterator(CHUNK_SIZE)), WISHLIST_WEIGHT, products, freq, pairs)
+
+    # Популярные товары категории для заполнения недостающих мест
+    popular = defaultdict(list)
+    for product_id, category_id in store_models.Product.objects.filter(
+        status="Published", category__isnull=False,
+    ).order_by('category_id', '-rating_count', '-id').values_list('id', 'category_id').iterator(CHUNK_SIZE):
+        if len(popular[category_id]) <= top_k:
+            popular[category_id].append(product_id)
+
+    index = {}
+    for product_id, category_id in products.items():
+        scores = {}
+        for other_id, co in pairs.get(product_id, {}).items():
+            score = co / math.sqrt(freq[product_id] * freq[other_id])
+            if category_id and products[other_id] == category_id:
+                score += CATEGORY_BONUS
+            scores[other_id] = score
+        best = heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+        if len(best) < top_k and category_id:
+            chosen = {other_id for other_id, _ in best}
+            fill = [other_id for other_id in popular[category_id] if other_id != product_id and other_id not in chosen]
+            best += [(other_id, 0.0) for other_id in fill[:top_k - len(best)]]
+        if best:
+            index[product_id] = best
+    return index
+
+
+def build_index(top_k=TOP_K):
+    """Пересчитывает и заменяет индекс целиком; возвращает (товаров, строк)"""
+    index = compute_index(top_k)
+    rows = [
+        store_models.ProductRecommendation(
+            product_id=product_id, recommended_id=other_id, rank=rank, score=round(score, 6),
+        )
+        for product_id, recommendations in index.items()
+        for rank, (other_id, score) in enumerate(recommendations)
+    ]
+    with transaction.atomic():
+        store_models.ProductRecommendation.objects.all().delete()
+        store_models.ProductRecommendation.objects.bulk_create(rows, batch_size=1000)
+    return len(index), len(rows)
+
+
+def recommended_products(product_id, limit=TOP_K):
+    """Рекомендации товара одним запросом по индексу (product, rank)"""
+    return [
+        row.recommended
+        for row in store_models.ProductRecommendation.objects.filter(
+            product_id=product_id, recommended__status="Published",
+        ).select_related('recommended__category').order_by('rank')[:limit]
+    ]
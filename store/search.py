@@ -0,0 +1,326 @@
+"""
+Полнотекстовый поиск товаров
+
+Для каждого товара заранее собирается документ (название, бренд, категория,
+описание без HTML), который индексируется средствами БД:
+- PostgreSQL: колонка search_vector (tsvector, конфигурация 'russian' - она же
+  стеммит латиницу английским стеммером) с GIN индексом
+- SQLite: виртуальная таблица FTS5 со стеммированным документом (dev режим)
+- прочие БД: icontains по search_document (без стемминга)
+
+Поиск фильтрует и ранжирует queryset одним SQL запросом по индексу, а не
+последовательным сканированием описаний.
+Документы обновляются сигналами при сохранении товара (store.signals).
+Автодополнение перестраивается периодически (SUGGEST_TTL), а не на каждое
+сохранение товара.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.db import connection, OperationalError, ProgrammingError
+from django.db.models import F, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'store_product_fts'
+INDEX_CHUNK = 500  # товаров на пачку index_products
+SEARCH_CONFIG = 'russian'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Окончания для лёгкого стемминга (от длинных к коротким)
+RU_ENDINGS = (
+    'иями', 'ями', 'ами', 'иях', 'ией', 'иям', 'ием', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ой', 'ей', 'ий', 'ый', 'ых', 'их',
+    'ов', 'ев', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ия', 'ию', 'ью',
+    'ы', 'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь', 'й',
+)
+EN_ENDINGS = ('ing', 'ies', 'es', 'ed', 'ly', 's')
+MIN_STEM = 3
+
+
+def stem(word):
+    """Лёгкий стеммер для русского и английского: отрезает словоизменительные окончания"""
+    word = word.lower().replace('ё', 'е')
+    endings = EN_ENDINGS if word.isascii() else RU_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            if ending == 'ies':
+                return word[:-3] + 'y'
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    return [token.lower() for token in WORD_RE.findall(text or '')]
+
+
+def build_document(product):
+    """Текст для индексации: название, бренд, категория, сезон, материал и описание"""
+    parts = [
+        product.name,
+        product.brand,
+        product.category.title if product.category_id and product.category else None,
+        product.season,
+        product.material,
+        strip_tags(product.description or ''),
+    ]
+    return ' '.join(part for part in parts if part)
+
+
+def stemmed(text):
+    return ' '.join(stem(token) for token in tokenize(text))
+
+
+# ========== ИНДЕКСАЦИЯ ==========
+
+def _vendor():
+    return connection.vendor
+
+
+def index_products(product_ids):
+    """
+    Пересобирает поисковые документы указанных товаров пачками по INDEX_CHUNK:
+    на пачку один SELECT, один UPDATE документов и одна запись в индекс БД -
+    переименование категории не делает запрос на каждый её товар
+    """
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), INDEX_CHUNK):
+        _index_chunk(product_ids[start:start + INDEX_CHUNK])
+
+
+def _index_chunk(product_ids):
+    from store import models as store_models
+
+    products = list(
+        store_models.Product.objects.filter(id__in=product_ids).select_related('category')
+        .only('id', 'name', 'brand', 'season', 'material', 'description', 'category__title')
+    )
+    for product in products:
+        product.search_document = build_document(product)
+    # bulk_update не вызывает сигналы - нет рекурсии через post_save
+    store_models.Product.objects.bulk_update(products, ['search_document'])
+    _index_backend({product.pk: product.search_document for product in products})
+
+    found = {product.pk for product in products}
+    missing = set(product_ids) - found
+    if missing:
+        remove_products(missing)
+
+    if found and _vendor() == 'postgresql':
+        from django.contrib.postgres.search import SearchVector
+        store_models.Product.objects.filter(id__in=found).update(
+            search_vector=SearchVector('search_document', config=SEARCH_CONFIG)
+        )
+
+
+def _index_backend(documents):
+    """{id товара: документ} -> таблица FTS5 (только SQLite)"""
+    if not documents or _vendor() != 'sqlite':
+        return
+    try:
+        with connection.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(documents))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', list(documents))
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s)',
+                [(product_id, stemmed(document)) for product_id, document in documents.items()]
+            )
+    except (OperationalError, ProgrammingError) as e:
+        logger.warning(f"FTS5 index is unavailable: {e}")
+
+
+def remove_products(product_ids):
+    product_ids = list(product_ids)
+    if not product_ids or _vendor() != 'sqlite':
+        return
+    try:
+        with connection.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+    except (OperationalError, ProgrammingError) as e:
+        logger.warning(f"FTS5 index is unavailable: {e}")
+
+
+# ========== ПОИСК ==========
+
+_fts_ready = None
+
+
+def _fts_available():
+    """Есть ли таблица FTS5 (проверяется один раз на процесс)"""
+    global _fts_ready
+    if _fts_ready is None:
+        try:
+            _fts_ready = FTS_TABLE in connection.introspection.table_names()
+        except (OperationalError, ProgrammingError):
+            _fts_ready = False
+    return _fts_ready
+
+
+def apply_search(queryset, query):
+    """
+    Ограничивает queryset результатами поиска и добавляет аннотацию search_rank
+    (больше - релевантнее). Фильтр и ранг считаются в том же SQL запросе,
+    без промежуточного списка id - результат не обрезается.
+
+    Returns:
+        tuple: (queryset, ranked) - ranked=True, если можно сортировать order_by_relevance
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.none(), False
+
+    vendor = _vendor()
+
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        # Префиксный поиск по каждому слову: 'крос:* & nike:*'
+        search_query = SearchQuery(
+            ' & '.join(f'{token}:*' for token in tokens),
+            config=SEARCH_CONFIG, search_type='raw'
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ), True
+
+    if vendor == 'sqlite' and _fts_available():
+        match = ' '.join(f'"{stem(token)}"*' for token in tokens)
+        table = queryset.model._meta.db_table
+        # bm25 меньше у более релевантных строк - знак меняется, чтобы сортировка совпадала с PostgreSQL
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        ).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id',
+            [match], output_field=FloatField()
+        )), True
+
+    for token in tokens:
+        queryset = queryset.filter(search_document__icontains=token)
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())), True
+
+
+def order_by_relevance(queryset, ranked=True):
+    """Сортирует результат apply_search по релевантности"""
+    if not ranked:
+        return queryset
+    return queryset.order_by('-search_rank', '-id')
+
+
+def search_product_ids(query, limit=None):
+    """
+    Возвращает id опубликованных товаров, подходящих под запрос,
+    отсортированные по релевантности (все или не более limit)
+    """
+    from store import models as store_models
+
+    queryset, ranked = apply_search(store_models.Product.objects.filter(status="Published"), query)
+    ids = order_by_relevance(queryset, ranked).values_list('id', flat=True)
+    return list(ids[:limit] if limit else ids)
+
+
+# ========== АВТОДОПОЛНЕНИЕ ==========
+
+SUGGEST_LIMIT = 10
+# Индекс автодополнения перестраивается не чаще раза в SUGGEST_TTL секунд на процесс
+SUGGEST_TTL = 600
+# Верхняя граница кандидатов на одну триграмму - защищает от слишком частых триграмм
+MAX_POSTING = 5000
+
+
+def _trigrams(text):
+    text = f'  {text} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class Suggester:
+    """
+    Триграммный индекс названий и брендов опубликованных товаров
+
+    Опечатки переживаются за счёт частичного совпадения триграмм:
+    "кросовки" и "кроссовки" делят большую часть триграмм.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.postings = {}
+        for position, entry in enumerate(entries):
+            for trigram in _trigrams(entry['key']):
+                self.postings.setdefault(trigram, []).append(position)
+
+    @classmethod
+    def build(cls):
+        from store import models as store_models
+
+        entries = [
+            {'name': name, 'slug': slug, 'brand': brand,
+             'key': ' '.join(tokenize(f'{name} {brand or ""}'))}
+            for name, slug, brand in store_models.Product.objects.filter(
+                status="Published").exclude(slug__isnull=True).values_list('name', 'slug', 'brand')
+        ]
+        return cls(entries)
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        query = ' '.join(tokenize(query))
+        if not query:
+            return []
+        query_trigrams = _trigrams(query)
+        hits = Counter()
+        for trigram in query_trigrams:
+            posting = self.postings.get(trigram)
+            if posting and len(posting) <= MAX_POSTING:
+                hits.update(posting)
+
+        scored = []
+        for position, shared in hits.most_common(limit * 5):
+            entry = self.entries[position]
+            score = shared / len(query_trigrams)
+            if entry['key'].startswith(query):
+                score += 1
+            scored.append((score, position))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+
+        return [
+            {'name': self.entries[position]['name'], 'slug': self.entries[position]['slug'],
+             'brand': self.entries[position]['brand']}
+            for score, position in scored[:limit] if score >= 0.3
+        ]
+
+
+_suggester = None
+_suggester_built = 0.0
+_suggester_lock = threading.Lock()
+
+
+def get_suggester():
+    """
+    Индекс автодополнения процесса. Устаревший индекс перестраивает один поток,
+    остальные в это время отвечают по старому индексу.
+    """
+    global _suggester, _suggester_built
+    if _suggester is not None and time.monotonic() - _suggester_built < SUGGEST_TTL:
+        return _suggester
+    if _suggester is None:
+        with _suggester_lock:
+            if _suggester is None:
+                _suggester = Suggester.build()
+                _suggester_built = time.monotonic()
+        return _suggester
+    if _suggester_lock.acquire(blocking=False):
+        try:
+            _suggester = Suggester.build()
+            _suggester_built = time.monotonic()
+        finally:
+            _suggester_lock.release()
+    return _suggester
+
+
+def suggest(query, limit=SUGGEST_LIMIT):
+    return get_suggester().suggest(query, limit=limit)
@@ -0,0 +1,140 @@
+"""
+Сигналы магазина: поддержка производных данных каталога в актуальном состоянии
+"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from store import facets
+from store import fragments
+from store import inventory
+from store import ratings
+from store import search
+from store.context import invalidate_categories
+from store import models as store_models
+
+
+def _on_commit_mark_dirty(*product_ids):
+    # Фасетный индекс и кэш карточек товаров
+    transaction.on_commit(lambda: (facets.mark_dirty(*product_ids), fragments.bump(*product_ids)))
+
+
+@receiver([post_save, post_delete], sender=store_models.Product)
+def product_changed(sender, instance, **kwargs):
+    _on_commit_mark_dirty(instance.pk)
+
+
+@receiver(post_save, sender=store_models.Product)
+def product_saved_reindex(sender, instance, update_fields=None, **kwargs):
+    # Сохранения служебных полей (например, агрегатов) не меняют поисковый документ
+    if update_fields and not set(update_fields) & {'name', 'brand', 'category', 'season', 'material', 'description', 'status'}:
+        return
+    product_id = instance.pk
+    transaction.on_commit(lambda: search.index_products([product_id]))
+
+
+@receiver(post_delete, sender=store_models.Product)
+def product_deleted_unindex(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: search.remove_products([product_id]))
+
+
+@receiver([post_save, post_delete], sender=store_models.ProductVariant)
+def product_variant_changed(sender, instance, **kwargs):
+    _on_commit_mark_dirty(instance.product_id)
+
+
+@receiver(post_save, sender=store_models.ProductVariant)
+def product_variant_stock_changed(sender, instance, update_fields=None, **kwargs):
+    # Флаги наличия следуют за остатком (UPDATE без сигналов)
+    if update_fields is None or {'stock', 'is_available'} & set(update_fields):
+        inventory.refresh_flags(instance.product_id)
+
+
+@receiver(post_delete, sender=store_models.ProductVariant)
+def product_variant_deleted(sender, instance, **kwargs):
+    inventory.refresh_flags(instance.product_id)
+
+
+@receiver(pre_save, sender=store_models.Product)
+def product_remember_stock(sender, instance, update_fields=None, **kwargs):
+    instance._previous_stock = None
+    if instance.pk and (update_fields is None or 'stock' in update_fields):
+        instance._previous_stock = sender.objects.filter(pk=instance.pk).values_list('stock', flat=True).first()
+
+
+@receiver(post_save, sender=store_models.Product)
+def product_stock_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    # Флаги наличия следуют за остатком; сохранение без изменения остатка
+    # (в том числе вручную выставленный in_stock) флаги не пересчитывает
+    if created:
+        inventory.refresh_flags(instance.pk)
+    elif (update_fields is None or 'stock' in update_fields) and getattr(instance, '_previous_stock', None) != instance.stock:
+        inventory.refresh_flags(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=store_models.Variant)
+def variant_changed(sender, instance, **kwargs):
+    _on_commit_mark_dirty(instance.product_id)
+
+
+@receiver([post_save, post_delete], sender=store_models.VariantItem)
+def variant_item_changed(sender, instance, **kwargs):
+    product_id = store_models.Variant.objects.filter(
+        id=instance.variant_id
+    ).values_list('product_id', flat=True).first()
+    _on_commit_mark_dirty(product_id)
+
+
+@receiver([post_save, post_delete], sender=store_models.Gallery)
+def gallery_changed(sender, instance, **kwargs):
+    product_id = instance.product_id
+    # Изображения входят в фиды - товар попадает в инкрементальную выгрузку
+    store_models.Product.objects.filter(pk=product_id).update(updated=timezone.now())
+    transaction.on_commit(lambda: fragments.bump(product_id))
+
+
+@receiver(pre_save, sender=store_models.Review)
+def review_remember_product(sender, instance, **kwargs):
+    # Если отзыв перенесли на другой товар, пересчитать нужно оба
+    instance._previous_product_id = None
+    if instance.pk:
+        instance._previous_product_id = store_models.Review.objects.filter(
+            pk=instance.pk
+        ).values_list('product_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=store_models.Review)
+def review_changed(sender, instance, **kwargs):
+    # Агрегаты пересчитываются в той же транзакции, что и изменение отзыва
+    product_ids = {instance.product_id, getattr(instance, '_previous_product_id', None)} - {None}
+    for product_id in product_ids:
+        ratings.recalculate_product_rating(product_id)
+    _on_commit_mark_dirty(*product_ids)
+
+
+@receiver([post_save, post_delete], sender=store_models.Category)
+def category_changed(sender, instance, **kwargs):
+    _on_commit_mark_dirty()
+    # Название категории есть в каждой карточке её товаров
+    transaction.on_commit(fragments.invalidate_all)
+    # Меню категорий в контекст-процессоре
+    transaction.on_commit(invalidate_categories)
+
+
+@receiver(pre_save, sender=store_models.Category)
+def category_remember_title(sender, instance, **kwargs):
+    instance._previous_title = None
+    if instance.pk:
+        instance._previous_title = sender.objects.filter(pk=instance.pk).values_list('title', flat=True).first()
+
+
+@receiver(post_save, sender=store_models.Category)
+def category_saved_reindex(sender, instance, created=False, **kwargs):
+    # Название категории входит в поисковый документ её товаров: переиндексация
+    # (пачками, search.index_products) только при переименовании
+    if created or getattr(instance, '_previous_title', None) == instance.title:
+        return
+    product_ids = list(store_models.Product.objects.filter(category=instance).values_list('id', flat=True))
+    transaction.on_commit(lambda: search.index_products(product_ids))
@@ -0,0 +1,242 @@
+"""
+Sitemap и robots.txt, заранее записанные на диск
+
+build (команда build_sitemaps) пишет в SITEMAPS_DIR:
+- sitemap-products-<n>.xml.gz, sitemap-blog-<n>.xml.gz - шарды по диапазонам
+  ID (SHARD_SIZE = 50 000 ID - не больше 50 000 URL, лимит протокола)
+- sitemap-categories-0.xml.gz, sitemap-pages-0.xml.gz - категории и
+  статические страницы
+- sitemap.xml (и sitemap.xml.gz) - индекс шардов, robots.txt со ссылкой на него
+
+Шард переписывается, только если изменилась его подпись: для товаров и
+статей - (число строк, последнее изменение) одним GROUP BY по шардам, для
+маленьких разделов - хэш содержимого. Правка, публикация, снятие с публикации
+и удаление меняют подпись только своего шарда. Подписи хранятся в state.json.
+
+Файлы отдаёт nginx из корня сайта (URL в sitemap должны быть не выше его
+каталога); views.sitemap_file и views.robots_txt отдают те же файлы, если
+nginx нет. Запросы краулеров в базу не ходят.
+"""
+import gzip
+import hashlib
+import json
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from blog import models as blog_models
+from store import models as store_models
+from store.feeds import write_atomic
+
+SHARD_SIZE = 50000
+CHUNK_SIZE = 5000
+STATE_FILE = 'state.json'
+INDEX_FILE = 'sitemap.xml'
+ROBOTS_FILE = 'robots.txt'
+
+STATIC_PAGES = [
+    'store:index', 'store:shop', 'blog:blog_list', 'store:about', 'store:contact', 'store:faqs',
+    'store:privacy_policy', 'store:terms_conditions',
+]
+# Личные кабинеты, корзина, оплата и служебные адреса
+DISALLOW = [
+    '/admin/', '/auth/', '/customer/', '/vendor/', '/password-reset/', '/ckeditor5/',
+    '/cart/', '/create_order/', '/checkout/', '/coupon_apply/', '/payment_status/',
+    '/add_to_cart/', '/delete_cart_item/', '/api/', '/webhooks/', '/order_tracker_detail/', '/feeds/',
+]
+
+
+def _absolute(path):
+    return settings.SITE_URL.rstrip('/') + path
+
+
+def _locator(viewname):
+    # Префикс и суффикс URL считаются один раз, а не reverse() на каждую строку
+    marker = 'SITEMAP-SLOT'
+    prefix, suffix = reverse(viewname, args=[marker]).split(marker)
+    return lambda value: _absolute(prefix + quote(str(value), safe='') + suffix)
+
+
+def _lastmod(value):
+    return value.isoformat(timespec='seconds') if value else ''
+
+
+def filename(key):
+    return f"sitemap-{key}.xml.gz"
+
+
+# ========== РАЗДЕЛЫ ==========
+
+class Section:
+    """Раздел, разбитый на шарды по ID: queryset опубликованных строк, поле URL и поле даты изменения"""
+    __slots__ = ('name', 'queryset', 'viewname', 'field', 'modified')
+
+    def __init__(self, name, queryset, viewname, field, modified):
+        self.name = name
+        self.queryset = queryset
+        self.viewname = viewname
+        self.field = field
+        self.modified = modified
+
+    def signatures(self):
+        """Номер шарда -> (число URL, последнее изменение): один GROUP BY"""
+        rows = self.queryset().annotate(shard=F('id') / SHARD_SIZE).values('shard').annotate(
+            urls=Count('id'), modified=Max(self.modified),
+        ).order_by()
+        return {row['shard']: [row['urls'], _lastmod(row['modified'])] for row in rows}
+
+    def entries(self, shard):
+        locate = _locator(self.viewname)
+        rows = self.queryset().filter(
+            id__gte=shard * SHARD_SIZE, id__lt=(shard + 1) * SHARD_SIZE,
+        ).order_by('id').values_list(self.field, self.modified)
+        for value, modified in rows.iterator(CHUNK_SIZE):
+            yield locate(value), _lastmod(modified)
+
+
+SECTIONS = [
+    Section(
+        'products',
+        lambda: store_models.Product.objects.filter(status="Published").exclude(slug__isnull=True).exclude(slug=''),
+        'store:product_detail', 'slug', 'updated',
+    ),
+    Section(
+        'blog',
+        lambda: blog_models.Blog.objects.filter(status="Published").exclude(slug=''),
+        'blog:blog_detail', 'slug', 'date',
+    ),
+]
+
+
+def category_entries():
+    """Категории; дата изменения - последнее изменение опубликованного товара категории"""
+    locate = _locator('store:category')
+    rows = store_models.Category.objects.annotate(
+        modified=Max('product__updated', filter=Q(product__status="Published")),
+    ).order_by('id').values_list('id', 'modified')
+    return [(locate(category_id), _lastmod(modified)) for category_id, modified in rows]
+
+
+def page_entries():
+    return [(_absolute(reverse(viewname)), '') for viewname in STATIC_PAGES]
+
+
+# ========== ФАЙЛЫ ==========
+
+def _urlset(entries):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    for loc, lastmod in entries:
+        lastmod = f'<lastmod>{lastmod}</lastmod>' if lastmod else ''
+        parts.append(f'<url><loc>{_escape(loc)}</loc>{lastmod}</url>\n')
+    parts.append('</urlset>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def _escape(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _write_gzip(path, content):
+    def write(raw):
+        with gzip.GzipFile(filename=os.path.basename(path)[:-3], mode='wb', fileobj=raw) as archive:
+            archive.write(content)
+    write_atomic(path, write)
+
+
+def _index(shards):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    for key, shard in sorted(shards.items()):
+        lastmod = f"<lastmod>{shard['lastmod']}</lastmod>" if shard['lastmod'] else ''
+        parts.append(f"<sitemap><loc>{_escape(_absolute('/' + filename(key)))}</loc>{lastmod}</sitemap>\n")
+    parts.append('</sitemapindex>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def robots():
+    lines = ['User-agent: *']
+    lines += [f'Disallow: {path}' for path in DISALLOW]
+    lines += ['', f"Sitemap: {_absolute('/' + INDEX_FILE)}", '']
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def load_state(directory):
+    try:
+        with open(os.path.join(directory, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'shards': {}}
+
+
+def build(force=False, directory=None):
+    """
+    Переписывает изменившиеся шарды, индекс и robots.txt
+
+    Returns:
+        tuple: (записано шардов, без изменений, удалено)
+    """
+    directory = directory or settings.SITEMAPS_DIR
+    os.makedirs(directory, exist_ok=True)
+    state = load_state(directory)
+    previous = state['shards']
+    shards = {}
+    written = unchanged = 0
+
+    def update(key, signature, lastmod, entries):
+        nonlocal written, unchanged
+        path = os.path.join(directory, filename(key))
+        old = previous.get(key)
+        if not force and old and old['signature'] == signature and os.path.exists(path):
+            shards[key] = old
+            unchanged += 1
+            return
+        _write_gzip(path, _urlset(entries()))
+        shards[key] = {'signature': signature, 'lastmod': lastmod}
+        written += 1
+
+    for section in SECTIONS:
+        for shard, signature in sorted(section.signatures().items()):
+            update(f'{section.name}-{shard}', signature, signature[1],
+                   lambda section=section, shard=shard: section.entries(shard))
+
+    # Маленькие разделы строятся целиком, файл переписывается при изменении содержимого
+    now = _lastmod(timezone.now())
+    for name, entries in (('categories', category_entries()), ('pages', page_entries())):
+        if entries:
+            signature = hashlib.sha1(repr(entries).encode('utf-8')).hexdigest()
+            update(f'{name}-0', signature, now, lambda entries=entries: entries)
+
+    removed = set(previous) - set(shards)
+    for key in removed:
+        path = os.path.join(directory, filename(key))
+        if os.path.exists(path):
+            os.unlink(path)
+
+    index_path = os.path.join(directory, INDEX_FILE)
+    if written or removed or force or not os.path.exists(index_path):
+        index = _index(shards)
+        write_atomic(index_path, lambda raw: raw.write(index))
+        _write_gzip(index_path + '.gz', index)
+
+    content = robots()
+    robots_path = os.path.join(directory, ROBOTS_FILE)
+    if force or _read(robots_path) != content:
+        write_atomic(robots_path, lambda raw: raw.write(content))
+
+    state['shards'] = shards
+    state['built'] = now
+    payload = json.dumps(state, indent=2).encode('utf-8')
+    write_atomic(os.path.join(directory, STATE_FILE), lambda raw: raw.write(payload))
+    return written, unchanged, len(removed)
+
@@ -1,96 +1,80 @@
 """
 Template tags for currency formatting
+
+All tags use the request-scoped PriceFormatter (plugin.currency.get_price_formatter):
+currency, exchange rate and number format are resolved once per request.
 """
 from django import template
-from plugin.currency import convert_price, format_price, get_user_currency
+from plugin.currency import CURRENCY_SYMBOLS, PriceFormatter, USD_FORMATTER, get_price_formatter
 
 register = template.Library()
 
+def _formatter(context, currency_code=None):
+    if currency_code:
+        formatter = get_price_formatter(context.get('request'))
+        if formatter.currency_code == currency_code:
+            return formatter
+        return PriceFormatter(currency_code)
+    formatter = context.get('price_formatter')
+    if formatter is None:
+        formatter = get_price_formatter(context.get('request'))
+    return formatter
+
 @register.simple_tag(takes_context=True)
 def format_currency(context, price, currency_code=None):
     """
     Format price with currency based on user's location
-    
+
     Usage: {% format_currency product.price %}
     """
     try:
-        request = context.get('request')
-        
-        if not currency_code and request:
-            try:
-                currency_code = get_user_currency(request)
-            except Exception:
-                currency_code = 'USD'
-        elif not currency_code:
-            currency_code = 'USD'
-        
-        # Convert price if needed
-        try:
-            price_float = float(price) if price else 0.0
-            if currency_code != 'USD':
-                converted_price = convert_price(price_float, currency_code)
-            else:
-                converted_price = price_float
-            
-            return format_price(converted_price, currency_code)
-        except (ValueError, TypeError):
-            # If price conversion fails, return as USD
-            return format_price(float(price) if price else 0.0, 'USD')
+        return _formatter(context, currency_code).format(price)
     except Exception:
         # Fallback to USD if anything goes wrong
         try:
-            return format_price(float(price) if price else 0.0, 'USD')
-        except:
+            return USD_FORMATTER.format(price)
+        except Exception:
             return '$0.00'
 
 @register.simple_tag(takes_context=True)
 def get_price(context, price, currency_code=None):
     """
     Get converted price without formatting
-    
+
     Usage: {% get_price product.price %}
     """
     try:
-        request = context.get('request')
-        
-        if not currency_code and request:
-            try:
-                currency_code = get_user_currency(request)
-            except Exception:
-                currency_code = 'USD'
-        elif not currency_code:
-            currency_code = 'USD'
-        
-        try:
-            price_float = float(price) if price else 0.0
-            if currency_code != 'USD':
-                converted_price = convert_price(price_float, currency_code)
-            else:
-                converted_price = price_float
-            
-            return converted_price
-        except (ValueError, TypeError):
-            return float(price) if price else 0.0
+        return _formatter(context, currency_code).convert(price)
     except Exception:
         try:
             return float(price) if price else 0.0
-        except:
+        except Exception:
             return 0.0
 
+@register.simple_tag(takes_context=True)
+def prices_for(context, products, *fields):
+    """
+    Format prices of a whole product list in one pass
+    Sets display_<field> on every product (default fields: price, regular_price)
+
+    Usage: {% prices_for products %} ... {{ p.display_price }} {{ p.display_regular_price }}
+    """
+    formatter = _formatter(context)
+    fields = fields or ('price', 'regular_price')
+    for product in products:
+        for field in fields:
+            try:
+                value = formatter.format(getattr(product, field, None))
+            except Exception:
+                value = USD_FORMATTER.format(getattr(product, field, None))
+            setattr(product, f'display_{field}', value)
+    return ''
+
 @register.simple_tag(takes_context=True)
 def get_currency_symbol(context):
     """
     Get currency symbol for current user
-    
+
     Usage: {% get_currency_symbol %}
     """
-    from plugin.currency import CURRENCY_SYMBOLS, get_user_currency
-    
-    request = context.get('request')
-    if request:
-        currency_code = get_user_currency(request)
-    else:
-        currency_code = 'USD'
-    
-    return CURRENCY_SYMBOLS.get(currency_code, '$')
-
+    return CURRENCY_SYMBOLS.get(_formatter(context).currency_code, '$')
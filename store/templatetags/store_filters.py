@@ -1,5 +1,6 @@
 from django import template
 from django.http import QueryDict
+from django.utils.safestring import mark_safe
 
 register = template.Library()
 
@@ -58,3 +59,14 @@ def length_is(value, arg):
         return False
 
 
+@register.simple_tag(takes_context=True)
+def product_cards(context, products, template_name):
+    """
+    Список карточек товаров из кэша фрагментов (store.fragments)
+    Использование: {% product_cards products 'partials/_store_card.html' %}
+    """
+    from plugin.currency import get_price_formatter
+    from store.fragments import render_cards
+
+    formatter = context.get('price_formatter') or get_price_formatter(context.get('request'))
+    return mark_safe(''.join(render_cards(products, template_name, formatter)))
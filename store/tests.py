@@ -1,3 +1,313 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from customer import models as customer_models
+from store import cart as cart_service
+from store import feeds
+from store import inventory
+from store import outbox
+from store import payments
+from store import models as store_models
+from store import product_page
+from store import search
+from store import webhooks
+from store.orders import create_order_from_cart
+from userauths.models import User
+
+
+def create_user(name):
+    return User.objects.create(email=f'{name}@example.com', username=name)
+
+
+def create_product(index, vendor, **kwargs):
+    values = {
+        'name': f'Товар {index}', 'description': '', 'price': Decimal('10.00'),
+        'shipping': Decimal('1.00'), 'stock': 100, 'vendor': vendor,
+    }
+    values.update(kwargs)
+    return store_models.Product.objects.create(**values)
+
+
+class CreateOrderQueriesTests(TestCase):
+    """Число запросов при оформлении заказа не зависит от числа позиций и продавцов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = create_user('customer')
+        cls.address = customer_models.Address.objects.create(user=cls.customer, full_name='Покупатель', country='India')
+        vendors = [create_user(f'vendor{i}') for i in range(3)]
+        cls.products = [create_product(i, vendors[i % len(vendors)]) for i in range(12)]
+
+    def fill_cart(self, cart_id, products):
+        for product in products:
+            cart_service.add_item(cart_id, product, qty=2)
+
+    def test_query_count_does_not_grow_with_cart(self):
+        self.fill_cart('small-cart', self.products[:1])
+        with CaptureQueriesContext(connection) as small:
+            create_order_from_cart(self.customer, self.address, 'small-cart')
+
+        self.fill_cart('large-cart', self.products[1:])
+        with self.assertNumQueries(len(small.captured_queries)):
+            order = create_order_from_cart(self.customer, self.address, 'large-cart')
+
+        self.assertEqual(store_models.OrderItem.objects.filter(order=order).count(), 11)
+        self.assertEqual(order.vendors.count(), 3)
+        self.assertEqual(order.sub_total, Decimal('220.00'))
+        self.assertEqual(order.shipping, Decimal('22.00'))
+        self.assertEqual(store_models.StockReservation.objects.filter(order=order).count(), 11)
+
+    def test_refuses_order_when_stock_is_short(self):
+        product = create_product(99, None, stock=3)
+        # Активный резерв другой корзины занимает две единицы из трёх
+        inventory.reserve('other-cart', product, 2)
+        self.fill_cart('short-cart', [product])
+
+        with self.assertRaises(inventory.OutOfStock) as raised:
+            create_order_from_cart(self.customer, self.address, 'short-cart')
+
+        self.assertEqual(raised.exception.available, 1)
+        self.assertFalse(store_models.Order.objects.filter(cart_id='short-cart').exists())
+
+
+class ProductPageQueriesTests(TestCase):
+    """Число запросов страницы товара не растёт с галереей, вариантами и отзывами"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reviewer')
+        cls.product = create_product(0, create_user('vendor'), slug='product-page')
+
+    def add_rows(self, step, count):
+        product = self.product
+        store_models.Gallery.objects.bulk_create([store_models.Gallery(product=product) for _ in range(count)])
+        for i in range(count):
+            variant = store_models.Variant.objects.create(product=product, name=f'Вариант {step}-{i}')
+            store_models.VariantItem.objects.bulk_create([
+                store_models.VariantItem(variant=variant, title=f'Элемент {j}', content=str(j)) for j in range(3)
+            ])
+        store_models.ProductVariant.objects.bulk_create([
+            store_models.ProductVariant(product=product, size=f'S{step}-{i}', stock=1) for i in range(count)
+        ])
+        store_models.Review.objects.bulk_create([
+            store_models.Review(product=product, user=self.user, rating=5, active=True, review='Отзыв')
+            for _ in range(count)
+        ])
+
+    def render(self):
+        """Загрузка и обход данных так же, как в шаблоне store/product_detail.html"""
+        product = product_page.load_product(self.product.slug)
+        values = [product.category and product.category.title, product.vendor]
+        values += [image.image for image in product.gallery()]
+        values += [(item.title, item.content) for variant in product.variants() for item in variant.items()]
+        values += [(pv.size, pv.color) for pv in product.product_variants.all()]
+        values += [review.user and review.user.username for review in product.approved_reviews]
+        return len(values)
+
+    def test_query_count_does_not_grow_with_gallery_and_variants(self):
+        # Базовое число - по одной строке каждого вида (без вариантов элементы не запрашиваются)
+        self.add_rows(0, 1)
+        with CaptureQueriesContext(connection) as baseline:
+            small = self.render()
+
+        self.add_rows(1, 10)
+        with self.assertNumQueries(len(baseline.captured_queries)):
+            large = self.render()
+        self.assertLess(small, large)
+
+
+@override_settings(FEEDS_TOKEN='feed-token')
+class ProductFeedTests(TestCase):
+    """Живой фид: только персоналу или по токену; снятые с публикации товары - только ID и доступность"""
+
+    @classmethod
+    def setUpTestData(cls):
+        vendor = create_user('vendor')
+        cls.published = create_product(0, vendor, description='Описание товара')
+        cls.draft = create_product(1, vendor, status="Draft", description='Секретное описание')
+
+    def test_requires_staff_or_token(self):
+        url = reverse('store:product_feed', args=['csv'])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, {'token': 'wrong'}).status_code, 403)
+        self.assertEqual(self.client.get(url, {'token': 'feed-token'}).status_code, 200)
+
+        staff = create_user('staff')
+        staff.is_staff = True
+        staff.save()
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_changes_hide_details_of_unpublished_products(self):
+        since = timezone.now() - timedelta(days=1)
+        content = ''.join(feeds.csv_feed(since))
+        self.assertIn(self.draft.sku, content)
+        self.assertNotIn(self.draft.name, content)
+        self.assertNotIn('Секретное описание', content)
+        self.assertIn('Описание товара', content)
+
+        full = ''.join(feeds.csv_feed())
+        self.assertNotIn(self.draft.sku, full)
+
+
+@mock.patch('store.payments.get_payment_rate', return_value=Decimal('1500'))
+class PaymentWebhookTests(TestCase):
+    """Событие оплаты завершает заказ, только если сумма и валюта совпадают с заказом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.order = store_models.Order.objects.create(customer=create_user('customer'), total=Decimal('20.00'))
+
+    def paystack_event(self, event_id, amount_in_kobo, currency='NGN'):
+        return store_models.PaymentEvent.objects.create(gateway="Paystack", event_id=event_id, payload={
+            'event': 'charge.success',
+            'data': {
+                'status': 'success', 'reference': event_id, 'currency': currency, 'amount': amount_in_kobo,
+                'metadata': {'order_id': self.order.order_id},
+            },
+        })
+
+    def test_rejects_underpaid_event(self, rate):
+        event = self.paystack_event('low', 100 * 100)
+        self.assertEqual(webhooks.process_batch(), (0, 0, 1))
+
+        event.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(event.status, "Failed")
+        self.assertEqual(self.order.payment_status, "Processing")
+
+    def test_rejects_other_currency(self, rate):
+        self.paystack_event('ghs', 30000 * 100, currency='GHS')
+        webhooks.process_batch()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, "Processing")
+
+    def test_pays_order_with_full_amount(self, rate):
+        # 20 USD по курсу 1500 = 30 000 NGN
+        event = self.paystack_event('full', 30000 * 100)
+        self.assertEqual(webhooks.process_batch(), (1, 0, 0))
+
+        event.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(event.status, "Processed")
+        self.assertEqual(self.order.payment_status, "Paid")
+        self.assertEqual(self.order.payment_id, 'full')
+
+
+@override_settings(PAYSTACK_PRIVATE_KEY='sk_test')
+@mock.patch('store.payments.get_payment_rate', return_value=Decimal('1500'))
+class PaymentVerifyTests(TestCase):
+    """Callback шлюза оплачивает заказ, только если платёж сделан для этого заказа на его сумму"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.order = store_models.Order.objects.create(customer=create_user('customer'), total=Decimal('20.00'))
+
+    def confirm_paystack(self, order_id, amount_in_kobo):
+        response = mock.Mock()
+        response.json.return_value = {'status': True, 'data': {
+            'status': 'success', 'reference': 'ref-1', 'currency': 'NGN', 'amount': amount_in_kobo,
+            'metadata': {'order_id': order_id},
+        }}
+        with mock.patch('store.payments.gateway_session') as session:
+            session.return_value.get.return_value = response
+            return payments.confirm_payment(self.order, "Paystack", {'reference': 'ref-1'})
+
+    def test_rejects_payment_of_other_order(self, rate):
+        self.assertEqual(self.confirm_paystack('other', 30000 * 100), payments.FAILED)
+
+    def test_rejects_lower_amount(self, rate):
+        self.assertEqual(self.confirm_paystack(self.order.order_id, 100 * 100), payments.FAILED)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, "Processing")
+
+    def test_pays_order(self, rate):
+        self.assertEqual(self.confirm_paystack(self.order.order_id, 30000 * 100), payments.PAID)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, "Paid")
+
+
+class StockFlagsTests(TestCase):
+    """Флаг in_stock пересчитывается, только когда меняется остаток"""
+
+    def test_manual_in_stock_survives_save_without_stock_change(self):
+        product = create_product(0, None, stock=0)
+        product.refresh_from_db()
+        self.assertFalse(product.in_stock)
+
+        product.in_stock = True
+        product.name = 'Товар под заказ'
+        product.save()
+        product.refresh_from_db()
+        self.assertTrue(product.in_stock)
+
+        product.stock = 5
+        product.in_stock = False
+        product.save()
+        product.refresh_from_db()
+        self.assertTrue(product.in_stock)
+
+
+class AddToCartTests(TestCase):
+    """Количество в корзину - целое положительное число"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product(0, None)
+
+    def test_rejects_invalid_qty(self):
+        url = reverse('store:add_to_cart')
+        for qty in ('abc', '0', '-2', '1.5'):
+            response = self.client.get(url, {'id': self.product.pk, 'qty': qty, 'cart_id': 'cart'})
+            self.assertEqual(response.status_code, 400, qty)
+        self.assertFalse(store_models.Cart.objects.filter(cart_id='cart').exists())
+        self.assertFalse(store_models.StockReservation.objects.filter(cart_id='cart').exists())
+
+        response = self.client.get(url, {'id': self.product.pk, 'qty': '2', 'cart_id': 'cart'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(store_models.Cart.objects.get(cart_id='cart').qty, 2)
+
+
+class OutboxTests(TestCase):
+    """Недоступный почтовый сервер - неудачная попытка для всех писем пачки"""
+
+    @mock.patch('store.outbox.get_connection')
+    def test_connection_failure_counts_as_attempt(self, get_connection):
+        get_connection.return_value.open.side_effect = OSError("Connection refused")
+        entry = store_models.OutgoingEmail.objects.create(to='customer@example.com', subject='Заказ', template='email/order')
+
+        self.assertEqual(outbox.send_batch(), (0, 1))
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, "Pending")
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn("Connection refused", entry.last_error)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+
+class SearchIndexTests(TestCase):
+    """Переиндексация пачками: число запросов не зависит от числа товаров"""
+
+    def test_query_count_does_not_grow_with_products(self):
+        category = store_models.Category.objects.create(title='Обувь', slug='shoes')
+        small = [create_product(i, None, category=category).pk for i in range(3)]
+        large = [create_product(i, None, category=category).pk for i in range(3, 33)]
+
+        with CaptureQueriesContext(connection) as baseline:
+            search.index_products(small)
+        with self.assertNumQueries(len(baseline.captured_queries)):
+            search.index_products(large)
+
+        # Переименование категории переиндексирует её товары после коммита
+        category.title = 'Кроссовки'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        documents = store_models.Product.objects.values_list('search_document', flat=True)
+        self.assertTrue(all('Кроссовки' in document for document in documents))
@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import path, re_path
 from store import views
 
 app_name = "store"
@@ -17,6 +17,10 @@ urlpatterns = [
 
     path("filter_products/", views.filter_products, name="filter_products"),
     path("api/filter_metadata/", views.get_filter_metadata, name="filter_metadata"),
+    path("api/search_autocomplete/", views.search_autocomplete, name="search_autocomplete"),
+    path("feeds/<name>/", views.product_feed, name="product_feed"),
+    path("robots.txt", views.robots_txt, name="robots_txt"),
+    re_path(r"^(?P<name>sitemap[\w-]*\.xml(?:\.gz)?)$", views.sitemap_file, name="sitemap_file"),
     path("add_to_cart/", views.add_to_cart, name="add_to_cart"),
     path("delete_cart_item/", views.delete_cart_item, name="delete_cart_item"),
 
@@ -26,6 +30,7 @@ urlpatterns = [
     path('razorpay_payment_verify/<order_id>/', views.razorpay_payment_verify, name='razorpay_payment_verify'),
     path('paystack_payment_verify/<order_id>/', views.paystack_payment_verify, name='paystack_payment_verify'),
     path('flutterwave_payment_callback/<order_id>/', views.flutterwave_payment_callback, name='flutterwave_payment_callback'),
+    path('webhooks/payments/<gateway>/', views.payment_webhook, name='payment_webhook'),
 
     path("order_tracker_page/", views.order_tracker_page, name="order_tracker_page"),
     path("order_tracker_detail/<item_id>/", views.order_tracker_detail, name="order_tracker_detail"),
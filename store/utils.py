@@ -3,10 +3,13 @@
 Полностью переписанная логика с корректной обработкой всех фильтров
 """
 from decimal import Decimal, InvalidOperation
-from django.db.models import Q, Count, Avg, Min, Max, F
-from django.core.paginator import Paginator
+from django.db.models import F
 from django.http import QueryDict
 
+from plugin.paginate_queryset import CachedCountPaginator
+from store.facets import filter_queryset as filter_by_facet, get_index as get_facet_index
+from store.search import apply_search, order_by_relevance
+
 
 def build_product_filters(request, base_queryset, category=None):
     """
@@ -30,14 +33,11 @@ def build_product_filters(request, base_queryset, category=None):
     # Словарь для хранения выбранных фильтров (для отображения тегов)
     selected_filters = {}
     
-    # ========== ПОИСК ==========
+    # ========== ПОИСК (полнотекстовый индекс, см. store.search) ==========
     query = request.GET.get("q", "").strip()
+    search_ranking = None
     if query:
-        products_list = products_list.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(brand__icontains=query)
-        )
+        products_list, search_ranking = apply_search(products_list, query)
         selected_filters['q'] = query
     
     # ========== ФИЛЬТР ПО ЦЕНЕ (MIN/MAX) ==========
@@ -86,11 +86,8 @@ def build_product_filters(request, base_queryset, category=None):
         # Очищаем от пустых значений
         sizes_clean = [s.strip() for s in sizes_filter if s and str(s).strip()]
         if sizes_clean:
-            # Фильтр только через ProductVariant (более надежный способ)
-            products_list = products_list.filter(
-                product_variants__size__in=sizes_clean, 
-                product_variants__is_available=True
-            ).distinct()
+            # Фильтр через ProductVariant: EXISTS в SQL (без JOIN, DISTINCT и списка id)
+            products_list = filter_by_facet(products_list, 'size', sizes_clean)
             selected_filters['sizes'] = sizes_clean
     
     # ========== ФИЛЬТР ПО ЦВЕТАМ (множественный выбор) ==========
@@ -99,11 +96,8 @@ def build_product_filters(request, base_queryset, category=None):
         # Очищаем от пустых значений
         colors_clean = [c.strip() for c in colors_filter if c and str(c).strip()]
         if colors_clean:
-            # Фильтр только через ProductVariant (более надежный способ)
-            products_list = products_list.filter(
-                product_variants__color__in=colors_clean, 
-                product_variants__is_available=True
-            ).distinct()
+            # Фильтр через ProductVariant: EXISTS в SQL (без JOIN, DISTINCT и списка id)
+            products_list = filter_by_facet(products_list, 'color', colors_clean)
             selected_filters['colors'] = colors_clean
     
     # ========== ФИЛЬТР ПО БРЕНДАМ (множественный выбор) ==========
@@ -112,7 +106,7 @@ def build_product_filters(request, base_queryset, category=None):
         # Очищаем от пустых значений
         brands_clean = [b.strip() for b in brands_filter if b and str(b).strip()]
         if brands_clean:
-            products_list = products_list.filter(brand__in=brands_clean).distinct()
+            products_list = products_list.filter(brand__in=brands_clean)
             selected_filters['brands'] = brands_clean
     
     # ========== ФИЛЬТР ПО СЕЗОНУ (множественный выбор) ==========
@@ -121,7 +115,7 @@ def build_product_filters(request, base_queryset, category=None):
         # Очищаем от пустых значений
         seasons_clean = [s.strip() for s in seasons_filter if s and str(s).strip()]
         if seasons_clean:
-            products_list = products_list.filter(season__in=seasons_clean).distinct()
+            products_list = products_list.filter(season__in=seasons_clean)
             selected_filters['seasons'] = seasons_clean
     
     # ========== ФИЛЬТР ПО МАТЕРИАЛУ (множественный выбор) ==========
@@ -130,7 +124,7 @@ def build_product_filters(request, base_queryset, category=None):
         # Очищаем от пустых значений
         materials_clean = [m.strip() for m in materials_filter if m and str(m).strip()]
         if materials_clean:
-            products_list = products_list.filter(material__in=materials_clean).distinct()
+            products_list = products_list.filter(material__in=materials_clean)
             selected_filters['materials'] = materials_clean
     
     # ========== ФИЛЬТР "ТОЛЬКО РАСПРОДАЖА" (toggle) ==========
@@ -147,21 +141,21 @@ def build_product_filters(request, base_queryset, category=None):
     # ========== СОРТИРОВКА ==========
     sort_by = request.GET.get('sort', 'popularity')
     
-    if sort_by == 'price_asc':
+    if search_ranking and 'sort' not in request.GET:
+        # Поиск без явно выбранной сортировки - по релевантности
+        products_list = order_by_relevance(products_list, search_ranking)
+        selected_filters['sort'] = 'relevance'
+    elif sort_by == 'price_asc':
         products_list = products_list.order_by('price', '-id')
         selected_filters['sort'] = 'price_asc'
     elif sort_by == 'price_desc':
         products_list = products_list.order_by('-price', '-id')
         selected_filters['sort'] = 'price_desc'
     elif sort_by == 'popularity':
-        products_list = products_list.annotate(
-            review_count=Count('reviews')
-        ).order_by('-review_count', '-date', '-id')
+        products_list = products_list.order_by('-rating_count', '-date', '-id')
         selected_filters['sort'] = 'popularity'
     elif sort_by == 'rating':
-        products_list = products_list.annotate(
-            avg_rating=Avg('reviews__rating')
-        ).order_by('-avg_rating', '-date', '-id')
+        products_list = products_list.order_by('-rating_avg', '-date', '-id')
         selected_filters['sort'] = 'rating'
     else:
         products_list = products_list.order_by('-date', '-id')
@@ -326,173 +320,17 @@ def build_active_filters(request, selected_filters, category_id):
 
 def get_filter_options(base_queryset, category=None):
     """
-    Получает опции для фильтров на основе текущего queryset
+    Получает опции для фильтров из фасетного индекса (store.facets)
+
+    base_queryset оставлен для совместимости вызовов: опции всегда строятся
+    по опубликованным товарам, которые и хранит индекс.
     """
-    from store import models as store_models
-    from django.db.models import Q
-    
-    filter_options = {}
-    
-    # Price Range
-    price_range = base_queryset.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
-    filter_options['price_range'] = price_range
-    
-    # Categories
-    categories = store_models.Category.objects.annotate(
-        product_count=Count('product', filter=Q(product__status='Published'))
-    ).order_by('title')
-    filter_options['categories'] = categories
-    
-    # Sizes
-    if category:
-        sizes_pv = store_models.ProductVariant.objects.filter(
-            product__category=category,
-            product__status='Published',
-            is_available=True,
-            size__isnull=False
-        ).exclude(size='').values('size').distinct().order_by('size')
-        
-        sizes_variant = store_models.VariantItem.objects.filter(
-            variant__name='Size',
-            variant__product__category=category,
-            variant__product__status='Published'
-        ).values('title', 'content').distinct()
-    else:
-        sizes_pv = store_models.ProductVariant.objects.filter(
-            product__status='Published',
-            is_available=True,
-            size__isnull=False
-        ).exclude(size='').values('size').distinct().order_by('size')
-        
-        sizes_variant = store_models.VariantItem.objects.filter(
-            variant__name='Size',
-            variant__product__status='Published'
-        ).values('title', 'content').distinct()
-    
-    sizes_dict = {}
-    for size in sizes_variant:
-        size_name = size['content'] or size['title']
-        if size_name:
-            sizes_dict[size_name] = {
-                'title': size['title'] or size_name,
-                'content': size_name
-            }
-    
-    for size in sizes_pv:
-        size_name = size['size']
-        if size_name and size_name not in sizes_dict:
-            sizes_dict[size_name] = {
-                'title': size_name,
-                'content': size_name
-            }
-    
-    filter_options['sizes'] = list(sizes_dict.values())
-    
-    # Colors
-    if category:
-        colors_pv = store_models.ProductVariant.objects.filter(
-            product__category=category,
-            product__status='Published',
-            is_available=True,
-            color__isnull=False
-        ).exclude(color='').values('color', 'color_code').distinct()
-        
-        colors_variant = store_models.VariantItem.objects.filter(
-            variant__name='Color',
-            variant__product__category=category,
-            variant__product__status='Published'
-        ).values('title', 'content').distinct()
-    else:
-        colors_pv = store_models.ProductVariant.objects.filter(
-            product__status='Published',
-            is_available=True,
-            color__isnull=False
-        ).exclude(color='').values('color', 'color_code').distinct()
-        
-        colors_variant = store_models.VariantItem.objects.filter(
-            variant__name='Color',
-            variant__product__status='Published'
-        ).values('title', 'content').distinct()
-    
-    colors_dict = {}
-    for color in colors_variant:
-        color_name = color['content'] or color['title']
-        if color_name:
-            colors_dict[color_name] = {
-                'title': color['title'] or color_name,
-                'content': color_name,
-                'code': None
-            }
-    
-    for color in colors_pv:
-        color_name = color['color']
-        if color_name and color_name not in colors_dict:
-            colors_dict[color_name] = {
-                'title': color_name,
-                'content': color_name,
-                'code': color.get('color_code')
-            }
-    
-    filter_options['colors'] = list(colors_dict.values())
-    
-    # Brands
-    if category:
-        brands = base_queryset.filter(category=category).exclude(
-            brand__isnull=True
-        ).exclude(brand='').values('brand').annotate(
-            count=Count('id')
-        ).order_by('brand')
-    else:
-        brands = base_queryset.exclude(brand__isnull=True).exclude(
-            brand=''
-        ).values('brand').annotate(
-            count=Count('id')
-        ).order_by('brand')
-    
-    filter_options['brands'] = brands
-    
-    # Seasons
-    if category:
-        seasons = base_queryset.filter(
-            category=category,
-            season__isnull=False
-        ).exclude(season='').values('season').annotate(
-            count=Count('id')
-        ).order_by('season')
-    else:
-        seasons = base_queryset.exclude(
-            season__isnull=True
-        ).exclude(season='').values('season').annotate(
-            count=Count('id')
-        ).order_by('season')
-    
-    filter_options['seasons'] = seasons
-    
-    # Materials
-    if category:
-        materials = base_queryset.filter(
-            category=category,
-            material__isnull=False
-        ).exclude(material='').values('material').annotate(
-            count=Count('id')
-        ).order_by('material')
-    else:
-        materials = base_queryset.exclude(
-            material__isnull=True
-        ).exclude(material='').values('material').annotate(
-            count=Count('id')
-        ).order_by('material')
-    
-    filter_options['materials'] = materials
-    
-    return filter_options
+    return get_facet_index().options(category_id=category.id if category else None)
 
 
 def paginate_queryset(request, queryset, per_page=12):
-    paginator = Paginator(queryset, per_page)
+    # Приблизительный (кэшированный) COUNT - не пересчитывается при листании
+    paginator = CachedCountPaginator(queryset, per_page)
     page_number = request.GET.get('page', 1)
     try:
         page = paginator.get_page(page_number)
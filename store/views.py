@@ -1,36 +1,45 @@
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.db import models
-from django.db.models import Q, F, Min, Max, Count
+from django.db.models import F
 from django.conf import settings
+from django.core.exceptions import PermissionDenied
 from django.urls import reverse
 from django.template.loader import render_to_string
-from django.core.mail import EmailMultiAlternatives, send_mail
 
 from decimal import Decimal
-import requests
+import hashlib
+import hmac
+import json
+import logging
+import os
 import stripe
-from plugin.service_fee import calculate_service_fee
-import razorpay
 
-from plugin.paginate_queryset import paginate_queryset
+from plugin.paginate_queryset import paginate_queryset, cursor_paginate, CachedCountPaginator
 from store import models as store_models
 from customer import models as customer_models
-from vendor import models as vendor_models
 from userauths import models as userauths_models
-from plugin.tax_calculation import tax_calculation
-from plugin.exchange_rate import convert_usd_to_inr, convert_usd_to_kobo, convert_usd_to_ngn, get_usd_to_ngn_rate
+from store.facets import filter_queryset as filter_by_facet, get_index as get_facet_index
+from store import cart as cart_service
+from store.context import get_cart_count, set_cart_count
+from store.orders import create_order_from_cart
+from store import feeds, inventory, payments, product_page, sitemaps, webhooks
+from store.search import apply_search, order_by_relevance, search_product_ids, suggest
+from plugin.exchange_rate import (
+    ExchangeRateUnavailable, convert_usd_to_inr, convert_usd_to_kobo, convert_usd_to_ngn, get_usd_to_ngn_rate,
+)
 
+logger = logging.getLogger(__name__)
 
-# stripe.api_key = settings.STRIPE_SECRET_KEY
-# razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
 
 def clear_cart_items(request):
     try:
         cart_id = request.session['cart_id']
         store_models.Cart.objects.filter(cart_id=cart_id).delete()
+        inventory.release_cart(cart_id)
+        set_cart_count(request, cart_id, 0)
     except:
         pass
     return
@@ -54,19 +63,15 @@ def shop(request):
     from django.db.models import Avg
     
     # Начинаем с базового queryset только опубликованных товаров
-    products_list = store_models.Product.objects.filter(status="Published").select_related('category', 'vendor').prefetch_related('reviews', 'product_variants')
+    products_list = store_models.Product.objects.filter(status="Published").select_related('category', 'vendor').prefetch_related('product_variants')
     
     # ========== ПРИМЕНЕНИЕ ФИЛЬТРОВ ИЗ GET ПАРАМЕТРОВ ==========
     
-    # Поиск
+    # Поиск (полнотекстовый индекс, см. store.search)
     query = request.GET.get("q") or request.GET.get("searchFilter")
+    search_ranking = None
     if query:
-        products_list = products_list.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(brand__icontains=query) |
-            Q(category__title__icontains=query)
-        )
+        products_list, search_ranking = apply_search(products_list, query)
     
     # Фильтр по категориям
     categories_filter = request.GET.getlist('categories[]') or request.GET.getlist('categories')
@@ -78,34 +83,30 @@ def shop(request):
         except (ValueError, TypeError):
             pass
     
+    # Фильтры по рейтингу, размерам и цветам - EXISTS по вариантам и денормализованный
+    # рейтинг вместо JOIN по отзывам/вариантам с DISTINCT
+    facet_index = get_facet_index()
+
     # Фильтр по рейтингу
     rating_filter = request.GET.getlist('rating[]') or request.GET.getlist('rating')
     if rating_filter:
         rating_values = [int(r) for r in rating_filter if r.isdigit()]
-        if rating_values:
-            rating_conditions = Q()
-            for r_val in rating_values:
-                rating_conditions |= Q(reviews__rating__gte=r_val)
-            products_list = products_list.filter(rating_conditions).distinct()
+        products_list = filter_by_facet(products_list, 'rating', rating_values)
     
     # Фильтр по размерам
     sizes_filter = request.GET.getlist('sizes[]') or request.GET.getlist('sizes')
     if sizes_filter:
-        size_filter = Q()
-        size_filter |= Q(product_variants__size__in=sizes_filter, product_variants__is_available=True)
-        products_list = products_list.filter(size_filter).distinct()
+        products_list = filter_by_facet(products_list, 'size', sizes_filter)
     
     # Фильтр по цветам
     colors_filter = request.GET.getlist('colors[]') or request.GET.getlist('colors')
     if colors_filter:
-        color_filter = Q()
-        color_filter |= Q(product_variants__color__in=colors_filter, product_variants__is_available=True)
-        products_list = products_list.filter(color_filter).distinct()
+        products_list = filter_by_facet(products_list, 'color', colors_filter)
     
     # Фильтр по брендам
     brands_filter = request.GET.getlist('brands[]') or request.GET.getlist('brands')
     if brands_filter:
-        products_list = products_list.filter(brand__in=brands_filter).distinct()
+        products_list = products_list.filter(brand__in=brands_filter)
     
     # Фильтр по наличию
     in_stock = request.GET.get('in_stock')
@@ -148,92 +149,23 @@ def shop(request):
     elif price_order == 'highest':
         products_list = products_list.order_by('price')
     elif price_order == 'rating':
-        products_list = products_list.annotate(avg_rating=Avg('reviews__rating')).order_by('-avg_rating', '-date')
+        products_list = products_list.order_by('-rating_avg', '-date')
     elif price_order == 'popular':
-        products_list = products_list.annotate(review_count=Count('reviews')).order_by('-review_count', '-date')
+        products_list = products_list.order_by('-rating_count', '-date')
+    elif search_ranking:
+        products_list = order_by_relevance(products_list, search_ranking)
     else:
         products_list = products_list.order_by('-date', '-id')
     
     # ========== ПОДГОТОВКА ДАННЫХ ДЛЯ ШАБЛОНА ==========
     
-    # Получаем категории с количеством товаров (с учетом текущих фильтров)
-    categories = store_models.Category.objects.annotate(
-        product_count=Count('product', filter=Q(product__status='Published'))
-    ).order_by('title')
-    
-    # Получаем цвета из Variant и ProductVariant
-    colors_variant = store_models.VariantItem.objects.filter(
-        variant__name='Color'
-    ).values('title', 'content').distinct()
-    
-    colors_pv = store_models.ProductVariant.objects.filter(
-        is_available=True, color__isnull=False
-    ).exclude(color='').values('color', 'color_code').distinct()
-    
-    # Объединяем цвета
-    colors_dict = {}
-    for color in colors_variant:
-        color_name = color['content'] or color['title']
-        if color_name:
-            colors_dict[color_name] = {
-                'title': color['title'] or color_name,
-                'content': color_name,
-                'code': None
-            }
-    
-    for color in colors_pv:
-        color_name = color['color']
-        if color_name and color_name not in colors_dict:
-            colors_dict[color_name] = {
-                'title': color_name,
-                'content': color_name,
-                'code': color.get('color_code')
-            }
-    
-    colors = list(colors_dict.values())
-    
-    # Получаем размеры из Variant и ProductVariant
-    sizes_variant = store_models.VariantItem.objects.filter(
-        variant__name='Size'
-    ).values('title', 'content').distinct()
-    
-    sizes_pv = store_models.ProductVariant.objects.filter(
-        is_available=True, size__isnull=False
-    ).exclude(size='').values('size').distinct()
-    
-    # Объединяем размеры
-    sizes_dict = {}
-    for size in sizes_variant:
-        size_name = size['content'] or size['title']
-        if size_name:
-            sizes_dict[size_name] = {
-                'title': size['title'] or size_name,
-                'content': size_name
-            }
-    
-    for size in sizes_pv:
-        size_name = size['size']
-        if size_name and size_name not in sizes_dict:
-            sizes_dict[size_name] = {
-                'title': size_name,
-                'content': size_name
-            }
-    
-    sizes = list(sizes_dict.values())
-    
-    # Получаем бренды
-    brands = store_models.Product.objects.filter(
-        status="Published"
-    ).exclude(brand__isnull=True).exclude(brand='').values('brand').annotate(
-        count=Count('id')
-    ).order_by('brand')
-    
-    # Диапазон цен (из всех товаров, не отфильтрованных)
-    all_products = store_models.Product.objects.filter(status="Published")
-    price_range = all_products.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
+    # Категории, цвета, размеры, бренды и диапазон цен - из фасетного индекса
+    filter_options = facet_index.options()
+    categories = filter_options['categories']
+    colors = filter_options['colors']
+    sizes = filter_options['sizes']
+    brands = filter_options['brands']
+    price_range = filter_options['price_range']
     
     item_display = [
         {"id": "1", "value": 1},
@@ -258,7 +190,7 @@ def shop(request):
     ]
 
     # Применяем пагинацию
-    products = paginate_queryset(request, products_list, 10)
+    products = paginate_queryset(request, products_list, 10, cache_count=True)
     
     # Получаем текущие выбранные фильтры для восстановления состояния в шаблоне
     selected_categories = request.GET.getlist('categories[]') or request.GET.getlist('categories')
@@ -308,7 +240,6 @@ def category(request, id):
     base_queryset = store_models.Product.objects.filter(
         status="Published"
     ).select_related('category', 'vendor').prefetch_related(
-        'reviews', 
         'product_variants'
     )
     
@@ -319,7 +250,7 @@ def category(request, id):
     products_list, selected_filters = build_product_filters(request, base_queryset, category=category)
     
     # Пагинация
-    products = paginate_qs(request, products_list, 12)
+    products = paginate_qs(request, products_list, 12, cache_count=True)
     
     # Получаем текущие GET параметры для сохранения состояния
     current_params = request.GET.copy()
@@ -375,7 +306,6 @@ def category_filter_ajax(request, id):
     base_queryset = store_models.Product.objects.filter(
         status="Published"
     ).select_related('category', 'vendor').prefetch_related(
-        'reviews', 
         'product_variants'
     )
     
@@ -383,7 +313,7 @@ def category_filter_ajax(request, id):
     products_list, selected_filters = build_product_filters(request, base_queryset, category=category)
     
     # Пагинация
-    products = paginate_qs(request, products_list, 12)
+    products = paginate_qs(request, products_list, 12, cache_count=True)
     
     # Рендерим HTML для товаров
     products_html = render_to_string('partials/_category_products.html', {
@@ -426,7 +356,7 @@ def category_filter_ajax(request, id):
         'products_html': products_html,
         'filters_html': filters_html,
         'pagination_html': pagination_html,
-        'product_count': products_list.count(),
+        'product_count': products.paginator.count,
         'update_url': update_url,
         'page': products.number if hasattr(products, 'number') else 1,
         'has_next': products.has_next() if hasattr(products, 'has_next') else False,
@@ -436,7 +366,7 @@ def category_filter_ajax(request, id):
     # Логирование для отладки
     import logging
     logger = logging.getLogger(__name__)
-    logger.info(f'AJAX filter response: {products_list.count()} products found for category {id}')
+    logger.info(f'AJAX filter response: {products.paginator.count} products found for category {id}')
     
     return JsonResponse(response_data)
 
@@ -449,15 +379,14 @@ def vendors(request):
     return render(request, "store/vendors.html", context)
 
 def product_detail(request, slug):
-    product = store_models.Product.objects.get(status="Published", slug=slug)
-    product_stock_range = range(1, product.stock + 1)
-
-    related_products = store_models.Product.objects.filter(category=product.category).exclude(id=product.id)
+    # Товар, галерея, варианты и отзывы - фиксированным числом запросов
+    product = product_page.load_product(slug)
+    product_stock_range = range(1, (product.stock or 0) + 1)
 
     context = {
         "product": product,
         "product_stock_range": product_stock_range,
-        "related_products": related_products,
+        "related_products": product_page.related_products(product),
     }
     return render(request, "store/product_detail.html", context)
 
@@ -474,6 +403,10 @@ def add_to_cart(request):
     # Validate required fields
     if not id or not qty or not cart_id:
         return JsonResponse({"error": "Не выбраны цвет или размер"}, status=400)
+    try:
+        qty = cart_service.parse_qty(qty)
+    except ValueError:
+        return JsonResponse({"error": "Неверное количество"}, status=400)
 
     # Try to fetch the product, return an error if it doesn't exist
     try:
@@ -481,54 +414,28 @@ def add_to_cart(request):
     except store_models.Product.DoesNotExist:
         return JsonResponse({"error": "Товар не найден"}, status=404)
 
-    # Check if the item is already in the cart
-    existing_cart_item = store_models.Cart.objects.filter(cart_id=cart_id, product=product).first()
-
-    # Check if quantity that user is adding exceed item stock qty
-    if int(qty) > product.stock:
-        return JsonResponse({"error": "Количество превышает доступный остаток"}, status=404)
-
-    # If the item is not in the cart, create a new cart entry
-    if not existing_cart_item:
-        cart = store_models.Cart()
-        cart.product = product
-        cart.qty = qty
-        cart.price = product.price
-        cart.color = color
-        cart.size = size
-        cart.sub_total = Decimal(product.price) * Decimal(qty)
-        cart.shipping = Decimal(product.shipping) * Decimal(qty)
-        cart.total = cart.sub_total + cart.shipping
-        cart.user = request.user if request.user.is_authenticated else None
-        cart.cart_id = cart_id
-        cart.save()
-
-        message = "Товар добавлен в корзину"
-    else:
-        # If the item exists in the cart, update the existing entry
-        existing_cart_item.color = color
-        existing_cart_item.size = size
-        existing_cart_item.qty = qty
-        existing_cart_item.price = product.price
-        existing_cart_item.sub_total = Decimal(product.price) * Decimal(qty)
-        existing_cart_item.shipping = Decimal(product.shipping) * Decimal(qty)
-        existing_cart_item.total = existing_cart_item.sub_total +  existing_cart_item.shipping
-        existing_cart_item.user = request.user if request.user.is_authenticated else None
-        existing_cart_item.cart_id = cart_id
-        existing_cart_item.save()
-
-        message = "Корзина обновлена"
-
-    # Count the total number of items in the cart
-    total_cart_items = store_models.Cart.objects.filter(cart_id=cart_id)
-    cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(sub_total = models.Sum("sub_total"))['sub_total']
+    # Hold the stock for this cart line (ProductVariant row when size and color match one)
+    try:
+        inventory.reserve(cart_id, product, qty, size=size, color=color)
+    except inventory.OutOfStock as e:
+        return JsonResponse({"error": f"Количество превышает доступный остаток ({e.available})"}, status=409)
+
+    # Insert or update the (cart_id, product, size, color) line in one statement
+    previous_count = get_cart_count(request)
+    item = cart_service.add_item(cart_id, product, qty, size=size, color=color, user=request.user)
+
+    # Count, subtotal and shipping of the cart in one aggregate
+    totals = cart_service.totals(cart_id)
+    # Keep the header counter in the session (read by the context processor)
+    set_cart_count(request, cart_id, totals['count'])
+    message = "Товар добавлен в корзину" if totals['count'] > previous_count else "Корзина обновлена"
 
     # Return the response with the cart update message and total cart items
     return JsonResponse({
         "message": message ,
-        "total_cart_items": total_cart_items.count(),
-        "cart_sub_total": "{:,.2f}".format(cart_sub_total),
-        "item_sub_total": "{:,.2f}".format(existing_cart_item.sub_total) if existing_cart_item else "{:,.2f}".format(cart.sub_total) 
+        "total_cart_items": totals['count'],
+        "cart_sub_total": "{:,.2f}".format(totals['sub_total']),
+        "item_sub_total": "{:,.2f}".format(item.sub_total)
     })
 
 def cart(request):
@@ -537,8 +444,8 @@ def cart(request):
     else:
         cart_id = None
 
-    items = store_models.Cart.objects.filter(cart_id=cart_id)
-    cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(sub_total = models.Sum("sub_total"))['sub_total']
+    items = list(cart_service.items(cart_id))
+    cart_sub_total = cart_service.totals_of(items)['sub_total']
     
     try:
         addresses = customer_models.Address.objects.filter(user=request.user)
@@ -565,23 +472,19 @@ def delete_cart_item(request):
     if not id and not item_id and not cart_id:
         return JsonResponse({"error": "Товар или ID товара не найдены"}, status=400)
 
-    try:
-        product = store_models.Product.objects.get(status="Published", id=id)
-    except store_models.Product.DoesNotExist:
-        return JsonResponse({"error": "Товар не найден"}, status=404)
-
-    # Check if the item is already in the cart
-    item = store_models.Cart.objects.get(product=product, id=item_id)
-    item.delete()
+    # Delete the line in one statement (scoped to this cart)
+    cart_service.remove_item(cart_id, item_id, product_id=id)
+    inventory.release_removed(cart_id)
 
-    # Count the total number of items in the cart
-    total_cart_items = store_models.Cart.objects.filter(cart_id=cart_id)
-    cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(sub_total = models.Sum("sub_total"))['sub_total']
+    # Count and subtotal of the cart in one aggregate
+    totals = cart_service.totals(cart_id)
+    if cart_id == request.session.get('cart_id'):
+        set_cart_count(request, cart_id, totals['count'])
 
     return JsonResponse({
         "message": "Товар удален",
-        "total_cart_items": total_cart_items.count(),
-        "cart_sub_total": "{:,.2f}".format(cart_sub_total) if cart_sub_total else 0.00
+        "total_cart_items": totals['count'],
+        "cart_sub_total": "{:,.2f}".format(totals['sub_total']) if totals['count'] else 0.00
     })
 
 def create_order(request):
@@ -598,39 +501,13 @@ def create_order(request):
         else:
             cart_id = None
 
-        items = store_models.Cart.objects.filter(cart_id=cart_id)
-        cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(sub_total = models.Sum("sub_total"))['sub_total']
-        cart_shipping_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(shipping = models.Sum("shipping"))['shipping']
-        
-        order = store_models.Order()
-        order.sub_total = cart_sub_total
-        order.customer = request.user
-        order.address = address
-        order.shipping = cart_shipping_total
-        order.tax = tax_calculation(address.country, cart_sub_total)
-        order.total = order.sub_total + order.shipping + Decimal(order.tax)
-        order.service_fee = calculate_service_fee(order.total)
-        order.total += order.service_fee
-        order.save()
-
-        for i in items:
-            store_models.OrderItem.objects.create(
-                order=order,
-                product=i.product,
-                qty=i.qty,
-                color=i.color,
-                size=i.size,
-                price=i.price,
-                sub_total=i.sub_total,
-                shipping=i.shipping,
-                tax=tax_calculation(address.country, i.sub_total),
-                total=i.total,
-                initial_total=i.total,
-                vendor=i.product.vendor
-            )
-
-            order.vendors.add(i.product.vendor)
-        
+        # Cart lines are locked, re-reserved and the order is built with bulk inserts in one transaction
+        try:
+            order = create_order_from_cart(request.user, address, cart_id)
+        except inventory.OutOfStock as e:
+            name = e.product.name if e.product else "товара"
+            messages.error(request, f"Недостаточно остатка для «{name}»: доступно {e.available}")
+            return redirect("store:cart")
     
     return redirect("store:checkout", order.order_id)
 
@@ -687,23 +564,31 @@ def coupon_apply(request, order_id):
 def checkout(request, order_id):
     order = store_models.Order.objects.get(order_id=order_id)
     
-    amount_in_inr = convert_usd_to_inr(order.total)
-    amount_in_kobo = convert_usd_to_kobo(order.total)
-    amount_in_ngn = convert_usd_to_ngn(order.total)
-
+    # Without a fresh rate the INR/NGN gateways are hidden, USD gateways stay available
     try:
-        razorpay_order = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)).order.create({
-            "amount": int(amount_in_inr),
-            "currency": "INR",
-            "payment_capture": "1"
-        })
-    except:
-        razorpay_order = None
+        amount_in_inr = convert_usd_to_inr(order.total)
+        amount_in_kobo = convert_usd_to_kobo(order.total)
+        amount_in_ngn = round(convert_usd_to_ngn(order.total), 2)
+    except ExchangeRateUnavailable as e:
+        logger.warning(f"Checkout {order.order_id}: {e}")
+        amount_in_inr = amount_in_kobo = amount_in_ngn = None
+
+    razorpay_order = None
+    if amount_in_inr is not None:
+        try:
+            razorpay_order = payments.razorpay_client().order.create({
+                "amount": int(amount_in_inr),
+                "currency": "INR",
+                "payment_capture": "1",
+                "notes": {"order_id": order.order_id},
+            })
+        except:
+            razorpay_order = None
     context = {
         "order": order,
         "amount_in_inr":amount_in_inr,
         "amount_in_kobo":amount_in_kobo,
-        "amount_in_ngn":round(amount_in_ngn, 2),
+        "amount_in_ngn":amount_in_ngn,
         "razorpay_order_id": razorpay_order['id'] if razorpay_order else None,
         "stripe_public_key": settings.STRIPE_PUBLIC_KEY,
         "paypal_client_id": settings.PAYPAL_CLIENT_ID,
@@ -717,9 +602,8 @@ def checkout(request, order_id):
 @csrf_exempt
 def stripe_payment(request, order_id):
     order = store_models.Order.objects.get(order_id=order_id)
-    stripe.api_key = settings.STRIPE_SECRET_KEY
 
-    checkout_session = stripe.checkout.Session.create(
+    params = dict(
         customer_email = order.address.email,
         payment_method_types=['card'],
         line_items = [
@@ -735,201 +619,74 @@ def stripe_payment(request, order_id):
             }
         ],
         mode = 'payment',
+        # Lets the checkout.session.completed webhook find the order
+        client_reference_id = order.order_id,
         success_url = request.build_absolute_uri(reverse("store:stripe_payment_verify", args=[order.order_id])) + "?session_id={CHECKOUT_SESSION_ID}" + "&payment_method=Stripe",
-        cancel_url = request.build_absolute_uri(reverse("store:stripe_payment_verify", args=[order.order_id]))
+        cancel_url = request.build_absolute_uri(reverse("store:stripe_payment_verify", args=[order.order_id])),
+    )
+    # Repeated clicks on "Pay" reuse one checkout session while every parameter is unchanged;
+    # a changed email, name, amount or URL gets a new key instead of an idempotency error
+    fingerprint = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    checkout_session = stripe.checkout.Session.create(
+        idempotency_key = f"checkout-{order.order_id}-{fingerprint}",
+        **params,
+        **payments.stripe_options()
     )
 
-    print("checkkout session", checkout_session)
     return JsonResponse({"sessionId": checkout_session.id})
 
+def payment_redirect(request, order, result):
+    # finalize_payment already emptied the order's cart, also when a webhook paid it first
+    # (then this callback gets ALREADY_PAID); here the session's cart and counter are reset
+    paid_from_this_cart = result == payments.ALREADY_PAID and order.cart_id == request.session.get('cart_id')
+    if result == payments.PAID or paid_from_this_cart:
+        clear_cart_items(request)
+    status = "failed" if result == payments.FAILED else "paid"
+    return redirect(f"/payment_status/{order.order_id}/?payment_status={status}")
+
 def stripe_payment_verify(request, order_id):
     order = store_models.Order.objects.get(order_id=order_id)
-
-    session_id = request.GET.get("session_id")
-    session = stripe.checkout.Session.retrieve(session_id)
-
-    if session.payment_status == "paid":
-        if order.payment_status == "Processing":
-            order.payment_status = "Paid"
-            order.save()
-            clear_cart_items(request)
-            customer_models.Notifications.objects.create(type="New Order", user=request.user)
-            customer_merge_data = {
-                'order': order,
-                'order_items': order.order_items(),
-            }
-            subject = f"New Order!"
-            text_body = render_to_string("email/order/customer/customer_new_order.txt", customer_merge_data)
-            html_body = render_to_string("email/order/customer/customer_new_order.html", customer_merge_data)
-
-            msg = EmailMultiAlternatives(
-                subject=subject, from_email=settings.FROM_EMAIL,
-                to=[order.address.email], body=text_body
-            )
-            msg.attach_alternative(html_body, "text/html")
-            msg.send()
-
-            # Send Order Emails to Vendors
-            for item in order.order_items():
-                
-                vendor_merge_data = {
-                    'item': item,
-                }
-                subject = f"New Order!"
-                text_body = render_to_string("email/order/vendor/vendor_new_order.txt", vendor_merge_data)
-                html_body = render_to_string("email/order/vendor/vendor_new_order.html", vendor_merge_data)
-
-                msg = EmailMultiAlternatives(
-                    subject=subject, from_email=settings.FROM_EMAIL,
-                    to=[item.vendor.email], body=text_body
-                )
-                msg.attach_alternative(html_body, "text/html")
-                msg.send()
-
-            return redirect(f"/payment_status/{order.order_id}/?payment_status=paid")
-    
-    return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
-    
-def get_paypal_access_token():
-    token_url = 'https://api.sandbox.paypal.com/v1/oauth2/token'
-    data = {'grant_type': 'client_credentials'}
-    auth = (settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET_ID)
-    response = requests.post(token_url, data=data, auth=auth)
-
-    if response.status_code == 200:
-        return response.json()['access_token']
-    else:
-        raise Exception(f'Failed to get access token from PayPal. Status code: {response.status_code}') 
+    result = payments.confirm_payment(order, "Stripe", request.GET)
+    return payment_redirect(request, order, result)
 
 def paypal_payment_verify(request, order_id):
     order = store_models.Order.objects.get(order_id=order_id)
-
-    transaction_id = request.GET.get("transaction_id")
-    paypal_api_url = f'https://api-m.sandbox.paypal.com/v2/checkout/orders/{transaction_id}'
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {get_paypal_access_token()}',
-    }
-    response = requests.get(paypal_api_url, headers=headers)
-
-    if response.status_code == 200:
-        paypal_order_data = response.json()
-        paypal_payment_status = paypal_order_data['status']
-        if paypal_payment_status == 'COMPLETED':
-            if order.payment_status == "Processing":
-                order.payment_status = "Paid"
-                payment_method = request.GET.get("payment_method")
-                order.payment_method = payment_method
-                order.save()
-                clear_cart_items(request)
-                return redirect(f"/payment_status/{order.order_id}/?payment_status=paid")
-    else:
-        return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
+    result = payments.confirm_payment(order, "PayPal", request.GET)
+    return payment_redirect(request, order, result)
 
 @csrf_exempt
 def razorpay_payment_verify(request, order_id):
     order = store_models.Order.objects.get(order_id=order_id)
-    payment_method = request.GET.get("payment_method")
 
     if request.method == "POST":
-        data = request.POST
-
-        # Extract payment data
-        razorpay_order_id = data.get('razorpay_order_id')
-        razorpay_payment_id = data.get('razorpay_payment_id')
-        razorpay_signature = data.get('razorpay_signature')
-
-        print("razorpay_order_id: ====", razorpay_order_id)
-        print("razorpay_payment_id: ====", razorpay_payment_id)
-        print("razorpay_signature: ====", razorpay_signature)
-
-        params_dict = {
-            'razorpay_order_id': razorpay_order_id,
-            'razorpay_payment_id': razorpay_payment_id,
-            'razorpay_signature': razorpay_signature
-        }
-
-        # Verify the payment signature
-        razorpay_client.utility.verify_payment_signature({
-            'razorpay_order_id': razorpay_order_id,
-            'razorpay_payment_id': razorpay_payment_id,
-            'razorpay_signature': razorpay_signature
-        })
-
-        razorpay_client.utility.verify_payment_signature(params_dict)
-
-        # Success response
-        if order.payment_status == "Processing":
-            order.payment_status = "Paid"
-            order.payment_method = payment_method
-            order.save()
-            clear_cart_items(request)
-            customer_models.Notifications.objects.create(type="New Order", user=request.user)
-            for item in order.order_items():
-                vendor_models.Notifications.objects.create(type="New Order", user=item.vendor)
-
-            return redirect(f"/payment_status/{order.order_id}/?payment_status=paid")
-
-        
-
-    return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
+        result = payments.confirm_payment(order, "RazorPay", request.POST)
+    else:
+        result = payments.ALREADY_PAID if order.payment_status == "Paid" else payments.FAILED
+    return payment_redirect(request, order, result)
 
 def paystack_payment_verify(request, order_id):
     order = store_models.Order.objects.get(order_id=order_id)
-    reference = request.GET.get('reference', '')
-
-    if reference:
-        headers = {
-            "Authorization": f"Bearer {settings.PAYSTACK_PRIVATE_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        # Verify the transaction
-        response = requests.get(f'https://api.paystack.co/transaction/verify/{reference}', headers=headers)
-        response_data = response.json()
-
-        if response_data['status']:
-            if response_data['data']['status'] == 'success':
-                if order.payment_status == "Processing":
-                    order.payment_status = "Paid"
-                    payment_method = request.GET.get("payment_method")
-                    order.payment_method = payment_method
-                    order.save()
-                    clear_cart_items(request)
-                    return redirect(f"/payment_status/{order.order_id}/?payment_status=paid")
-                else:
-                    return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
-            else:
-                # Payment failed
-                return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
-        else:
-            return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
-    else:
-        return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
+    result = payments.confirm_payment(order, "Paystack", request.GET)
+    return payment_redirect(request, order, result)
 
 def flutterwave_payment_callback(request, order_id):
     order = store_models.Order.objects.get(order_id=order_id)
+    result = payments.confirm_payment(order, "Flutterwave", request.GET)
+    return payment_redirect(request, order, result)
 
-    payment_id = request.GET.get('tx_ref')
-    status = request.GET.get('status')
-
-    headers = {
-        'Authorization': f'Bearer {settings.FLUTTERWAVE_PRIVATE_KEY}'
-    }
-    response = requests.get(f'https://api.flutterwave.com/v3/charges/verify_by_id/{payment_id}', headers=headers)
-
-    if response.status_code == 200:
-        if order.payment_status == "Processing":
-            order.payment_status = "Paid"
-            payment_method = request.GET.get("payment_method")
-            order.payment_method = payment_method
-            order.save()
-            clear_cart_items(request)
-            return redirect(f"/payment_status/{order.order_id}/?payment_status=paid")
-        else:
-            return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
-    else:
-        return redirect(f"/payment_status/{order.order_id}/?payment_status=failed")
+@csrf_exempt
+def payment_webhook(request, gateway):
+    # Only verifies the signature and stores the event; process_payment_events applies it
+    if request.method != "POST":
+        return HttpResponse(status=405)
+    try:
+        webhooks.record_event(gateway, request)
+    except KeyError:
+        return HttpResponse(status=404)
+    except webhooks.InvalidSignature as e:
+        logger.warning(f"Rejected {gateway} webhook: {e}")
+        return HttpResponse(status=400)
+    return HttpResponse(status=200)
 
 def payment_status(request, order_id):
     order = store_models.Order.objects.get(order_id=order_id)
@@ -950,12 +707,11 @@ def filter_products(request):
     - Возврат JSON с HTML и метаданными
     - Новые фильтры: бренд, наличие, новинки, скидки, диапазон цен
     """
-    from django.core.paginator import Paginator
     from django.db.models import Avg
     
     # Начинаем с базового queryset только опубликованных товаров
     # Оптимизация: используем select_related для ForeignKey и prefetch_related для обратных связей
-    products = store_models.Product.objects.filter(status="Published").select_related('category', 'vendor').prefetch_related('reviews', 'product_variants')
+    products = store_models.Product.objects.filter(status="Published").select_related('category', 'vendor').prefetch_related('product_variants')
 
     # Получаем фильтры из AJAX запроса
     categories = request.GET.getlist('categories[]')
@@ -983,33 +739,23 @@ def filter_products(request):
         except (ValueError, TypeError) as e:
             print(f"Error converting category IDs: {e}")
 
-    # Применяем фильтр по рейтингу
+    # Фильтры по рейтингу, размерам и цветам - условиями в SQL (EXISTS по вариантам),
+    # без JOIN по отзывам/вариантам и DISTINCT
+    # Применяем фильтр по рейтингу (средний рейтинг товара >= выбранного значения)
     if rating:
-        rating_values = [int(r) for r in rating if r.isdigit()]
-        if rating_values:
-            # Фильтруем товары, у которых средний рейтинг >= выбранного значения
-            rating_conditions = Q()
-            for r_val in rating_values:
-                rating_conditions |= Q(reviews__rating__gte=r_val)
-            products = products.filter(rating_conditions).distinct()
+        products = filter_by_facet(products, 'rating', [int(r) for r in rating if r.isdigit()])
 
     # Применяем фильтр по размерам (только через ProductVariant)
     if sizes:
-        products = products.filter(
-            product_variants__size__in=sizes, 
-            product_variants__is_available=True
-        ).distinct()
+        products = filter_by_facet(products, 'size', sizes)
 
     # Применяем фильтр по цветам (только через ProductVariant)
     if colors:
-        products = products.filter(
-            product_variants__color__in=colors, 
-            product_variants__is_available=True
-        ).distinct()
+        products = filter_by_facet(products, 'color', colors)
 
     # Применяем фильтр по брендам
     if brands:
-        products = products.filter(brand__in=brands).distinct()
+        products = products.filter(brand__in=brands)
 
     # Применяем фильтр по наличию
     if in_stock == 'true':
@@ -1040,14 +786,10 @@ def filter_products(request):
         except (ValueError, TypeError):
             pass
 
-    # Применяем поисковый фильтр
+    # Применяем поисковый фильтр (полнотекстовый индекс, см. store.search)
+    search_ranking = None
     if search_filter:
-        products = products.filter(
-            Q(name__icontains=search_filter) |
-            Q(description__icontains=search_filter) |
-            Q(brand__icontains=search_filter) |
-            Q(category__title__icontains=search_filter)
-        )
+        products, search_ranking = apply_search(products, search_filter)
 
     # Применяем сортировку
     if price_order == 'lowest':
@@ -1055,45 +797,74 @@ def filter_products(request):
     elif price_order == 'highest':
         products = products.order_by('price')
     elif price_order == 'rating':
-        # Сортировка по рейтингу
-        products = products.annotate(avg_rating=Avg('reviews__rating')).order_by('-avg_rating', '-date')
+        # Сортировка по рейтингу (денормализованная колонка, без JOIN и GROUP BY)
+        products = products.order_by('-rating_avg', '-date')
     elif price_order == 'popular':
         # Сортировка по популярности (количество отзывов)
-        products = products.annotate(review_count=Count('reviews')).order_by('-review_count', '-date')
+        products = products.order_by('-rating_count', '-date')
+    elif search_ranking:
+        # При поиске без явной сортировки - по релевантности
+        products = order_by_relevance(products, search_ranking)
     else:
         # Сортировка по умолчанию (новые сначала)
         products = products.order_by('-date', '-id')
 
-    # Получаем общее количество товаров ДО пагинации (для отображения)
-    total_count = products.count()
+    # Ограничение количества товаров (display) - это размер страницы: применяется до пагинации,
+    # чтобы next_cursor и номера страниц указывали на первый непоказанный товар
+    if display and display.isdigit() and int(display) > 0:
+        per_page = min(per_page, int(display))
 
     # Применяем пагинацию
-    paginator = Paginator(products, per_page)
-    try:
-        page_obj = paginator.page(page)
-        products_page = page_obj.object_list
-    except:
-        page_obj = paginator.page(1)
-        products_page = page_obj.object_list
-
-    # Ограничение количества товаров (если указано в display)
-    if display and display.isdigit():
-        display_count = int(display)
-        if display_count < total_count:
-            products_page = products_page[:display_count]
+    # Курсорный режим (infinite scroll): передаётся параметр cursor (пустой - первая страница).
+    # Фильтрует по ключу последнего товара вместо OFFSET; при сортировке по релевантности -
+    # обычная постраничная пагинация
+    cursor_page = None
+    if 'cursor' in request.GET:
+        cursor_page = cursor_paginate(products, request.GET.get('cursor'), per_page)
+
+    if cursor_page is not None:
+        try:
+            page_number = max(1, int(page))
+        except (TypeError, ValueError):
+            page_number = 1
+        products_page = cursor_page.object_list
+        # Приблизительное количество (кэшируется, не пересчитывается на каждой странице)
+        total_count = cursor_page.count
+        pagination = {
+            'page': page_number,
+            'has_next': cursor_page.has_next(),
+            'has_previous': page_number > 1,
+            'num_pages': cursor_page.num_pages,
+            'next_cursor': cursor_page.next_cursor,
+        }
+    else:
+        paginator = CachedCountPaginator(products, per_page)
+        try:
+            page_obj = paginator.page(page)
+            products_page = page_obj.object_list
+        except:
+            page_obj = paginator.page(1)
+            products_page = page_obj.object_list
+
+        # Общее количество товаров ДО пагинации (COUNT кэшируется пагинатором)
+        total_count = paginator.count
+        pagination = {
+            'page': page_obj.number,
+            'has_next': page_obj.has_next(),
+            'has_previous': page_obj.has_previous(),
+            'num_pages': paginator.num_pages,
+            'next_cursor': None,
+        }
 
     # Рендерим отфильтрованные товары в HTML
-    html = render_to_string('partials/_store.html', {'products': products_page})
+    html = render_to_string('partials/_store.html', {'products': products_page}, request=request)
 
     # Возвращаем JSON с HTML, метаданными и информацией о пагинации
     return JsonResponse({
         'html': html,
         'product_count': total_count,
-        'page': page_obj.number,
-        'has_next': page_obj.has_next(),
-        'has_previous': page_obj.has_previous(),
-        'num_pages': paginator.num_pages,
-        'per_page': per_page
+        'per_page': per_page,
+        **pagination,
     })
 
 
@@ -1105,69 +876,26 @@ def get_filter_metadata(request):
     - Доступные размеры с количеством
     - Доступные цвета с количеством
     - Минимальная и максимальная цена
+
+    Счётчики считаются по фасетному индексу (store.facets) без запросов к БД:
+    для каждого фасета учитываются все выбранные фильтры, кроме его собственного.
     """
-    
-    # Базовый queryset опубликованных товаров
-    base_products = store_models.Product.objects.filter(status="Published")
-    
-    # Получаем текущие фильтры (для подсчета количества с учетом других фильтров)
-    current_categories = request.GET.getlist('categories[]')
-    current_brands = request.GET.getlist('brands[]')
-    current_rating = request.GET.getlist('rating[]')
-    current_sizes = request.GET.getlist('sizes[]')
-    current_colors = request.GET.getlist('colors[]')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    in_stock = request.GET.get('in_stock')
-    is_new = request.GET.get('is_new')
-    has_discount = request.GET.get('has_discount')
+    from store.facets import get_index, selection_from_request
+
+    index = get_index()
+    selection, min_price, max_price = selection_from_request(request.GET)
+
+    # Поиск не входит в фасетный индекс - ограничиваем область результатом поиска
+    restrict = None
     search_filter = request.GET.get('searchFilter')
-    
-    # Применяем все фильтры кроме того, для которого считаем метаданные
-    filtered_products = base_products
-    
-    if current_brands:
-        filtered_products = filtered_products.filter(brand__in=current_brands)
-    if current_rating:
-        rating_values = [int(r) for r in current_rating if r.isdigit()]
-        if rating_values:
-            rating_conditions = Q()
-            for r_val in rating_values:
-                rating_conditions |= Q(reviews__rating__gte=r_val)
-            filtered_products = filtered_products.filter(rating_conditions).distinct()
-    if current_sizes:
-        filtered_products = filtered_products.filter(
-            product_variants__size__in=current_sizes, 
-            product_variants__is_available=True
-        ).distinct()
-    if current_colors:
-        filtered_products = filtered_products.filter(
-            product_variants__color__in=current_colors, 
-            product_variants__is_available=True
-        ).distinct()
-    if min_price:
-        try:
-            filtered_products = filtered_products.filter(price__gte=Decimal(min_price))
-        except:
-            pass
-    if max_price:
-        try:
-            filtered_products = filtered_products.filter(price__lte=Decimal(max_price))
-        except:
-            pass
-    if in_stock == 'true':
-        filtered_products = filtered_products.filter(in_stock=True)
-    if is_new == 'true':
-        filtered_products = filtered_products.filter(is_new=True)
-    if has_discount == 'true':
-        filtered_products = filtered_products.filter(regular_price__gt=F('price'))
     if search_filter:
-        filtered_products = filtered_products.filter(
-            Q(name__icontains=search_filter) |
-            Q(description__icontains=search_filter) |
-            Q(brand__icontains=search_filter)
-        )
-    
+        restrict = set(search_product_ids(search_filter))
+
+    counts = index.counts(
+        selection, facets=('category', 'brand', 'size', 'color'),
+        restrict=restrict, price_min=min_price, price_max=max_price
+    )
+
     # Получаем метаданные
     metadata = {
         'categories': [],
@@ -1179,124 +907,98 @@ def get_filter_metadata(request):
             'max': 0
         }
     }
-    
+
     # Категории с количеством товаров
-    categories = store_models.Category.objects.annotate(
-        product_count=Count('product', filter=Q(product__status='Published'))
-    ).order_by('title')
-    
-    for cat in categories:
-        # Подсчитываем количество с учетом текущих фильтров (кроме категорий)
-        count = filtered_products.filter(category=cat).count()
+    for cat_id, title in sorted(index.labels['category'].items(), key=lambda c: c[1]):
         metadata['categories'].append({
-            'id': cat.id,
-            'title': cat.title,
-            'count': count
+            'id': cat_id,
+            'title': title,
+            'count': counts['category'].get(cat_id, 0)
         })
-    
+
     # Бренды с количеством товаров
-    brands_data = base_products.exclude(brand__isnull=True).exclude(brand='').values('brand').annotate(
-        count=Count('id')
-    ).order_by('brand')
-    
-    for brand_data in brands_data:
-        brand_name = brand_data['brand']
-        # Подсчитываем с учетом текущих фильтров (кроме брендов)
-        count = filtered_products.filter(brand=brand_name).count()
+    for brand_name in sorted(index.postings['brand']):
         metadata['brands'].append({
             'name': brand_name,
-            'count': count
+            'count': counts['brand'].get(brand_name, 0)
         })
-    
-    # Размеры с количеством товаров
-    sizes_data = {}
-    # Из Variant
-    variant_sizes = store_models.VariantItem.objects.filter(
-        variant__name='Size'
-    ).values('content').distinct()
-    for size_item in variant_sizes:
-        size_name = size_item['content']
-        if size_name:
-            count = filtered_products.filter(
-                product_variants__size=size_name, 
-                product_variants__is_available=True
-            ).distinct().count()
-            sizes_data[size_name] = count
-    
-    # Из ProductVariant
-    product_variant_sizes = store_models.ProductVariant.objects.filter(
-        is_available=True, size__isnull=False
-    ).exclude(size='').values('size').distinct()
-    for pv_size in product_variant_sizes:
-        size_name = pv_size['size']
-        if size_name and size_name not in sizes_data:
-            count = filtered_products.filter(
-                product_variants__size=size_name, 
-                product_variants__is_available=True
-            ).distinct().count()
-            sizes_data[size_name] = count
-    
-    for size_name, count in sorted(sizes_data.items()):
+
+    # Размеры с количеством товаров (из Variant и ProductVariant)
+    for size_name in sorted(index.option_postings['size']):
         metadata['sizes'].append({
             'name': size_name,
-            'count': count
+            'count': counts['size'].get(size_name, 0)
         })
-    
-    # Цвета с количеством товаров
-    colors_data = {}
-    # Из Variant
-    variant_colors = store_models.VariantItem.objects.filter(
-        variant__name='Color'
-    ).values('content', 'title').distinct()
-    for color_item in variant_colors:
-        color_name = color_item['content'] or color_item['title']
-        if color_name:
-            count = filtered_products.filter(
-                product_variants__color=color_name, 
-                product_variants__is_available=True
-            ).distinct().count()
-            colors_data[color_name] = {
-                'count': count,
-                'name': color_item['title'] or color_name
-            }
-    
-    # Из ProductVariant
-    product_variant_colors = store_models.ProductVariant.objects.filter(
-        is_available=True, color__isnull=False
-    ).exclude(color='').values('color', 'color_code').distinct()
-    for pv_color in product_variant_colors:
-        color_name = pv_color['color']
-        if color_name and color_name not in colors_data:
-            count = filtered_products.filter(
-                product_variants__color=color_name, 
-                product_variants__is_available=True
-            ).distinct().count()
-            colors_data[color_name] = {
-                'count': count,
-                'name': color_name,
-                'code': pv_color.get('color_code')
-            }
-    
-    for color_name, color_info in sorted(colors_data.items()):
+
+    # Цвета с количеством товаров (из Variant и ProductVariant)
+    for color_name in sorted(index.option_postings['color']):
+        from_variant = color_name in index.labels['color']
         metadata['colors'].append({
             'name': color_name,
-            'display_name': color_info['name'],
-            'code': color_info.get('code'),
-            'count': color_info['count']
+            'display_name': index.labels['color'].get(color_name, color_name),
+            'code': None if from_variant else index.color_codes.get(color_name),
+            'count': counts['color'].get(color_name, 0)
         })
-    
-    # Диапазон цен
-    price_stats = base_products.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
+
+    # Диапазон цен (в выбранных категориях)
+    price_stats = index.price_range(index.ids_for('category', selection['category']) if selection['category'] else None)
     metadata['price_range'] = {
         'min': float(price_stats['min_price'] or 0),
         'max': float(price_stats['max_price'] or 0)
     }
-    
+
     return JsonResponse(metadata)
 
+def search_autocomplete(request):
+    """
+    Подсказки поиска с учётом опечаток (триграммный индекс названий, см. store.search)
+    """
+    query = request.GET.get('q', '').strip()
+    suggestions = []
+    if len(query) >= 2:
+        for item in suggest(query):
+            suggestions.append({
+                'name': item['name'],
+                'brand': item['brand'],
+                'url': reverse('store:product_detail', args=[item['slug']]),
+            })
+    return JsonResponse({'suggestions': suggestions})
+
+def product_feed(request, name):
+    """
+    Фид товаров потоком из базы (store.feeds): ?since=<ISO дата> - только изменённые товары
+    Полные фиды для площадок пишет export_feeds, их отдаёт nginx; живой фид - только
+    для персонала или по токену FEEDS_TOKEN (?token=... или заголовок X-Feed-Token)
+    """
+    token = request.headers.get('X-Feed-Token') or request.GET.get('token', '')
+    # Without a configured token the live feed is staff-only
+    if not (request.user.is_staff or (settings.FEEDS_TOKEN and hmac.compare_digest(settings.FEEDS_TOKEN, token))):
+        raise PermissionDenied
+    feed = feeds.FEEDS.get(name)
+    if feed is None:
+        raise Http404
+    since = None
+    if request.GET.get('since'):
+        try:
+            since = feeds.parse_since(request.GET['since'])
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+    # Rows are generated chunk by chunk while the response is being sent
+    response = StreamingHttpResponse(feed.generate(since), content_type=feed.content_type)
+    response['Content-Disposition'] = f'inline; filename="{feed.filename}"'
+    return response
+
+def sitemap_file(request, name):
+    """Готовый файл sitemap с диска (store.sitemaps); в продакшене его отдаёт nginx"""
+    path = os.path.join(settings.SITEMAPS_DIR, name)
+    if not os.path.isfile(path):
+        raise Http404
+    return FileResponse(open(path, 'rb'))
+
+def robots_txt(request):
+    return sitemap_file(request, sitemaps.ROBOTS_FILE)
+
 def order_tracker_page(request):
     if request.method == "POST":
         item_id = request.POST.get("item_id")
@@ -0,0 +1,253 @@
+"""
+Вебхуки платёжных шлюзов
+
+Приём (представление payment_webhook) не обращается к шлюзу и не трогает заказ:
+- подпись проверяется локально (HMAC / секрет из настроек)
+- событие записывается одним INSERT ... ON CONFLICT DO NOTHING в PaymentEvent;
+  повторная доставка того же события ничего не добавляет
+- ответ 200 сразу после записи
+
+Команда process_payment_events забирает пачку событий (select_for_update
+с skip_locked - воркеров может быть несколько), загружает их заказы одним
+запросом и завершает оплату через store.payments.finalize_payment - тем же
+идемпотентным путём, что и redirect-callback, поэтому событие и возврат
+покупателя на сайт не оплачивают заказ дважды. Событие, которое не удалось
+применить, повторяется с задержкой (как письма outbox).
+Сумма и валюта платежа сверяются с заказом (payments.amount_matches): событие
+на меньшую сумму сразу отмечается Failed и заказ не меняет.
+
+PayPal не поддерживается: его подпись проверяется только запросом к API PayPal.
+"""
+import hashlib
+import hmac
+import json
+import logging
+from decimal import Decimal
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from store import models as store_models
+from store import payments
+from store.outbox import backoff
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 5
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+def _secret(name):
+    secret = getattr(settings, name, '')
+    if not secret:
+        raise InvalidSignature(f"{name} is not configured")
+    return secret
+
+
+def _check_hmac(secret, body, signature, digestmod):
+    expected = hmac.new(secret.encode(), body, digestmod).hexdigest()
+    if not signature or not hmac.compare_digest(expected, signature):
+        raise InvalidSignature("Signature mismatch")
+
+
+# ========== ПРИЁМ ==========
+# Функции проверяют подпись и возвращают (данные события, ID события, тип события)
+
+def receive_stripe(request):
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body, request.headers.get('Stripe-Signature', ''), _secret('STRIPE_WEBHOOK_SECRET'),
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        raise InvalidSignature(str(e))
+    return json.loads(request.body), event['id'], event['type']
+
+
+def receive_paystack(request):
+    _check_hmac(_secret('PAYSTACK_PRIVATE_KEY'), request.body,
+                request.headers.get('X-Paystack-Signature', ''), hashlib.sha512)
+    payload = json.loads(request.body)
+    data = payload.get('data') or {}
+    return payload, f"{payload.get('event')}:{data.get('id')}", payload.get('event', '')
+
+
+def receive_flutterwave(request):
+    secret = _secret('FLUTTERWAVE_WEBHOOK_HASH')
+    if not hmac.compare_digest(secret, request.headers.get('Verif-Hash', '')):
+        raise InvalidSignature("Signature mismatch")
+    payload = json.loads(request.body)
+    data = payload.get('data') or {}
+    return payload, f"{payload.get('event')}:{data.get('id')}", payload.get('event', '')
+
+
+def receive_razorpay(request):
+    _check_hmac(_secret('RAZORPAY_WEBHOOK_SECRET'), request.body,
+                request.headers.get('X-Razorpay-Signature', ''), hashlib.sha256)
+    payload = json.loads(request.body)
+    event_id = request.headers.get('X-Razorpay-Event-Id') or hashlib.sha256(request.body).hexdigest()
+    return payload, event_id, payload.get('event', '')
+
+
+RECEIVERS = {
+    "stripe": ("Stripe", receive_stripe),
+    "paystack": ("Paystack", receive_paystack),
+    "flutterwave": ("Flutterwave", receive_flutterwave),
+    "razorpay": ("RazorPay", receive_razorpay),
+}
+
+
+def record_event(gateway_slug, request):
+    """
+    Проверяет подпись и сохраняет событие
+
+    Raises:
+        KeyError: неизвестный шлюз
+        InvalidSignature: подпись не сошлась, секрет не настроен или тело не JSON
+    """
+    gateway, receive = RECEIVERS[gateway_slug]
+    try:
+        payload, event_id, event_type = receive(request)
+    except (ValueError, KeyError) as e:
+        raise InvalidSignature(f"Malformed payload: {e}")
+    store_models.PaymentEvent.objects.bulk_create(
+        [store_models.PaymentEvent(gateway=gateway, event_id=event_id[:255], event_type=event_type[:100], payload=payload)],
+        ignore_conflicts=True,
+    )
+
+
+# ========== ОБРАБОТКА ==========
+# Функции разбирают сохранённое событие: (order_id заказа, ID платежа, валюта,
+# сумма в основных единицах) для успешной оплаты, None для событий, которые
+# заказ не меняют
+
+def parse_stripe(payload):
+    if payload['type'] not in ('checkout.session.completed', 'checkout.session.async_payment_succeeded'):
+        return None
+    session = payload['data']['object']
+    if session.get('payment_status') != 'paid' or not session.get('client_reference_id'):
+        return None
+    return (session['client_reference_id'], session.get('payment_intent') or session['id'],
+            session.get('currency'), Decimal(session.get('amount_total') or 0) / 100)
+
+
+def parse_paystack(payload):
+    data = payload.get('data') or {}
+    if payload.get('event') != 'charge.success' or data.get('status') != 'success':
+        return None
+    order_id = (data.get('metadata') or {}).get('order_id')
+    if not order_id:
+        return None
+    return str(order_id), data['reference'], data.get('currency'), Decimal(data.get('amount') or 0) / 100
+
+
+def parse_flutterwave(payload):
+    data = payload.get('data') or {}
+    if payload.get('event') != 'charge.completed' or data.get('status') != 'successful':
+        return None
+    if not data.get('tx_ref'):
+        return None
+    return data['tx_ref'], str(data['id']), data.get('currency'), Decimal(str(data.get('amount') or 0))
+
+
+def parse_razorpay(payload):
+    if payload.get('event') != 'order.paid':
+        return None
+    entities = payload.get('payload') or {}
+    order_id = (entities['order']['entity'].get('notes') or {}).get('order_id')
+    if not order_id:
+        return None
+    payment = entities['payment']['entity']
+    return str(order_id), payment['id'], payment.get('currency'), Decimal(payment.get('amount') or 0) / 100
+
+
+PARSERS = {
+    "Stripe": parse_stripe,
+    "Paystack": parse_paystack,
+    "Flutterwave": parse_flutterwave,
+    "RazorPay": parse_razorpay,
+}
+
+
+def process_batch(limit=BATCH_SIZE):
+    """
+    Применяет пачку событий к заказам
+
+    Returns:
+        tuple: (обработано, пропущено, ошибок); событие с суммой или валютой не
+        как у заказа сразу получает статус Failed
+    """
+    processed, ignored, failed, rejected = [], [], [], []
+    with transaction.atomic():
+        events = list(
+            store_models.PaymentEvent.objects.select_for_update(skip_locked=True)
+            .filter(status="Pending", next_attempt_at__lte=timezone.now()).order_by('id')[:limit]
+        )
+        if not events:
+            return 0, 0, 0
+
+        parsed = {}
+        for event in events:
+            try:
+                parsed[event.id] = PARSERS[event.gateway](event.payload)
+            except (KeyError, TypeError, ArithmeticError) as e:
+                failed.append((event, f"Malformed event: {e!r}"))
+
+        order_ids = {result[0] for result in parsed.values() if result}
+        orders = {}
+        if order_ids:
+            orders = {order.order_id: order for order in store_models.Order.objects.filter(order_id__in=order_ids)}
+
+        for event in events:
+            if event.id not in parsed:
+                continue
+            result = parsed[event.id]
+            if result is None:
+                ignored.append(event)
+                continue
+            order_id, payment_id, currency, amount = result
+            order = orders.get(order_id)
+            if order is None:
+                failed.append((event, f"Order {order_id} not found"))
+                continue
+            try:
+                if not payments.amount_matches(order, currency, amount):
+                    # Платёж не на сумму заказа: не повторяется
+                    rejected.append((event, f"Order {order_id}: paid {amount} {currency}, order total {order.total} USD"))
+                    continue
+                outcome = payments.finalize_payment(order, event.gateway, payment_id)
+            except Exception as e:
+                logger.warning(f"Failed to apply {event.gateway} event {event.event_id}: {e}")
+                failed.append((event, repr(e)))
+                continue
+            if outcome == payments.FAILED:
+                failed.append((event, f"Order {order.order_id} is {order.payment_status}"))
+            else:
+                processed.append(event)
+
+        now = timezone.now()
+        for status, done in (("Processed", processed), ("Ignored", ignored)):
+            if done:
+                store_models.PaymentEvent.objects.filter(id__in=[event.id for event in done]).update(
+                    status=status, processed_at=now, attempts=F('attempts') + 1, last_error="",
+                )
+        for event, error in failed:
+            attempts = event.attempts + 1
+            store_models.PaymentEvent.objects.filter(id=event.id).update(
+                attempts=attempts,
+                status="Failed" if attempts >= MAX_ATTEMPTS else "Pending",
+                next_attempt_at=now + backoff(attempts),
+                last_error=error[:2000],
+            )
+        for event, error in rejected:
+            logger.warning(f"Rejected {event.gateway} event {event.event_id}: {error}")
+            store_models.PaymentEvent.objects.filter(id=event.id).update(
+                attempts=event.attempts + 1, status="Failed", processed_at=now, last_error=error[:2000],
+            )
+    return len(processed), len(ignored), len(failed) + len(rejected)